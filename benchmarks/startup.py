@@ -0,0 +1,93 @@
+"""
+
+Start-up time benchmark for the command line entry points.
+
+The CLI is often called thousands of times from shell pipelines, one short file at a time,
+so the time spent importing modules can easily dominate the actual processing.
+
+This benchmark imports each entry point module in a fresh interpreter, using `python -X importtime`,
+and fails (exit code 1) if:
+* the import time exceeds the budget, or
+* any of the "heavy" modules, which should only be imported when actually used
+    (e.g. pylatexenc, when converting LaTeX), are imported at start-up.
+
+Usage:
+    $ python -m benchmarks.startup [--budget-ms 60] [--repeat 5]
+
+
+"""
+
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# Entry point modules, {module: import time budget (ms)}:
+ENTRY_MODULES = {
+    'tts_preprocessor.common': 50,
+    'tts_preprocessor.scripts.tts_v2': 50,
+    'tts_preprocessor.latex_processing': 30,
+}
+
+# Modules that must not be imported at start-up:
+DEFERRED_MODULES = ('pylatexenc', 'yaml', 'json', 'pickle', 'multiprocessing', 'pprint', 'sqlite3')
+
+
+def parse_importtime(stderr):
+    """ Parse `-X importtime` output, returning a list of (module, cumulative_us, level) tuples. """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(cumulative), level))
+    return imports
+
+
+def run_importtime(statement):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return parse_importtime(result.stderr)
+
+
+def measure_import(module, repeat=5):
+    """ Measure the time to import module in a fresh interpreter.
+
+    Returns:
+        (best time in ms, set of modules imported by the statement)
+    """
+    # Modules imported by the interpreter itself (e.g. `site`) are not counted:
+    startup_modules = {name for name, cumulative, level in run_importtime("pass")}
+    best, imported = None, set()
+    for _ in range(repeat):
+        imports = [entry for entry in run_importtime("import %s" % (module,)) if entry[0] not in startup_modules]
+        total = sum(cumulative for name, cumulative, level in imports if level == 0) / 1000
+        imported = {name for name, cumulative, level in imports}
+        best = total if best is None else min(best, total)
+    return best, imported
+
+
+def main(argv=None):
+    ap = ArgumentParser(description="Check the import time of the command line entry points.")
+    ap.add_argument('--budget-ms', type=float, default=None,
+                    help="Import time budget (ms) for each entry point (default: per-module budgets).")
+    ap.add_argument('--repeat', type=int, default=5)
+    argns = ap.parse_args(argv)
+
+    failed = False
+    for module, budget in ENTRY_MODULES.items():
+        if argns.budget_ms is not None:
+            budget = argns.budget_ms
+        best, imported = measure_import(module, repeat=argns.repeat)
+        deferred = sorted({name.split(".")[0] for name in imported} & set(DEFERRED_MODULES))
+        ok = best <= budget and not deferred
+        print("%-40s %7.1f ms  (budget %5.1f ms)  %s" % (module, best, budget, "OK" if ok else "FAIL"))
+        if deferred:
+            print("    Modules that should be imported when needed:", ", ".join(deferred))
+        failed = failed or not ok
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
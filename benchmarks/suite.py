@@ -0,0 +1,194 @@
+"""
+
+Benchmark suite for substitution, LaTeX conversion, and the full tts_v2 pipeline.
+
+For each workload (see `benchmarks.workloads`), the suite measures:
+* latency percentiles (p50, p90, p99, in ms) over repeated runs,
+* throughput (MB/s, input size divided by the median latency), and
+* peak memory (KiB allocated by Python during a single run, measured separately using `tracemalloc`).
+
+Results are saved as JSON, which can be kept as a baseline, and compared against later runs.
+A workload is flagged as a regression if its median latency (or peak memory) increased by more than the threshold.
+
+Usage:
+    $ python -m benchmarks.suite run [--output results.json] [--filter substitute] [--repeat 10]
+    $ python -m benchmarks.suite run --output benchmarks/baselines/mymachine.json  # Save a baseline
+    $ python -m benchmarks.suite compare benchmarks/baselines/mymachine.json results.json [--threshold 0.1]
+    $ python -m benchmarks.suite run --compare benchmarks/baselines/mymachine.json  # Run and compare
+
+`compare` (and `run --compare`) exits with code 1 if any regressions were found.
+OBS: Baselines are only comparable when made on the same machine (and Python version).
+
+
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from benchmarks.workloads import WORKLOADS
+
+DEFAULT_REPEAT = 10
+DEFAULT_MIN_TIME = 1.0  # seconds; small workloads are repeated until they have run for at least this long
+MAX_ITERATIONS = 1000
+DEFAULT_THRESHOLD = 0.10  # Relative increase in median latency flagged as a regression
+DEFAULT_MEMORY_THRESHOLD = 0.25  # Relative increase in peak memory flagged as a regression
+
+
+def percentile(sorted_values, fraction):
+    """ Return the percentile of sorted_values (nearest-rank method), e.g. fraction=0.9 for p90. """
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def measure(func, nbytes, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """ Measure latency, throughput, and peak memory of func (see module docstring). """
+    func()  # Warm-up (e.g. lazy imports and regex compilation)
+    times = []
+    start = time.perf_counter()
+    while len(times) < MAX_ITERATIONS and (len(times) < repeat or time.perf_counter() - start < min_time):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    median = percentile(times, 0.5)
+    return {
+        'iterations': len(times),
+        'nbytes': nbytes,
+        'p50_ms': median * 1000,
+        'p90_ms': percentile(times, 0.9) * 1000,
+        'p99_ms': percentile(times, 0.99) * 1000,
+        'mb_per_s': nbytes / 2**20 / median if median > 0 else None,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_suite(names, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    results = {}
+    print("%-32s %8s %8s %8s %9s %10s" % ("workload", "p50 ms", "p90 ms", "p99 ms", "MB/s", "peak KiB"))
+    for name in names:
+        func, nbytes = WORKLOADS[name]()
+        try:
+            result = results[name] = measure(func, nbytes, repeat=repeat, min_time=min_time)
+        finally:
+            if hasattr(func, 'cleanup'):
+                func.cleanup()
+        print("%-32s %8.2f %8.2f %8.2f %9.2f %10.0f" % (
+            name, result['p50_ms'], result['p90_ms'], result['p99_ms'], result['mb_per_s'] or 0, result['peak_kib']))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, memory_threshold=DEFAULT_MEMORY_THRESHOLD):
+    """ Compare current results against baseline, printing a table.
+
+    Returns:
+        A list of the names of workloads with regressions.
+    """
+    regressions = []
+    if baseline['meta'].get('platform') != current['meta'].get('platform') or \
+            baseline['meta'].get('python') != current['meta'].get('python'):
+        print("Warning: Baseline was made with a different platform or Python version.")
+    print("%-32s %10s %10s %8s %8s" % ("workload", "base ms", "curr ms", "time", "memory"))
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print("%-32s %10s %10.2f  (new workload)" % (name, "-", result['p50_ms']))
+            continue
+        time_ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        memory_ratio = result['peak_kib'] / base['peak_kib'] if base['peak_kib'] else 1.0
+        flags = []
+        if time_ratio > 1 + threshold:
+            flags.append("SLOWER")
+        if memory_ratio > 1 + memory_threshold:
+            flags.append("MORE MEMORY")
+        if flags:
+            regressions.append(name)
+        print("%-32s %10.2f %10.2f %+7.1f%% %+7.1f%%  %s" % (
+            name, base['p50_ms'], result['p50_ms'], (time_ratio - 1) * 100, (memory_ratio - 1) * 100,
+            " ".join(flags)))
+    for name in baseline['results']:
+        if name not in current['results']:
+            print("%-32s  (not run)" % (name,))
+    if regressions:
+        print("%s regression(s): %s" % (len(regressions), ", ".join(regressions)))
+    else:
+        print("No regressions.")
+    return regressions
+
+
+def load_results(filename):
+    with open(filename, encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def save_results(results, filename):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, mode='w', encoding='utf-8') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+    print("Results saved to", filename)
+
+
+def main(argv=None):
+    ap = ArgumentParser(description="Benchmark suite for substitution, LaTeX conversion, and the tts_v2 pipeline.")
+    subparsers = ap.add_subparsers(dest='command')
+    ap_run = subparsers.add_parser('run', help="Run the benchmarks.")
+    ap_run.add_argument('--filter', action="append", default=[],
+                        help="Only run workloads whose name contains this string (can be given more than once).")
+    ap_run.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Minimum number of runs per workload.")
+    ap_run.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                        help="Minimum time (seconds) to repeat each workload.")
+    ap_run.add_argument('--output', help="Save results (e.g. as a new baseline) to this JSON file.")
+    ap_run.add_argument('--compare', metavar="BASELINE", help="Compare results against this baseline JSON file.")
+    ap_run.add_argument('--list', action="store_true", help="List the workloads and exit.")
+    ap_compare = subparsers.add_parser('compare', help="Compare two results files.")
+    ap_compare.add_argument('baseline')
+    ap_compare.add_argument('current')
+    for parser in (ap_run, ap_compare):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help="Flag a regression if the median latency increases by more than this fraction.")
+        parser.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD,
+                            help="Flag a regression if peak memory increases by more than this fraction.")
+    argns = ap.parse_args(argv)
+
+    if argns.command == 'compare':
+        regressions = compare(load_results(argns.baseline), load_results(argns.current),
+                              threshold=argns.threshold, memory_threshold=argns.memory_threshold)
+        return 1 if regressions else 0
+    if argns.command != 'run':
+        ap.print_help()
+        return 2
+    names = [name for name in WORKLOADS if not argns.filter or any(pattern in name for pattern in argns.filter)]
+    if argns.list:
+        print("\n".join(names))
+        return 0
+    results = run_suite(names, repeat=argns.repeat, min_time=argns.min_time)
+    if argns.output:
+        save_results(results, argns.output)
+    if argns.compare:
+        regressions = compare(load_results(argns.compare), results,
+                              threshold=argns.threshold, memory_threshold=argns.memory_threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+
+Representative workloads for the benchmark suite (see `benchmarks.suite`).
+
+Inputs are synthetic, but generated deterministically (from a fixed seed), so the same workload
+gives the same input on every run and every machine:
+
+* .txt, .tex, and .html documents, built from a vocabulary containing the kind of tokens
+    that the shipped `default_*` directives replace (units, Greek letters, abbreviations, markup, etc.),
+* a synthetic lexicon with 10k entries (mostly fixed strings, some regexes),
+    and text where some of the words are lexicon entries,
+* the same kind of lexicon (10k and 100k entries) as a token-trie `lexicon_processing.Lexicon`.
+
+Each workload is a function `setup() -> (func, nbytes)`, where `func()` runs the workload once,
+and `nbytes` is the input size (used to calculate throughput).
+Setup (generating input, loading and compiling directives) is not included in the measurements.
+
+
+"""
+
+import io
+import os
+import random
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+
+from tts_preprocessor.pattern_utils import CompiledDirective, ReplacementTuple, substitute_patterns, FIXED_TYPE, \
+    REGEX_TYPE
+from tts_preprocessor.directives import REGISTERED_TRANSFORMATIONS
+
+SEED = 42
+SMALL_SIZE = 2**13  # characters
+LARGE_SIZE = 2**20
+LARGE_TEX_SIZE = 2**17  # pylatexenc is much slower than the regex directives
+LARGE_LEXICON_SIZE = 2**16  # A 10k-entry lexicon is applied in ~1000 passes (its fixed-string runs are short)
+LEXICON_SIZE = 10000
+LARGE_LEXICON_ENTRIES = 100000
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but have "
+    "an they you were her she there been one all we their has would when if so no will can more about "
+    "protein sample buffer solution concentration temperature measured observed structure binding").split()
+TXT_TOKENS = (
+    "e.g.", "i.e.", "etc.", "vs.", "Fig. 2", "Dr. Smith", "5 nm", "10 um", "2 μM", "Å", "α-helix", "β-sheet",
+    "Δ", "37 °C", "1990s", "3'-end", "(see ref. [12])", "---", "5'", "p < 0.05", "~10", "±2")
+HTML_TOKENS = (
+    "&amp;", "&nbsp;", "&lt;", "&gt;", '<a href="http://example.com/page">link</a>', "<b>bold</b>", "<i>it</i>",
+    "<span class=\"x\">span</span>", "<br/>", "<sup>2</sup>", "<sub>i</sub>")
+TEX_TOKENS = (
+    r"\emph{important}", r"\textbf{bold}", r"\cite{smith2010}", r"\ref{fig:1}", r"$\alpha + \beta$",
+    r"$x^2$", r"\%", r"\&", "~", "``quoted''", r"\footnote{A note.}", r"$\Delta G$", "--")
+
+
+def make_paragraph(rng, tokens, n_words=60, token_fraction=0.15):
+    words = [rng.choice(tokens) if rng.random() < token_fraction else rng.choice(WORDS) for _ in range(n_words)]
+    # Wrap lines at ~10 words:
+    return "\n".join(" ".join(words[i:i+10]) for i in range(0, len(words), 10))
+
+
+def make_txt(size, tokens=TXT_TOKENS, seed=SEED):
+    rng = random.Random(seed)
+    paragraphs, length = [], 0
+    while length < size:
+        paragraphs.append(make_paragraph(rng, tokens))
+        length += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs) + "\n"
+
+
+def make_html(size, seed=SEED):
+    rng = random.Random(seed)
+    parts = ["<html><head><title>Benchmark</title></head>\n<body>\n"]
+    length = 0
+    while length < size:
+        if rng.random() < 0.1:
+            parts.append("<h2>%s</h2>\n" % (make_paragraph(rng, TXT_TOKENS, n_words=5),))
+        parts.append("<p>%s</p>\n\n" % (make_paragraph(rng, TXT_TOKENS + HTML_TOKENS),))
+        length += len(parts[-1])
+    parts.append("</body></html>\n")
+    return "".join(parts)
+
+
+def make_tex(size, seed=SEED):
+    rng = random.Random(seed)
+    parts = ["\\documentclass{article}\n\\begin{document}\n\n"]
+    length = 0
+    while length < size:
+        if rng.random() < 0.1:
+            parts.append("\\section{%s}\n\n" % (make_paragraph(rng, WORDS, n_words=4),))
+        parts.append(make_paragraph(rng, TEX_TOKENS) + "\n% A comment line\n\n")
+        length += len(parts[-1])
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+
+def make_lexicon(n_entries=LEXICON_SIZE, seed=SEED):
+    """ Make a synthetic lexicon (list of ReplacementTuples): 90% fixed-string and 10% regex entries. """
+    rng = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    ops, seen = [], set()
+    while len(ops) < n_entries:
+        abbr = "".join(rng.choice(letters) for _ in range(rng.randint(2, 4))) + str(rng.randint(0, 99))
+        if abbr in seen:
+            continue
+        seen.add(abbr)
+        expansion = " ".join(rng.choice(WORDS) for _ in range(3))
+        if rng.random() < 0.1:
+            ops.append(ReplacementTuple(r"\b%s\b" % (abbr,), " %s " % (expansion,), REGEX_TYPE, None))
+        else:
+            ops.append(ReplacementTuple(abbr, " %s " % (expansion,), FIXED_TYPE, None))
+    return ops
+
+
+def lexicon_text(lexicon, size, seed=SEED):
+    """ Make text where ~10% of the words are lexicon entries. """
+    terms = tuple(op.search_pat.replace(r"\b", "") for op in lexicon[::10])
+    return make_txt(size, tokens=terms, seed=seed)
+
+
+def nbytes(text):
+    return len(text.encode('utf-8'))
+
+
+def directive_workload(directive_name, make_input, size):
+    def setup():
+        directive = REGISTERED_TRANSFORMATIONS[directive_name]
+        text = make_input(size)
+        return (lambda: substitute_patterns(text, directive)), nbytes(text)
+    return setup
+
+
+def lexicon_workload(size):
+    def setup():
+        directive = CompiledDirective(make_lexicon(), name="lexicon")
+        text = lexicon_text(directive.ops, size)
+        return (lambda: substitute_patterns(text, directive)), nbytes(text)
+    return setup
+
+
+def token_lexicon_workload(size, n_entries=LEXICON_SIZE):
+    def setup():
+        from tts_preprocessor.lexicon_processing import Lexicon
+        entries = [ReplacementTuple(op.search_pat.replace(r"\b", ""), op.replace_pat, FIXED_TYPE)
+                   for op in make_lexicon(n_entries)]
+        lexicon = Lexicon(entries, name="lexicon", options={'lexicon': True})
+        text = lexicon_text(entries, size)
+        return (lambda: lexicon(text)), nbytes(text)
+    return setup
+
+
+def lexicon_compile_workload():
+    def setup():
+        lexicon = make_lexicon()
+        return (lambda: CompiledDirective(lexicon, name="lexicon")), sum(nbytes(op.search_pat) for op in lexicon)
+    return setup
+
+
+def latex_workload(size, engine="pylatexenc"):
+    def setup():
+        from tts_preprocessor.latex_processing import LATEX_ENGINES
+        text = make_tex(size)
+        converter = LATEX_ENGINES[engine][0]()  # Create the default converter (part of setup)
+        return (lambda: converter.convert(text)), nbytes(text)
+    return setup
+
+
+def html_extract_workload(size):
+    def setup():
+        from tts_preprocessor.html_processing import extract_text_blocks
+        text = make_html(size)
+        return (lambda: sum(1 for block in extract_text_blocks(io.StringIO(text)))), nbytes(text)
+    return setup
+
+
+def pipeline_workload(n_small=20):
+    """ tts_v2.process_all_inputfiles() with a mix of small and large .txt/.html/.tex files (including file I/O). """
+    def setup():
+        from tts_preprocessor.scripts.tts_v2 import process_all_inputfiles
+        tmpdir = tempfile.mkdtemp(prefix="tts_benchmark_")
+        inputs = {"large.txt": make_txt(LARGE_SIZE), "large.html": make_html(LARGE_SIZE),
+                  "small.tex": make_tex(SMALL_SIZE)}
+        for i in range(n_small):
+            inputs["small%02d.txt" % (i,)] = make_txt(SMALL_SIZE, seed=SEED + i)
+        groups = {}  # {extension: [inputfile, ...]}; default directives are selected from the first file
+        for filename, text in inputs.items():
+            path = os.path.join(tmpdir, filename)
+            with open(path, mode='w', encoding='utf-8') as fp:
+                fp.write(text)
+            groups.setdefault(os.path.splitext(filename)[1], []).append(path)
+        outputfnfmt = os.path.join(tmpdir, "out", "{fnbasename}")
+        os.makedirs(os.path.dirname(outputfnfmt))
+
+        def run():
+            with redirect_stdout(io.StringIO()):
+                for inputfiles in groups.values():
+                    process_all_inputfiles(inputfiles, directives=None, outputfnfmt=outputfnfmt)
+
+        run.cleanup = lambda: shutil.rmtree(tmpdir, ignore_errors=True)
+        return run, sum(nbytes(text) for text in inputs.values())
+    return setup
+
+
+# Workloads, {name: setup function}:
+WORKLOADS = {
+    'substitute.default_txt.small': directive_workload('default_txt', make_txt, SMALL_SIZE),
+    'substitute.default_txt.large': directive_workload('default_txt', make_txt, LARGE_SIZE),
+    'substitute.default_html.small': directive_workload('default_html', make_html, SMALL_SIZE),
+    'substitute.default_html.large': directive_workload('default_html', make_html, LARGE_SIZE),
+    'substitute.default_tex.small': directive_workload('default_tex', make_tex, SMALL_SIZE),
+    'substitute.default_tex.large': directive_workload('default_tex', make_tex, LARGE_SIZE),
+    'substitute.lexicon10k.small': lexicon_workload(SMALL_SIZE),
+    'substitute.lexicon10k.large': lexicon_workload(LARGE_LEXICON_SIZE),
+    'compile.lexicon10k': lexicon_compile_workload(),
+    'token_lexicon.lexicon10k.large': token_lexicon_workload(LARGE_SIZE),
+    'token_lexicon.lexicon100k.large': token_lexicon_workload(LARGE_SIZE, LARGE_LEXICON_ENTRIES),
+    'pylatexenc.small': latex_workload(SMALL_SIZE),
+    'pylatexenc.large': latex_workload(LARGE_TEX_SIZE),
+    'latex_fast.small': latex_workload(SMALL_SIZE, engine="fast"),
+    'latex_fast.large': latex_workload(LARGE_SIZE, engine="fast"),
+    'html_extract.small': html_extract_workload(SMALL_SIZE),
+    'html_extract.large': html_extract_workload(LARGE_SIZE),
+    'pipeline.tts_v2': pipeline_workload(),
+}
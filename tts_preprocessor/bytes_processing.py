@@ -0,0 +1,326 @@
+"""
+
+Memory-mapped, bytes-level processing of large UTF-8 (or ASCII) files (the `--mmap` command line option).
+
+The regular path reads the whole file, decodes it to a str (which takes up to 4 bytes per character,
+if the text contains a single character outside Latin-1), applies each op (creating a new str each time),
+and encodes the result again when writing. For multi-GB files, the data is then held and copied several times.
+
+Instead, the input file is memory-mapped, and the directive steps are applied directly to the UTF-8 bytes:
+* Fixed-string ops use `bytes.replace()` (with UTF-8 encoded search and replacement strings),
+    and single-pass multi-string replacements use the same trie regex as for str (see `multi_replace`),
+* Regex ops use a bytes version of the regex (see `regex_analysis.bytes_regex()`), if it matches
+    UTF-8 text the same way as the str regex matches the decoded text.
+Steps that need str semantics (e.g. regexes using `\\w` or `.`), and transformations that are not
+CompiledDirectives (e.g. lexicons, `pylatexenc`), fall back to the str path: the data is decoded,
+the (consecutive) str steps are applied, and the result is encoded again.
+
+If all transformations are local (see `streaming`), the mapped file is processed in paragraph-aligned blocks,
+each block is written to the output file as soon as it is transformed, and the pages of the mapped file
+are released after use. Memory use is then proportional to the block size, rather than to the size of the file.
+Otherwise, the whole file is transformed at once (still without decoding it, unless a str step needs to).
+
+The output is the same as for the regular path, which is only guaranteed for UTF-8 input and output,
+and for files without carriage returns (which the regular path reads as newlines), see `mmap_unsupported()`.
+Input that is not valid UTF-8 is passed through by bytes steps (the regular path fails to decode it).
+
+
+"""
+
+import codecs
+import mmap
+import os
+import re
+
+from tts_preprocessor.pattern_utils import CompiledDirective, FixedStringOp, GuardedFixedStringOps, RegexOp
+from tts_preprocessor.pattern_utils import FusedRegexOp, MultiFixedStringOp
+from tts_preprocessor.multi_replace import MultiReplacer
+from tts_preprocessor.regex_analysis import bytes_regex
+from tts_preprocessor.streaming import DEFAULT_BLOCKSIZE, is_local
+from tts_preprocessor import profiling
+
+
+def encode_parts(parts):
+    """ Encode the literal strings of parsed replacement template parts (see `pattern_utils`) as UTF-8. """
+    return [part.encode('utf-8') if isinstance(part, str) else part for part in parts]
+
+
+def bytes_template_repl(parts):
+    """ Create a `repl` argument for `regex.sub()` from encoded template parts (see `template_parts_to_repl()`). """
+    if not any(isinstance(part, int) for part in parts):
+        literal = b"".join(parts)
+        if b"\\" not in literal:
+            return literal
+        return lambda match: literal
+
+    def expand(match):
+        return b"".join([part if isinstance(part, bytes) else (match.group(part) or b"") for part in parts])
+    return expand
+
+
+def non_ascii(literals):
+    """ Return True if all the (bytes) literals contain non-ASCII characters (so they never occur in ASCII text). """
+    return bool(literals) and not any(literal.isascii() for literal in literals)
+
+
+def bytes_prefilter(prefilter):
+    return None if prefilter is None else tuple(literal.encode('utf-8') for literal in prefilter)
+
+
+class BytesFixedStringOps:
+    """ Fixed-string ops (FixedStringOp or GuardedFixedStringOps) applied to bytes. """
+
+    def __init__(self, step):
+        self.step = step
+        operations = [step.operation] if isinstance(step, FixedStringOp) else step.operations
+        self.pairs = [(op.search_pat.encode('utf-8'), (op.replace_pat or "").encode('utf-8')) for op in operations]
+        self.guard = step.guard.encode('utf-8') if isinstance(step, GuardedFixedStringOps) else None
+        self.non_ascii = non_ascii([search for search, replace in self.pairs])
+
+    def __call__(self, data):
+        if self.guard is not None and self.guard not in data:
+            return data
+        for search, replace in self.pairs:
+            data = data.replace(search, replace)
+        return data
+
+    def describe(self):
+        return self.step.describe()
+
+
+class BytesMultiReplacer(MultiReplacer):
+    """ A MultiReplacer for bytes (see `multi_replace`).
+
+    The trie regex is built for the search strings' UTF-8 bytes (decoded as Latin-1, one character per byte),
+    and then compiled as a bytes regex.
+    """
+
+    def __init__(self, pairs):
+        super().__init__([(search.decode('latin-1'), replace.decode('latin-1')) for search, replace in pairs])
+        self.table = {search.encode('latin-1'): replace.encode('latin-1') for search, replace in self.table.items()}
+        self.priority = {search.encode('latin-1'): prio for search, prio in self.priority.items()}
+        self.regex = re.compile(self.regex.pattern.encode('latin-1'))
+        if self.overlapping:
+            self.lookahead_regex = re.compile(self.lookahead_regex.pattern.encode('latin-1'))
+
+
+class BytesMultiFixedStringOp:
+    """ A MultiFixedStringOp applied to bytes. """
+
+    def __init__(self, step):
+        self.step = step
+        self.replacer = BytesMultiReplacer(
+            [(op.search_pat.encode('utf-8'), (op.replace_pat or "").encode('utf-8')) for op in step.operations])
+        self.non_ascii = non_ascii(self.replacer.table)
+
+    def __call__(self, data):
+        return self.replacer(data)
+
+    def describe(self):
+        return self.step.describe()
+
+
+class BytesRegexOp:
+    """ A RegexOp or FusedRegexOp applied to bytes, using the bytes version of its regex. """
+
+    def __init__(self, step, regex):
+        self.step = step
+        self.regex = regex
+        self.prefilter = bytes_prefilter(step.prefilter)
+        self.non_ascii = non_ascii(self.prefilter)
+        if isinstance(step, FusedRegexOp):
+            self.dispatch = {index: encode_parts(parts) for index, parts in step.dispatch.items()}
+            self.repl = self.fused_repl
+        else:
+            self.repl = bytes_template_repl(encode_parts(step.template_parts))
+
+    def fused_repl(self, match):
+        return b"".join([part if isinstance(part, bytes) else (match.group(part) or b"")
+                         for part in self.dispatch[match.lastindex]])
+
+    def __call__(self, data):
+        if self.prefilter is not None and not any(literal in data for literal in self.prefilter):
+            return data
+        return self.regex.sub(self.repl, data)
+
+    def describe(self):
+        return self.step.describe()
+
+
+def bytes_step(step):
+    """ Convert a directive step (see `CompiledDirective.steps`) to a step applied to UTF-8 bytes.
+
+    Returns:
+        A callable bytes -> bytes, or None if the step needs str semantics.
+    """
+    if isinstance(step, (FixedStringOp, GuardedFixedStringOps)):
+        operations = [step.operation] if isinstance(step, FixedStringOp) else step.operations
+        if all(op.search_pat for op in operations):  # (Replacing "" inserts text between characters)
+            return BytesFixedStringOps(step)
+    elif isinstance(step, MultiFixedStringOp):
+        return BytesMultiFixedStringOp(step)
+    elif isinstance(step, (RegexOp, FusedRegexOp)):
+        regex = bytes_regex(step.regex)
+        if regex is not None:
+            return BytesRegexOp(step, regex)
+    return None
+
+
+class StrSteps:
+    """ Consecutive steps (or transformations) that need str semantics: decode, apply the steps, and encode. """
+
+    non_ascii = False
+
+    def __init__(self):
+        self.steps = []
+
+    def __call__(self, data):
+        text = codecs.decode(data, 'utf-8')
+        for step in self.steps:
+            text = step(text)
+        return text.encode('utf-8')
+
+    def describe(self):
+        return "Decoding to str for %s steps: %s" % (len(self.steps), "; ".join(
+            step.describe() if hasattr(step, 'describe') else profiling.Profiler.transform_name(step)
+            for step in self.steps))
+
+
+class BytesChain:
+    """ A chain of transformations, applied to UTF-8 bytes (see module docstring).
+
+    The steps of CompiledDirectives are converted to bytes steps where possible (see `bytes_step()`),
+    and everything else is applied as str.
+    """
+
+    def __init__(self, transformations):
+        self.local = all(is_local(transform) for transform in transformations)
+        self.steps = []
+        self.bytes_steps = self.str_steps = 0
+        for transform in transformations:
+            if isinstance(transform, CompiledDirective):
+                steps = [(step, bytes_step(step)) for step in transform.steps]
+            else:
+                steps = [(transform, None)]
+            for step, converted in steps:
+                if converted is not None:
+                    self.steps.append(converted)
+                    self.bytes_steps += 1
+                    continue
+                if not self.steps or not isinstance(self.steps[-1], StrSteps):
+                    self.steps.append(StrSteps())
+                self.steps[-1].steps.append(step)
+                self.str_steps += 1
+
+    def __call__(self, data):
+        # Like str ops (which check the string's kind first), skip steps that can only match non-ASCII text:
+        ascii = data.isascii()
+        for step in self.steps:
+            if ascii and step.non_ascii:
+                continue
+            result = step(data)
+            if ascii and result is not data:
+                ascii = result.isascii()
+            data = result
+        return data
+
+    def report(self, verbose=0):
+        lines = ["Bytes path: %s steps applied to bytes, %s applied as str (in %s runs)." % (
+            self.bytes_steps, self.str_steps, sum(isinstance(step, StrSteps) for step in self.steps))]
+        if verbose > 1:
+            lines.extend("    " + step.describe() for step in self.steps if isinstance(step, StrSteps))
+        return "\n".join(lines)
+
+
+_BYTES_CHAINS = {}  # {ids of transformations: (transformations, BytesChain)}
+
+
+def get_bytes_chain(transformations):
+    """ Get a BytesChain for transformations, re-using the chain created for the same transformations, if any. """
+    key = tuple(id(transform) for transform in transformations)
+    if key not in _BYTES_CHAINS:
+        _BYTES_CHAINS[key] = (list(transformations), BytesChain(transformations))
+    return _BYTES_CHAINS[key][1]
+
+
+def is_utf8(encoding):
+    return codecs.lookup(encoding).name == 'utf-8'
+
+
+def mmap_unsupported(inputencoding, outputencoding):
+    """ Return the reason the bytes path cannot give the same output as the regular path, or None. """
+    if not (is_utf8(inputencoding) and is_utf8(outputencoding)):
+        return "input and output encodings must be UTF-8"
+    if os.linesep != "\n":
+        return "the regular path writes newlines as %r" % (os.linesep,)
+    if profiling.ACTIVE_PROFILER is not None:
+        return "profiling"
+    return None
+
+
+def block_ranges(buffer, blocksize=DEFAULT_BLOCKSIZE):
+    """ Split buffer in paragraph-aligned blocks (like `streaming.read_blocks()`), yielding (start, end) ranges. """
+    pos, size = 0, len(buffer)
+    while pos < size:
+        end = pos + blocksize
+        if end >= size:
+            end = size
+        else:
+            boundary = buffer.rfind(b"\n\n", pos, end)
+            if boundary != -1:
+                end = boundary + 2
+            else:
+                # After the last newline, or if the block has none, the next newline:
+                end = (buffer.rfind(b"\n", pos, end) + 1 or buffer.find(b"\n", end) + 1) or size
+        yield pos, end
+        pos = end
+
+
+def release_pages(mapped, start, end):
+    """ Release the (fully used) pages of the mapped file between start and end from memory. """
+    if not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    start -= start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if end > start:
+        mapped.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def mapped_find(mapped, sub, blocksize=DEFAULT_BLOCKSIZE):
+    """ Find sub (a single byte) in the mapped file, block by block, releasing the pages of each block after use. """
+    for start in range(0, len(mapped), blocksize):
+        pos = mapped.find(sub, start, start + blocksize)
+        release_pages(mapped, start, start + blocksize)
+        if pos != -1:
+            return pos
+    return -1
+
+
+def mmap_transform(inputfile, outputfn, chain, blocksize=DEFAULT_BLOCKSIZE):
+    """ Memory-map inputfile, apply chain (a BytesChain), and write the result to outputfn.
+
+    If the chain is local, the file is transformed and written block by block.
+    The output is written to a temporary file, which replaces outputfn when the input file is closed
+    (outputfn may be inputfile, which must not be truncated while it is mapped).
+
+    Returns:
+        False (without writing the output file) if the file contains carriage returns, otherwise True.
+    """
+    tmpfn = outputfn + ".tmp"
+    with open(inputfile, mode='rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            with open(tmpfn, mode='wb') as outfp:
+                outfp.write(chain(b""))
+        else:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped_find(mapped, b"\r", blocksize=blocksize) != -1:
+                    return False
+                with open(tmpfn, mode='wb') as outfp:
+                    if not chain.local:
+                        outfp.write(chain(mapped[:]))
+                    else:
+                        for start, end in block_ranges(mapped, blocksize=blocksize):
+                            outfp.write(chain(mapped[start:end]))
+                            release_pages(mapped, start, end)
+    os.replace(tmpfn, outputfn)
+    return True
@@ -26,31 +26,68 @@ Obsolete nomenclature / not used:
 """
 
 import os
-from pprint import pprint
+import sys
 from argparse import ArgumentParser
 
 # from .data import DEFAULT_FILE_DIRECTIVES
-from tts_preprocessor.directives import REGISTERED_DIRECTIVE_DEFS, DEFAULT_FILE_DIRECTIVES
-from .pattern_utils import load_patterns, substitute_patterns
+from tts_preprocessor.directives import REGISTERED_TRANSFORMATIONS, DEFAULT_FILE_DIRECTIVES
+from tts_preprocessor.directives import DIRECTIVE_CACHE, rebuild_directive_cache
+from .lexicon_processing import compile_directive
+from .streaming import DEFAULT_BLOCKSIZE, is_local, stream_transform
+from .parallel import process_files_in_pool, process_files_serially
+from .profiling import Profiler, profiling, DEFAULT_TOP
+from .manifest import Manifest, chain_fingerprint, file_hash, write_if_changed, replace_if_changed
+from .encoding_utils import resolve_encoding, AUTO_ENCODING
 
 
 def default_argparser(**ap_kwargs):
     ap = ArgumentParser(**ap_kwargs)
 
-    ap.add_argument('inputfiles', nargs='+')  # Only one? Or maybe multiple?
+    ap.add_argument('inputfiles', nargs='*')  # Only one? Or maybe multiple?
     ap.add_argument('--patternsfile')
     ap.add_argument('-d', '--named-directive', nargs="+", action="append")  # Use standard/default named directives
     # ap.add_argument('--patternsformat')  # how to load patternsfile; yaml/json/txt/tsv/csv; default: tsv
     ap.add_argument('--outputfnfmt', default="{fnroot}.out{fnext}")
-    ap.add_argument('--inputencoding', default='utf-8')
+    ap.add_argument('--inputencoding', default='utf-8',
+                    help="The encoding of the input files ('auto': detect the encoding of each file).")
     ap.add_argument('--outputencoding', default='utf-8')
+    ap.add_argument('--streaming', action="store_true",
+                    help="Read, transform, and write large files in paragraph-aligned blocks, to limit memory usage. "
+                         "Only used if all directives are local; otherwise the whole file is processed at once.")
+    ap.add_argument('--blocksize', type=int, default=DEFAULT_BLOCKSIZE,
+                    help="Block size (in characters) used for --streaming.")
+    ap.add_argument('-j', '--jobs', type=int, default=1,
+                    help="Number of worker processes used to process input files in parallel (0: one per CPU core).")
+    ap.add_argument('--incremental', action="store_true",
+                    help="Skip input files whose outputs are up to date, according to the manifest in the output "
+                         "directory (input hash, directive fingerprint, encodings, output hash), "
+                         "and only rewrite changed outputs.")
+    ap.add_argument('--profile', action="store_true",
+                    help="Profile the directives: Record time, matches, and bytes in/out for each op (and "
+                         "transformation), and print a report of the slowest. Files are processed serially.")
+    ap.add_argument('--profile-top', type=int, default=DEFAULT_TOP, metavar="N",
+                    help="Number of directive ops shown in the --profile report.")
+    ap.add_argument('--profile-json', metavar="FILE", help="Also save the full --profile statistics as JSON.")
+    ap.add_argument('--rebuild-cache', action="store_true",
+                    help="Re-parse and validate all patterns files in the directive directories (and any given "
+                         "as directive files), updating the directive cache. Input files are optional.")
     ap.add_argument('--verbose', action="count", default=0)
     # argns = ap.parse_args()  # args, namespace
 
     return ap
 
 
-def process_file(inputfile, directives, outputfnfmt=None, inputencoding=None, outputencoding=None, verbose=0):
+def process_file(inputfile, directives, outputfnfmt=None, inputencoding=None, outputencoding=None, verbose=0,
+                 streaming=False, blocksize=DEFAULT_BLOCKSIZE, manifest=None):
+    """ Process a single input file, writing the result to the output file given by outputfnfmt.
+
+    If a manifest is given (see `manifest.Manifest`), the file is skipped if its output is up to date,
+    and the output file is only written if its content changes.
+    With inputencoding="auto", the encoding of the file is detected (see `encoding_utils`).
+
+    Returns:
+        (outputfn, manifest_entry) if a manifest is given and the file was processed, otherwise None.
+    """
     if inputencoding is None:
         inputencoding = 'utf-8'
     if outputencoding is None:
@@ -59,6 +96,36 @@ def process_file(inputfile, directives, outputfnfmt=None, inputencoding=None, ou
     fnbasename = os.path.basename(inputfile)
     fnbase_noext = os.path.basename(fnroot)
     fndir = os.path.dirname(inputfile)
+    outputfn = outputfnfmt.format(
+        inputfile=inputfile, fnroot=fnroot, fnext=fnext, fnbasename=fnbasename, fndir=fndir, fnbase_noext=fnbase_noext,
+        cwd=os.getcwd())
+    inputencoding = resolve_encoding(inputfile, inputencoding)
+    if outputencoding == AUTO_ENCODING:
+        outputencoding = inputencoding
+    encodings = (inputencoding, outputencoding)  # Recorded in the manifest, as they affect the output
+    if manifest is not None:
+        input_hash = file_hash(inputfile)
+        if manifest.is_current(outputfn, input_hash, encodings=encodings):
+            print("Skipping unchanged file:", inputfile)
+            return None
+    if streaming and not all(is_local(transform) for transform in directives):
+        print("Directives are not all local; processing the whole file at once.")
+        streaming = False
+    if streaming:
+        # Write to a temporary file (the output file may be the input file), and then replace the output file
+        # (with a manifest, only if it has changed):
+        streamfn = outputfn + ".tmp"
+        with open(inputfile, encoding=inputencoding) as infp, \
+                open(streamfn, mode='w', encoding=outputencoding) as outfp:
+            print("Reading file:", inputfile)
+            print("Writing file:", outputfn)
+            stream_transform(infp, outfp, directives, blocksize=blocksize)
+        if manifest is not None:
+            output_hash = replace_if_changed(streamfn, outputfn)
+            return outputfn, manifest.make_entry(inputfile, input_hash, output_hash, encodings=encodings)
+        os.replace(streamfn, outputfn)
+        return None
+
     with open(inputfile, encoding=inputencoding) as fp:
         print("Reading file:", inputfile)
         content = fp.read()
@@ -67,7 +134,7 @@ def process_file(inputfile, directives, outputfnfmt=None, inputencoding=None, ou
     # print()
     for directive_def in directives:
         print(directive_def)
-        content = substitute_patterns(content, directive_def, verbose=verbose)
+        content = directive_def(content, verbose=verbose)
     # filepath = /mydirectory/myfile.ext
     # basename = myfile.ext  (or sometimes just `myfile` - os.path.basename() returns WITH extension)
     # filename = myfile.ext  (or sometimes just `myfile` and other times the whole filepath)
@@ -75,9 +142,10 @@ def process_file(inputfile, directives, outputfnfmt=None, inputencoding=None, ou
     # so what to call `myfile`?
     # It is rootname of basename (and also basename of rootname)... So maybe baseroot(name) or rootbase(name)?
     # Or maybe just use `fnbase_noext` (for basename with no extension).
-    outputfn = outputfnfmt.format(
-        inputfile=inputfile, fnroot=fnroot, fnext=fnext, fnbasename=fnbasename, fndir=fndir, fnbase_noext=fnbase_noext,
-        cwd=os.getcwd())
+    if manifest is not None:
+        print("Writing file:", outputfn)
+        output_hash = write_if_changed(outputfn, content, outputencoding)
+        return outputfn, manifest.make_entry(inputfile, input_hash, output_hash, encodings=encodings)
     with open(outputfn, mode='w', encoding=outputencoding) as fp:
         print("Writing file:", outputfn)
         fp.write(content)
@@ -96,11 +164,14 @@ def select_directives(patternsfile, named_directives, inputfile):
         inputfile:
 
     Returns:
+        A list of transformations (CompiledDirectives, or Lexicons for patterns files with the `lexicon` option),
+        compiled with the options of their patterns files (e.g. `sequential`, `local`, `optimize`).
 
     OBS: This depends on `data` module, `data` module depends on `pattern_utils`. Keep func here to void circular refs.
     """
     if patternsfile is not None:
-        directive_defs = [load_patterns(patternsfile)]
+        name, directive_ops, options = DIRECTIVE_CACHE.load_patterns_defs(patternsfile)
+        directives = [compile_directive(directive_ops, name=name, options=options)]
     else:
         if not named_directives:
             fnbase, fnext = os.path.splitext(inputfile)
@@ -112,34 +183,69 @@ def select_directives(patternsfile, named_directives, inputfile):
                 named_directives = DEFAULT_FILE_DIRECTIVES["txt"]
                 print("Could not determine which directive(s) to use; defaulting to %s patterns directive."
                       % (named_directives,))
-        # print(named_directives)
-        # print("\n\nREGISTERED_DIRECTIVE_DEFS:")
-        # pprint(REGISTERED_DIRECTIVE_DEFS)
-        # print("\n\n")
+        # The registered transformations are compiled with their options (see `directives`):
+        directives = [REGISTERED_TRANSFORMATIONS[name] for name in named_directives]
+    return directives
+
 
-        directive_defs = [REGISTERED_DIRECTIVE_DEFS[name] for name in named_directives]
-        # print("\n\ndirective_defs:")
-        # print(directive_defs)
-        # print("\n\n")
-    return directive_defs
+def compile_directives(patternsfile, named_directives, inputfile):
+    """ Select the directives to use, compiled with their options (see `select_directives()`). """
+    return select_directives(patternsfile, named_directives=named_directives, inputfile=inputfile)
 
 
 def process_all_inputfiles(
         inputfiles, patternsfile, named_directives, outputfnfmt,
-        inputencoding=None, outputencoding=None, verbose=0):
-    directives = select_directives(patternsfile, named_directives=named_directives, inputfile=inputfiles[0])
+        inputencoding=None, outputencoding=None, verbose=0, streaming=False, blocksize=DEFAULT_BLOCKSIZE,
+        jobs=1, incremental=False):
+    """ Process all input files, returning a list of (inputfile, error) for files that could not be processed.
+
+    With incremental=True, input files whose outputs are up to date are skipped (see `manifest`).
+
+    With jobs != 1, files are processed in parallel by a pool of worker processes (see `parallel`).
+    """
+    # Compile once, rather than once per input file:
+    directives = compile_directives(patternsfile, named_directives=named_directives, inputfile=inputfiles[0])
     # print("\nDirectives: (type: %s)" % (type(directives),))
     # pprint.pprint(directives)
     # print(directives)
-    for inputfn in inputfiles:
-        process_file(
-            inputfn,
-            directives,
+    manifest = Manifest(chain_fingerprint(directives)) if incremental else None
+
+    def record(result):
+        if result is not None:
+            manifest.record(*result)
+
+    if jobs != 1:
+        errors = process_files_in_pool(
+            process_file, inputfiles,
+            chain_factory=compile_directives, factory_args=(patternsfile, named_directives, inputfiles[0]),
+            jobs=jobs,
+            on_result=record,
+            verbose=verbose,
             outputfnfmt=outputfnfmt,
             inputencoding=inputencoding,
             outputencoding=outputencoding,
-            verbose=verbose,
+            streaming=streaming,
+            blocksize=blocksize,
+            manifest=manifest,
         )
+        if incremental:
+            manifest.save()
+        return errors
+    errors = process_files_serially(
+        process_file, inputfiles,
+        on_result=record,
+        directives=directives,
+        outputfnfmt=outputfnfmt,
+        inputencoding=inputencoding,
+        outputencoding=outputencoding,
+        verbose=verbose,
+        streaming=streaming,
+        blocksize=blocksize,
+        manifest=manifest,
+    )
+    if incremental:
+        manifest.save()
+    return errors
 
 
 def main(argv=None, argns=None):
@@ -160,16 +266,40 @@ def main(argv=None, argns=None):
     named_directives = argns.named_directive
     if named_directives is not None:
         named_directives = [directive for nargs in argns.named_directive for directive in nargs]
-    process_all_inputfiles(
-        inputfiles=argns.inputfiles,
-        patternsfile=argns.patternsfile,
-        named_directives=named_directives,
-        outputfnfmt=argns.outputfnfmt,
-        inputencoding=argns.inputencoding,
-        outputencoding=argns.outputencoding,
-        verbose=argns.verbose,
-    )
+    if argns.rebuild_cache:
+        cache_errors = rebuild_directive_cache([argns.patternsfile] if argns.patternsfile else [])
+        if not argns.inputfiles:
+            return 1 if cache_errors else 0
+    if not argns.inputfiles:
+        print("No input files given.")
+        return 2
+    if argns.profile and argns.jobs != 1:
+        print("Profiling: processing files serially (--jobs 1).")
+        argns.jobs = 1
+    profiler = Profiler() if argns.profile else None
+    with profiling(profiler):
+        errors = process_all_inputfiles(
+            inputfiles=argns.inputfiles,
+            patternsfile=argns.patternsfile,
+            named_directives=named_directives,
+            outputfnfmt=argns.outputfnfmt,
+            inputencoding=argns.inputencoding,
+            outputencoding=argns.outputencoding,
+            verbose=argns.verbose,
+            streaming=argns.streaming,
+            blocksize=argns.blocksize,
+            jobs=argns.jobs,
+            incremental=argns.incremental,
+        )
+    if profiler is not None:
+        print(profiler.report(top=argns.profile_top))
+        if argns.profile_json:
+            profiler.save(argns.profile_json)
+            print("Profile saved to", argns.profile_json)
+    if errors:
+        print("%s of %s input files could not be processed." % (len(errors), len(argns.inputfiles)))
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
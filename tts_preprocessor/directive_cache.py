@@ -0,0 +1,128 @@
+"""
+
+Persistent on-disk cache of parsed and validated directives.
+
+Loading a patterns file means tokenizing the file, parsing the first-line config (yaml),
+and creating a ReplacementTuple for every op. The cache saves the result of this,
+so it only has to be done once for each version of the file:
+
+    <cache_dir>/directives/<key>.marshal    -- {'name': ..., 'ops': [(search, replace, type, comment), ...], ...}
+    <cache_dir>/file-stats.marshal          -- {filepath: (mtime_ns, size, key)}
+
+Entries are keyed by a hash of the file's content (and base name, which gives the default directive name).
+The file stats are used to find the key of an unchanged file without reading it;
+if the file's mtime or size has changed, its content is hashed again.
+
+All ops are validated (regexes compiled and replacement templates parsed) before an entry is saved,
+so invalid patterns are reported when the cache is built, and a cached directive is known to be valid.
+
+The `marshal` format is used because it is compact, fast to load, and fast to import.
+
+
+"""
+
+import os
+import marshal
+
+from tts_preprocessor.pattern_utils import load_patterns_defs, compile_operation, ReplacementTuple
+
+# Increment this when the entry format (or the parsing of patterns files) changes:
+CACHE_VERSION = 1
+
+
+def parse_and_validate(filename):
+    """ Load patterns file and validate all ops, returning (name, directive_ops, options).
+
+    Raises:
+        re.error or ValueError if any op is invalid.
+    """
+    options = {}
+    name, directive_ops = load_patterns_defs(filename, options=options)
+    for operation in directive_ops:
+        compile_operation(operation)
+    return name, directive_ops, options
+
+
+class DirectiveCache:
+    """ Cache of parsed and validated patterns files (see module docstring).
+
+    Args:
+        cache_dir: The cache directory. If None, nothing is cached (files are parsed every time).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._file_stats = None  # {filepath: (mtime_ns, size, key)}, loaded when first needed.
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, "directives", key + ".marshal")
+
+    @property
+    def file_stats(self):
+        if self._file_stats is None:
+            self._file_stats = self._load(os.path.join(self.cache_dir, "file-stats.marshal")) or {}
+        return self._file_stats
+
+    def load_patterns_defs(self, filename, rebuild=False):
+        """ Load patterns file, from the cache if possible, returning (name, directive_ops, options).
+
+        Args:
+            filename: The patterns file to load.
+            rebuild: If True, always parse and validate the file (and update the cache).
+        """
+        if self.cache_dir is None:
+            return parse_and_validate(filename)
+        filepath = os.path.abspath(filename)
+        stat = os.stat(filepath)
+        cached = self.file_stats.get(filepath)
+        if not rebuild and cached is not None and tuple(cached[:2]) == (stat.st_mtime_ns, stat.st_size):
+            entry = self._load_entry(cached[2])
+            if entry is not None:
+                return entry
+        with open(filepath, mode='rb') as fp:
+            content = fp.read()
+        import hashlib
+        key = hashlib.sha1(os.path.basename(filepath).encode('utf-8') + b"\0" + content).hexdigest()
+        entry = None if rebuild else self._load_entry(key)
+        if entry is None:
+            entry = parse_and_validate(filename)
+            self._save_entry(key, entry)
+        self.file_stats[filepath] = (stat.st_mtime_ns, stat.st_size, key)
+        self._save(os.path.join(self.cache_dir, "file-stats.marshal"), self.file_stats)
+        return entry
+
+    def _load_entry(self, key):
+        data = self._load(self.entry_path(key))
+        if not data or data.get('version') != CACHE_VERSION:
+            return None
+        return data['name'], [ReplacementTuple(*operation) for operation in data['ops']], data['options']
+
+    def _save_entry(self, key, entry):
+        name, directive_ops, options = entry
+        self._save(self.entry_path(key), {
+            'version': CACHE_VERSION, 'name': name, 'ops': [tuple(operation) for operation in directive_ops],
+            'options': options})
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, mode='rb') as fp:
+                return marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _save(path, data):
+        """ Save data to path, replacing the file atomically (the cache may be used by several processes). """
+        tmppath = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmppath, mode='wb') as fp:
+                marshal.dump(data, fp)
+            os.replace(tmppath, path)
+        except (OSError, ValueError):
+            # Cache directory not writable, or data (options) cannot be marshalled: Just don't cache it.
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
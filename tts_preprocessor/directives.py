@@ -24,16 +24,163 @@ Obsolete nomenclature / not used:
 """
 
 import os
-from functools import partial
+import re
+import marshal
+import zlib
 
-from tts_preprocessor.pattern_utils import load_patterns_defs, substitute_patterns
+from tts_preprocessor.pattern_utils import CompiledDirective
+from tts_preprocessor.lexicon_processing import compile_directive
+from tts_preprocessor.directive_cache import DirectiveCache
 
 # Data directory included with this library containing default .patterns.txt files:
 DATADIR = os.path.join(os.path.dirname(__file__), 'data')
 
+# Directory for cached data, e.g. directive indexes and parsed directives (set to "" to disable caching):
+CACHE_DIR = os.environ.get(
+    'TTS_PREPROCESSOR_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".cache", "tts_preprocessor")) or None
+
+# Parsed and validated patterns files:
+DIRECTIVE_CACHE = DirectiveCache(CACHE_DIR)
+
+STRUCTURED_FORMATS = ("json", "yaml", "yml", "pickle")
+
+
+class DirectoryIndex:
+    """ A lightweight index of the patterns files in a directory (and its sub-directories).
+
+    The index maps directive names to patterns files, {directive_name: filepath}, without loading
+    (parsing and compiling) the directives. It is saved to CACHE_DIR (using `marshal`, which is fast to import),
+    and only rebuilt when the modification time of one of the directories changes
+    (i.e. when files are added, removed, or renamed).
+
+    Args:
+        directory: The directory to index.
+        cache_dir: Where to save the index (None: Do not save).
+    """
+    # Saved indexes with a different version are rebuilt:
+    version = 2
+
+    def __init__(self, directory, cache_dir=CACHE_DIR):
+        self.directory = os.path.abspath(directory)
+        self.cache_file = None
+        if cache_dir is not None:
+            key = zlib.crc32(self.directory.encode('utf-8'))
+            self.cache_file = os.path.join(cache_dir, "index-%08x.marshal" % (key,))
+        self.dir_mtimes = {}  # {dirpath: mtime_ns}
+        self.names = {}       # {directive_name: filepath}
+        self.load()
+
+    def is_current(self):
+        """ Return True if none of the indexed directories have changed since the index was built. """
+        if not self.dir_mtimes:
+            return False
+        try:
+            return all(os.stat(dirpath).st_mtime_ns == mtime for dirpath, mtime in self.dir_mtimes.items())
+        except OSError:
+            return False
+
+    def load(self):
+        """ Load the saved index, if it is still current; otherwise, rebuild it. """
+        if self.cache_file is not None:
+            try:
+                with open(self.cache_file, mode='rb') as fp:
+                    data = marshal.load(fp)
+                if data['directory'] == self.directory and data.get('version') == self.version:
+                    self.dir_mtimes, self.names = data['dir_mtimes'], data['names']
+            except (OSError, EOFError, ValueError, TypeError, KeyError):
+                pass
+        if not self.is_current():
+            self.rebuild()
+
+    def refresh(self):
+        """ Rebuild the index if any of the directories have changed. """
+        if not self.is_current():
+            self.rebuild()
+
+    def rebuild(self):
+        dir_mtimes, names = {}, {}
+        for root, dirs, files in os.walk(self.directory):
+            dir_mtimes[root] = os.stat(root).st_mtime_ns
+            for fn in sorted(files):
+                fnroot, fnext = os.path.splitext(fn)
+                if fn[0] in (".", "_") or fnext[:2] == "py":
+                    continue
+                filepath = os.path.join(root, fn)
+                names[directive_name_from_file(filepath)] = filepath  # As registered in order, the last file wins.
+        self.dir_mtimes, self.names = dir_mtimes, names
+        if self.cache_file is not None:
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                with open(self.cache_file, mode='wb') as fp:
+                    marshal.dump({'directory': self.directory, 'version': self.version,
+                                  'dir_mtimes': dir_mtimes, 'names': names}, fp)
+            except OSError:
+                pass  # The index is just not saved.
+
+    def find(self, name):
+        """ Return the patterns file for directive name (or filepath), or None. """
+        self.refresh()
+        if name in self.names:
+            return self.names[name]
+        if name in self.names.values():
+            return name
+        return None
+
+
+def directive_name_from_file(filepath):
+    """ Get the directive name of a patterns file (the same name as `load_patterns_defs()` would give). """
+    fnbase, fnext = os.path.splitext(filepath)
+    if fnext[1:].lower() in STRUCTURED_FORMATS:
+        # The name may be specified inside the file:
+        try:
+            name, directive_ops, options = DIRECTIVE_CACHE.load_patterns_defs(filepath)
+            return name
+        except (OSError, ValueError, re.error):
+            pass  # Errors are reported when the directive is used.
+    return os.path.basename(filepath).split(".", 1)[0]
+
+
+# Indexes of directories with patterns files; directives are loaded the first time they are used:
+DIRECTORY_INDEXES = []
+
+
+def find_indexed_directive(name):
+    """ Find the patterns file for directive name in the indexed directories, returning None if not found.
+
+    Directories loaded later take precedence, e.g. a user directory overrides the package `DATADIR`.
+    """
+    for index in reversed(DIRECTORY_INDEXES):
+        filepath = index.find(name)
+        if filepath is not None:
+            return filepath
+    return None
+
+
+class DirectiveRegistry(dict):
+    """ A dict of registered directives, which loads indexed directives the first time they are requested. """
+
+    def __missing__(self, name):
+        filepath = find_indexed_directive(name)
+        if filepath is None:
+            raise KeyError(name)
+        register_directives_from_file(filepath)
+        if name in self.keys():
+            return dict.__getitem__(self, name)
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or find_indexed_directive(name) is not None
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
 # Dict containing the registered directives: {directive_name: directive_defs}
-REGISTERED_DIRECTIVE_DEFS = {}
-REGISTERED_TRANSFORMATIONS = {}
+REGISTERED_DIRECTIVE_DEFS = DirectiveRegistry()
+REGISTERED_TRANSFORMATIONS = DirectiveRegistry()
 
 
 def register_directive_defs(directive_name, directives):
@@ -42,21 +189,35 @@ def register_directive_defs(directive_name, directives):
 
 # Transformation functions:
 def register_subs_directive_func(directive_name, directive_list, verbose=0):
-    REGISTERED_TRANSFORMATIONS[directive_name] = partial(substitute_patterns, directive=directive_list)
+    """ Compile directive_list (unless already compiled, e.g. a Lexicon) and register it as a transformation. """
+    if not callable(directive_list):
+        directive_list = CompiledDirective(directive_list, name=directive_name)
+    REGISTERED_TRANSFORMATIONS[directive_name] = directive_list
+    return directive_list
+
+
+# Files registered by `register_directives_from_file()`, {filename: (mtime_ns, size)}:
+REGISTERED_FILE_STATS = {}
 
 
 def register_directives_from_file(fn):
-    # TODO: Make a lazy-loading function instead of loading all data on startup
     # Make sure to register both with the "simple" name and with the full filename/path.
-    directives_name, directives = load_patterns_defs(fn)
+    stat = os.stat(fn)
+    directives_name, directives, options = DIRECTIVE_CACHE.load_patterns_defs(fn)
+    REGISTERED_FILE_STATS[fn] = (stat.st_mtime_ns, stat.st_size)
     register_directive_defs(directives_name, directives)
     register_directive_defs(fn, directives)
-    register_subs_directive_func(fn, directives)
-    register_subs_directive_func(directives_name, directives)
+    # Compile once, register the same transformation under both names:
+    transformation = compile_directive(directives, name=directives_name, options=options)
+    register_subs_directive_func(directives_name, transformation)
+    register_subs_directive_func(fn, transformation)
 
 
 def ensure_directive_is_registered(name_or_file):
     if os.path.isfile(name_or_file):
+        stat = os.stat(name_or_file)
+        if REGISTERED_FILE_STATS.get(name_or_file) == (stat.st_mtime_ns, stat.st_size):
+            return name_or_file  # Already registered, and not changed since.
         # name_or_file, directive_defs = load_patterns_defs(name_or_file)
         # register_directive_defs(name_or_file, directive_defs)
         register_directives_from_file(name_or_file)
@@ -65,23 +226,77 @@ def ensure_directive_is_registered(name_or_file):
     return name_or_file
 
 
+def reload_changed_directives():
+    """ Re-register all registered patterns files that have changed on disk since they were registered.
+
+    If a changed file cannot be loaded (e.g. invalid patterns), the previously registered directive is kept,
+    and the file is not tried again until it changes again.
+
+    Returns:
+        (reloaded, errors): A list of reloaded filenames, and a list of (filename, error) for failed reloads.
+    """
+    reloaded, errors = [], []
+    for fn, registered_stat in list(REGISTERED_FILE_STATS.items()):
+        try:
+            stat = os.stat(fn)
+        except OSError:
+            continue  # Removed (or being replaced); keep the registered directive.
+        if (stat.st_mtime_ns, stat.st_size) == registered_stat:
+            continue
+        try:
+            register_directives_from_file(fn)
+            reloaded.append(fn)
+        except Exception as e:  # Any error in a single file, e.g. a YAML syntax error (yaml.YAMLError).
+            REGISTERED_FILE_STATS[fn] = (stat.st_mtime_ns, stat.st_size)
+            errors.append((fn, e))
+    return reloaded, errors
+
+
 def load_directives_from_dir(directory):
-    for root, dirs, files in os.walk(directory):
-        # root: str, dirs: list, files: list
-        for fn in files:
-            fnroot, fnext = os.path.splitext(fn)
-            if fn[0] in (".", "_") or fnext[:2] == "py":
-                continue
-            # print(root, fn)
-            register_directives_from_file(os.path.join(root, fn))
+    """ Make the patterns files in directory available as named directives.
+
+    Only the directory index is loaded (see `DirectoryIndex`); each directive is loaded
+    the first time it is requested from `REGISTERED_DIRECTIVE_DEFS` or `REGISTERED_TRANSFORMATIONS`.
+    """
+    index = DirectoryIndex(directory)
+    DIRECTORY_INDEXES.append(index)
+    # The directives in directory override those already registered with the same name:
+    for name in index.names:
+        dict.pop(REGISTERED_DIRECTIVE_DEFS, name, None)
+        dict.pop(REGISTERED_TRANSFORMATIONS, name, None)
 load_directives_from_dir(DATADIR)
 
 
+def rebuild_directive_cache(filenames=()):
+    """ Re-index the directive directories, and re-parse and validate all patterns files, updating the cache.
+
+    Args:
+        filenames: Additional patterns files to add to the cache.
+
+    Returns:
+        A list of (filename, error) for the patterns files that could not be loaded.
+    """
+    errors = []
+    filepaths = list(filenames)
+    for index in DIRECTORY_INDEXES:
+        index.rebuild()
+        filepaths.extend(sorted(set(index.names.values())))
+    for filepath in filepaths:
+        try:
+            DIRECTIVE_CACHE.load_patterns_defs(filepath, rebuild=True)
+        except Exception as e:  # Any error in a single file, e.g. a YAML syntax error (yaml.YAMLError).
+            print("Error loading patterns file %s: %s" % (filepath, e))
+            errors.append((filepath, e))
+    print("Directive cache rebuilt: %s patterns files (%s errors)." % (len(filepaths), len(errors)))
+    return errors
+
+
 # A transformation is any function that takes a single text argument and transforms it.
 # Add library-defined functional directive transformations:
-from .latex_processing import pylatexenc_convert
+from .latex_processing import pylatexenc_convert, fast_latex_convert
 FUNCTIONAL_TRANSFORMATIONS = {
-    'pylatexenc': pylatexenc_convert
+    'pylatexenc': pylatexenc_convert,
+    'latex_fast': fast_latex_convert,
 }
 REGISTERED_TRANSFORMATIONS.update(FUNCTIONAL_TRANSFORMATIONS)
 
@@ -107,7 +322,7 @@ def get_directive_transformation(directive):
         return REGISTERED_TRANSFORMATIONS[directive]
     else:
         # Assume directive is a list of substitution operation tuples:
-        return partial(substitute_patterns, directive=directive)
+        return CompiledDirective(directive)
 
 
 # print("\npredefined_pattern_strs:")
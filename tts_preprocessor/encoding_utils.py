@@ -0,0 +1,147 @@
+"""
+
+Detecting the encoding of text files, and transcoding files with bounded memory use.
+
+Encoding detection (`detect_encoding()`) reads the file in chunks, and stops as soon as the encoding is known:
+1. A byte order mark (BOM) at the start of the file gives the encoding right away (utf-8-sig, utf-16, utf-32).
+2. Otherwise, the file is decoded as (strict) UTF-8, chunk by chunk, which is fast, and by far the most common case.
+    If the first `max_bytes` of the file are valid UTF-8, the encoding is utf-8.
+3. Otherwise, the chunks are fed to a `chardet` detector, until the detector is done (confident),
+    or `max_bytes` have been read. If `chardet` is not installed, the encoding cannot be detected.
+Only the first `max_bytes` of the file are read (and held in memory, for the detector), regardless of the file size.
+
+Encodings are returned as normalized `codecs` names, e.g. "cp1252" (rather than chardet's "Windows-1252").
+
+`transcode_file()` converts a file from one encoding to another, in blocks, so memory use is bounded
+by the block size, rather than by the size of the file.
+
+Used by `scripts.change_file_encoding`, and by the main command line tools with `--inputencoding auto`.
+
+
+"""
+
+import codecs
+
+AUTO_ENCODING = "auto"  # The --inputencoding value for detecting the encoding of each input file
+DETECT_CHUNKSIZE = 2**16  # bytes
+DETECT_MAX_BYTES = 2**20  # bytes
+TRANSCODE_BLOCKSIZE = 2**20  # characters
+
+# Byte order marks, and the codecs that read them (UTF-32 first, since the UTF-32-LE BOM starts with the UTF-16-LE BOM):
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def normalize_encoding(encoding):
+    """ Return the `codecs` name of encoding, e.g. "cp1252" for "Windows-1252" (or encoding, if unknown). """
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return encoding
+
+
+def bom_encoding(data):
+    """ Return the encoding given by the byte order mark at the start of data, or None. """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    return None
+
+
+def _chardet_detector():
+    """ Create a `chardet` UniversalDetector, or return None if chardet is not installed. """
+    try:
+        import chardet
+    except ImportError:
+        return None
+    detector_class = getattr(chardet, 'UniversalDetector', None)
+    if detector_class is None:  # chardet < 7
+        from chardet.universaldetector import UniversalDetector as detector_class
+    return detector_class()
+
+
+def detect_encoding(fp, chunksize=DETECT_CHUNKSIZE, max_bytes=DETECT_MAX_BYTES):
+    """ Detect the encoding of binary file-like object fp (see module docstring).
+
+    Args:
+        fp: A binary file-like object, positioned at the start of the file.
+        chunksize: The number of bytes read at a time.
+        max_bytes: The maximum number of bytes read (None: the whole file).
+
+    Returns:
+        (encoding, confidence), where encoding is None if the encoding could not be detected.
+        The confidence is 1.0 for a BOM, or if the whole file is valid UTF-8.
+    """
+    chunks, nbytes = [], 0
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while max_bytes is None or nbytes < max_bytes:
+        chunk = fp.read(chunksize if max_bytes is None else min(chunksize, max_bytes - nbytes))
+        if not chunks and chunk:
+            encoding = bom_encoding(chunk)
+            if encoding is not None:
+                return encoding, 1.0
+        try:
+            decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError:
+            chunks.append(chunk)
+            break
+        if not chunk:
+            return 'utf-8', 1.0
+        chunks.append(chunk)
+        nbytes += len(chunk)
+    else:
+        # The first max_bytes are valid UTF-8 (the rest of the file is not checked):
+        return 'utf-8', 0.99
+    detector = _chardet_detector()
+    if detector is None:
+        return None, 0.0
+    for chunk in chunks:
+        detector.feed(chunk)
+        if detector.done:
+            break
+    while not detector.done and (max_bytes is None or nbytes < max_bytes):
+        chunk = fp.read(chunksize)
+        if not chunk:
+            break
+        detector.feed(chunk)
+        nbytes += len(chunk)
+    result = detector.close()
+    if not result or not result.get('encoding'):
+        return None, 0.0
+    return normalize_encoding(result['encoding']), result.get('confidence') or 0.0
+
+
+def file_encoding(filename, **kwargs):
+    """ Detect the encoding of a file (see `detect_encoding()`), returning (encoding, confidence). """
+    with open(filename, mode='rb') as fp:
+        return detect_encoding(fp, **kwargs)
+
+
+def resolve_encoding(filename, encoding):
+    """ Get the encoding for reading a file: encoding, or the detected encoding if encoding is "auto".
+
+    Raises:
+        ValueError, if the encoding could not be detected.
+    """
+    if encoding != AUTO_ENCODING:
+        return encoding
+    detected, confidence = file_encoding(filename)
+    if detected is None:
+        raise ValueError("Could not detect the encoding of file %s" % (filename,))
+    print("Detected encoding: %s (confidence %.2f)" % (detected, confidence))
+    return detected
+
+
+def transcode_file(inputfn, outputfn, inputencoding, outputencoding, blocksize=TRANSCODE_BLOCKSIZE):
+    """ Convert file inputfn from inputencoding to outputencoding, writing outputfn block by block. """
+    with open(inputfn, encoding=inputencoding) as infp, open(outputfn, mode='w', encoding=outputencoding) as outfp:
+        while True:
+            block = infp.read(blocksize)
+            if not block:
+                break
+            outfp.write(block)
@@ -1,4 +1,3 @@
-
 """
 
 See rtf_preprocessing for general things.
@@ -8,25 +7,243 @@ HTML-to-text:
 * https://github.com/aaronsw/html2text
 
 
+Extracting text with `html.parser`:
+-----------------------------------
+`HtmlTextExtractor` is an incremental `html.parser.HTMLParser`: HTML is fed to it in chunks (e.g. blocks read
+from a large saved web page), and the text extracted so far is taken out after each chunk, so the document is
+never held in memory, and is parsed in a single pass (rather than rescanned for each tag pattern):
+* The content of script, style, nav, and similar elements (see `SKIP_TAGS`) is dropped.
+* Block elements (paragraphs, headings, list items, table rows, etc.) become paragraph or line breaks,
+    and other whitespace is collapsed to single spaces (except in <pre> elements), as a browser would render it.
+* Superscripts that are read as words are converted, e.g. `m<sup>2</sup>` to "m squared" (see `SUPERSCRIPTS`);
+    other sub- and superscript tags are removed.
+* Character references (entities) are decoded by the parser, in the same pass.
+
+`extract_text_blocks()` yields the extracted text in paragraph-aligned blocks (see `streaming`),
+which can be passed straight to the directive chain (if the directives are local).
 
+Usage:
+    $ python -m tts_preprocessor.html_processing page.html
+    $ python -m tts_preprocessor.html_processing page.html -d default_txt mylexicon.txt --outputfnfmt "{fnroot}.out.txt"
 
 
 """
 
+import re
+import sys
+from argparse import ArgumentParser
+from html.parser import HTMLParser
+
+from tts_preprocessor.streaming import DEFAULT_BLOCKSIZE, is_local, take_paragraphs, transform_blocks
+
+# Elements whose content is not read:
+SKIP_TAGS = frozenset(("script", "style", "nav", "noscript", "template", "svg", "math", "iframe", "object"))
+# Elements which are separate paragraphs:
+BLOCK_TAGS = frozenset((
+    "address", "article", "aside", "blockquote", "caption", "details", "dialog", "div", "dl", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "main",
+    "ol", "p", "pre", "section", "summary", "table", "title", "ul"))
+# Elements which are separate lines:
+LINE_TAGS = frozenset(("br", "li", "tr", "dt", "dd"))
+# Elements separated by spaces:
+CELL_TAGS = frozenset(("td", "th"))
+# Superscripts read as words, {superscript text: words}:
+SUPERSCRIPTS = {
+    "2": "squared",
+    "3": "cubed",
+}
+WHITESPACE_REGEX = re.compile(r"\s+")
+PARAGRAPH_BREAK = "\n\n"
+LINE_BREAK = "\n"
+
+
+class HtmlTextExtractor(HTMLParser):
+    """ Incremental HTML-to-text extractor (see module docstring).
+
+    Feed HTML with `feed()`, and take the text extracted so far with `take_text()`;
+    after `close()`, `take_text()` gives the rest of the text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []        # Extracted text, not yet taken
+        self.started = False    # Whether any text has been extracted
+        self.pending = ""       # Whitespace to write before the next text: "", " ", or a line/paragraph break
+        self.skip_depth = 0     # Number of open SKIP_TAGS elements
+        self.pre_depth = 0      # Number of open <pre> elements
+        self.sup_start = None   # Index in pieces where the open <sup> element's text starts
+        self.words_end = False  # Whether the last text written was a converted superscript
+
+    def write(self, text):
+        if self.words_end and text[:1].isalnum():
+            self.separate(" ")  # E.g. "m<sup>2</sup>s" -> "m squared s"
+        self.words_end = False
+        if self.pending:
+            if self.started:
+                self.pieces.append(self.pending)
+            self.pending = ""
+        self.pieces.append(text)
+        self.started = True
+
+    def separate(self, whitespace):
+        """ Separate the text before and after by whitespace (the separator with the most line breaks is used). """
+        if not self.pending or whitespace.count("\n") > self.pending.count("\n"):
+            self.pending = whitespace
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        if self.skip_depth:
+            return
+        if tag in BLOCK_TAGS:
+            self.separate(PARAGRAPH_BREAK)
+            if tag == "pre":
+                self.pre_depth += 1
+        elif tag in LINE_TAGS:
+            self.separate(LINE_BREAK)
+        elif tag in CELL_TAGS:
+            self.separate(" ")
+        elif tag == "sup" and self.sup_start is None:
+            self.sup_start = len(self.pieces)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        if self.skip_depth:
+            return
+        if tag in BLOCK_TAGS:
+            self.separate(PARAGRAPH_BREAK)
+            if tag == "pre":
+                self.pre_depth = max(self.pre_depth - 1, 0)
+        elif tag in LINE_TAGS:
+            self.separate(LINE_BREAK)
+        elif tag in CELL_TAGS:
+            self.separate(" ")
+        elif tag == "sup" and self.sup_start is not None:
+            words = SUPERSCRIPTS.get("".join(self.pieces[self.sup_start:]).strip())
+            if words is not None:
+                del self.pieces[self.sup_start:]
+                self.separate(" ")
+                self.write(words)
+                self.words_end = True
+            self.sup_start = None
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.pre_depth:
+            self.write(data)
+            return
+        text = WHITESPACE_REGEX.sub(" ", data)
+        if text.startswith(" "):
+            self.separate(" ")
+        if text.strip(" "):
+            self.write(text.strip(" "))
+            if text.endswith(" "):
+                self.separate(" ")
+
+    def take_text(self):
+        """ Take the text extracted so far (except an unfinished <sup> element), or all the text after `close()`. """
+        end = len(self.pieces) if self.sup_start is None else self.sup_start
+        text = "".join(self.pieces[:end])
+        del self.pieces[:end]
+        if self.sup_start is not None:
+            self.sup_start = 0
+        return text
+
+    def close(self):
+        super().close()
+        self.sup_start = None
+        if self.started:
+            self.pending = ""
+            self.pieces.append(LINE_BREAK)
+
+
+def extract_text_blocks(fp, blocksize=DEFAULT_BLOCKSIZE):
+    """ Read HTML from file-like object fp, yielding the extracted text in paragraph-aligned blocks. """
+    extractor = HtmlTextExtractor()
+    buffer = ""
+    while True:
+        data = fp.read(blocksize)
+        if not data:
+            break
+        extractor.feed(data)
+        search_start = max(len(buffer) - 1, 0)
+        buffer += extractor.take_text()
+        paragraphs, buffer = take_paragraphs(buffer, search_start, blocksize=blocksize)
+        if paragraphs:
+            yield "".join(paragraphs)
+    extractor.close()
+    buffer += extractor.take_text()
+    if buffer:
+        yield buffer
+
+
+def html_to_text(html):
+    """ Extract the text from an HTML document (see module docstring). """
+    extractor = HtmlTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.take_text()
+
+
+def process_html_file(inputfile, transformations, outputfnfmt="{fnroot}.txt", inputencoding='utf-8',
+                      outputencoding=None, blocksize=DEFAULT_BLOCKSIZE):
+    """ Extract the text from an HTML file, and apply transformations to it, writing the result to the output file.
+
+    If all transformations are local, the text is transformed (and written) block by block,
+    as it is extracted, otherwise all at once.
 
-from .data import DEFAULT_HTML_PATTERNS
-from .common import process_all_inputfiles, default_argparser
+    Returns:
+        The output filename.
+    """
+    from tts_preprocessor.encoding_utils import resolve_encoding, AUTO_ENCODING
+    from tts_preprocessor.scripts.tts_v2 import format_outputfn
+    inputencoding = resolve_encoding(inputfile, inputencoding or 'utf-8')
+    if outputencoding is None or outputencoding == AUTO_ENCODING:
+        outputencoding = inputencoding
+    outputfn = format_outputfn(outputfnfmt, inputfile)
+    with open(inputfile, encoding=inputencoding) as infp, open(outputfn, mode='w', encoding=outputencoding) as outfp:
+        print("Reading file:", inputfile)
+        print("Writing file:", outputfn)
+        blocks = extract_text_blocks(infp, blocksize=blocksize)
+        if not all(is_local(transform) for transform in transformations):
+            blocks = ["".join(blocks)]
+        for block in transform_blocks(blocks, transformations):
+            outfp.write(block)
+    return outputfn
 
 
 def main(argv=None, argns=None):
     if argns is None:
-        ap = default_argparser()
+        ap = ArgumentParser(description="Extract the text from HTML files, and apply directives to it.")
+        ap.add_argument('inputfiles', nargs='+')
+        ap.add_argument('-d', '--directive', nargs="+", action="append", dest="directives",
+                        help="Directives to apply to the extracted text (default: the directives for .txt files).")
+        ap.add_argument('--outputfnfmt', default="{fnroot}.txt")
+        ap.add_argument('--inputencoding', default='utf-8',
+                        help="The encoding of the input files ('auto': detect the encoding of each file).")
+        ap.add_argument('--outputencoding', default='utf-8')
+        ap.add_argument('--blocksize', type=int, default=DEFAULT_BLOCKSIZE,
+                        help="Block size (in characters) used to read the input files.")
         argns = ap.parse_args(argv)
-    process_all_inputfiles(
-        inputfiles=argns.inputfiles,
-        patternsfile=argns.patternsfile,
-        outputfnfmt=argns.outputfnfmt,
-        inputformat='html',
-        patternsformat=argns.patternsformat)
+    from tts_preprocessor.directives import DEFAULT_FILE_DIRECTIVES
+    from tts_preprocessor.scripts.tts_v2 import get_directive_transforms
+    directives = [directive for nargs in argns.directives or () for directive in nargs]
+    # The extracted text is plain text, so it is processed as a .txt file by default:
+    transformations = get_directive_transforms(directives or DEFAULT_FILE_DIRECTIVES["txt"], argns.inputfiles[0])
+    errors = 0
+    for inputfile in argns.inputfiles:
+        try:
+            process_html_file(inputfile, transformations, outputfnfmt=argns.outputfnfmt,
+                              inputencoding=argns.inputencoding, outputencoding=argns.outputencoding,
+                              blocksize=argns.blocksize)
+        except (OSError, ValueError) as e:
+            print("Error processing file %s: %s" % (inputfile, e))
+            errors += 1
+    return 1 if errors else 0
 
 
+if __name__ == '__main__':
+    sys.exit(main())
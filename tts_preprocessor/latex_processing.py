@@ -146,6 +146,15 @@ Approach using pylatexenc:
 
 
 
+The fast engine:
+----------------
+`FastLatexConverter` (`--latex-engine fast`) converts LaTeX to text in a single pass, driven by the same macro table
+as `LatexConverter`, without building a node tree, and without pylatexenc. It is much faster, uses less memory,
+and never fails on malformed input (the damage is limited to the paragraph with the error).
+The output is the same as pylatexenc's, except for whitespace between macros and groups, which is kept.
+
+
+
 Nomenclature:
 
 `directive` is used to designate a (often named) method of transformation.
@@ -158,10 +167,10 @@ A `directive` may be:
 """
 
 import os
+import re
 import argparse
-# import pylatexenc
-import pylatexenc.latex2text
-import pylatexenc.latexwalker
+import unicodedata
+# OBS: pylatexenc is imported when needed (by the functions using it), to keep start-up fast.
 
 
 # from .common import substitute_patterns
@@ -184,189 +193,661 @@ import pylatexenc.latexwalker
 #     return string
 
 
-def pylatexenc_convert(tex):  # , extra_env_defs=None, extra_macro_defs=None, extra_text_replacements=None):
-    """
+# Extra macros for pylatexenc, (macname, simplify_repl, discard).
+# Can't use string input, need to have True/False column.
+EXTRA_MACRO_REPRS = [
+    ("includegraphics",	None,			True),
+    ("cite",		None,				True),
+    ("footnote",	None,				True),
+
+    ("chapter",		"\n\nChapter: %s\n",False),
+    ("section",		"\nSection: %s\n",	False),
+    ("subsection",	"\n%s:\n",			False),
+    ("subsubsection","\n%s:\n",			False),
+    ("paragraph",	"\n%s:",			False),
+    ("caption",		"\nCaption: %s\n",	False),
+    ("epigraph",	"\nQuote: %s\n",	False),
+
+    ("%",			"percent",			False),
+    ("percent",		"percent",			False),
+    ("prime",		"prime",			False),
+    ("degree",		"degree",			False),
+
+    ("SI",			"%s %s",			False),
+    ("SIrange",		"from %s to %s ",	False),
+    # ("SIrange",		" from %s to %s ",	False),
+    ("autoref",		"see reference: ",	False),
+]
+GREEK_LETTERS = (
+    'alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa',
+    'lambda', 'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'upsilon', 'phi',
+    'chi', 'psi', 'omega')
+EXTRA_MACRO_REPRS.extend((letter, letter, False) for letter in GREEK_LETTERS)
+
+# Number of arguments for the extra macros (for latexwalker nodes, to capture macro arguments); default is 1:
+EXTRA_MACRO_NUMARGS = {
+    "SI": 2,
+    "SIrange": 2,
+    "%": 0,
+    "percent": 0,
+    "prime": 0,
+    "degree": 0,
+}
+# Symbols take no arguments (otherwise e.g. `\alpha\beta` would be read as \alpha with the argument \beta):
+EXTRA_MACRO_NUMARGS.update((letter, 0) for letter in GREEK_LETTERS)
+
+# Probably better to have these in separate file, unless regex.
+# TODO: Disabled text replacements while checking grammar!! (Not used, see EXTRA_TEXT_REPLACEMENTS)
+# TODO: Just move all text replacements outside of this function and let this only deal with latex macros.
+DISABLED_TEXT_REPLACEMENTS = [
+    # (search, replace) tuple, regex or fixed-string, using regex.sub() or str.replace()
+    # Mac TTS has problems when words contains hyphens; generally just replace hyphen with space or en-dash
+    # ("-", "—"),
+    ("-", " "),
+    ("   ", " "),
+    ("  ", " "),
+    ("  ", " "),
+    ("  ", " "),
+    (" .", "."),
+    (" , ", ", "),
+    ("\n ", "\n"),
+
+    ("3'", "3 prime"),
+    ("5'", "5 prime"),
+    ("2'", "2 prime"),
+    ("5′", "5 prime"),
+    ("3′", "3 prime"),
+    ("2′", "2 prime"),
+    ("T_m", "melting temperature"),
+    ("%", "percent"),
+    ("∼", "approximately"),
+    (" nt", " nucleotide"),
+    (" nts", " nucleotides"),
+    ("et al.", "and co-workers"),
+    ("e.g.", "for example"),
+    ("i.e.", "that is,"),
+
+    # Hyphens, etc:
+    ("---", "—"),  # em-dash
+    ("--", "—"),  # en-dash
+    # ("--", "-"),  # hyphen
+
+    # Other;
+    ("°", " degree "),  # hyphen
+    ("T_m", "melting temperature"),  # hyphen
+    ("T_ m", "melting temperature"),  # hyphen
+
+    # Specialized:
+    ("OH", "hydroxyl"),
+    (" KL", " kissing loop"),
+    (" MB", " molecular beacon"),
+    (" bp", " base-pair"),
+    (" kbp",  "kilo base pairs"),
+    (" kb", " kilo bases"),
+    ("K+", " potassium ions"),
+    ("Na+", " sodium ions"),
+    ("Mg2+", "magnesium"),
+    ("Mg 2+", "magnesium"),
+
+    ("G-quadruplex", "G quadruplex"),
+    ("G-tetrad", "G tetrad"),
+    ("G-tetrads", "G tetrads"),
+    ("siRNA", "SI RNA"),  # space or hyphen
+    ("dsRNA", "double stranded RNA"),  # space or hyphen
+    ("dsDNA", "double stranded DNA"),  # space or hyphen
+    # ("TALENs", "Ta-lens"),
+    # 3,5-difluoro-4-hydroxybenzylidene
+
+    # Trim excessive white space:
+    ("  ", " "),
+    ("  ", " "),
+
+]
+EXTRA_TEXT_REPLACEMENTS = [
+    # Trim excessive white space:
+    (" MB", "molecular beacon"),
+    ("   ", " "),
+    ("  ", " "),
+    ("  ", " "),
+    (" .", "."),
+    (" ,", ","),
+
+]
+
+
+class LatexConverter:
+    """ Convert LaTeX to plain text using pylatexenc.
+
     Pros and cons using pylatexenc:
     * Parser seems pretty self-rolled.
     * Doesn't handle e.g. two optional arguments, so \chapter[short title][header title]{full title} craps up.
         (two optional arguments is not allowed by LaTeX, but is OK for e.g. ConTeXt.)
 
-    :param tex:
-    :return:
+    The macro/environment tables and the `LatexNodes2Text` instance are created once, when the converter
+    is created, so converting a document only parses it. The pylatexenc default tables are copied, not modified.
+
+    The text replacements (pylatexenc's defaults and the extra ones) are compiled to a single CompiledDirective,
+    so redundant replacements are left out (see `pattern_utils.optimize_operations()`), and the rest are applied
+    in the same order as pylatexenc would, i.e. before removing `$` signs.
+
+    Args:
+        extra_macro_reprs: List of (macname, simplify_repl, discard) tuples, for macros to add or override.
+        extra_macro_numargs: Dict with the number of arguments for the extra macros (default is 1).
+        extra_text_replacements: List of (search, replace) tuples, applied after the default text replacements.
+    """
+
+    def __init__(self, extra_macro_reprs=EXTRA_MACRO_REPRS, extra_macro_numargs=EXTRA_MACRO_NUMARGS,
+                 extra_text_replacements=EXTRA_TEXT_REPLACEMENTS):
+        import pylatexenc.latex2text
+        import pylatexenc.latexwalker
+        from pylatexenc.latex2text import MacroDef
+        from pylatexenc.latexwalker import MacrosDef
+
+        self.env_repr_dict = dict(pylatexenc.latex2text.default_env_dict)
+
+        macro_repr_keys = ("macname", "simplify_repl", "discard")
+        extra_macro_reprs = {row[0]: MacroDef(**dict(zip(macro_repr_keys, row))) for row in extra_macro_reprs}
+        self.macro_repr_dict = dict(pylatexenc.latex2text.default_macro_dict)
+        self.macro_repr_dict.update(extra_macro_reprs)
+
+        # Define the extra macros for latexwalker nodes (to capture macro arguments):
+        self.macro_node_defs = dict(pylatexenc.latexwalker.default_macro_dict)
+        for macname in extra_macro_reprs:
+            numargs = extra_macro_numargs.get(macname, 1)
+            self.macro_node_defs[macname] = MacrosDef(macname=macname, optarg=numargs > 0, numargs=numargs)
+
+        self.text_replacements = list(pylatexenc.latex2text.default_text_replacements)
+        self.text_replacements.extend(extra_text_replacements)
+        self.text_directive = compile_text_replacements(self.text_replacements)
+
+        self.nodes2text = pylatexenc.latex2text.LatexNodes2Text(
+            env_dict=self.env_repr_dict,
+            macro_dict=self.macro_repr_dict,
+            text_replacements=(self.text_replacements if self.text_directive is None else
+                               [(DirectiveTextReplacement(self.text_directive), None)]),
+            keep_inline_math=False,  # False = "replace $ with ' '"
+            keep_comments=False,
+        )
+        self.LatexWalker = pylatexenc.latexwalker.LatexWalker
+
+    def parse(self, tex):
+        """ Parse tex, returning a list of latexwalker nodes. """
+        parser = self.LatexWalker(
+            tex,
+            macro_dict=self.macro_node_defs,
+            keep_inline_math=False,  # True
+            tolerant_parsing=False,
+            strict_braces=False
+        )
+        (nodelist, tpos, tlen) = parser.get_latex_nodes(
+            stop_upon_closing_brace=None,
+            stop_upon_end_environment=None,
+            stop_upon_closing_mathmode=None
+        )
+        return nodelist
+
+    def convert(self, tex):
+        """ Convert tex to plain text. """
+        return self.nodes2text.nodelist_to_text(self.parse(tex))
+
+    def __call__(self, tex):
+        return self.convert(tex)
+
+
+def compile_text_replacements(text_replacements):
+    """ Compile pylatexenc text replacements, (search, replace) tuples, to a CompiledDirective.
+
+    pylatexenc applies string searches with `str.replace()`, and compiled regexes with their `sub()` method.
+    Returns None if a replacement cannot be expressed as a directive op (e.g. a regex with flags, or a function).
     """
-    # from importlib import reload
-    # reload(pylatexenc)
-    # reload(pylatexenc.latexwalker)
-    # reload(pylatexenc.latex2text)
-    from pylatexenc.latex2text import EnvDef, MacroDef
-    from pylatexenc.latexwalker import MacrosDef
-
-    env_repr_dict = pylatexenc.latex2text.default_env_dict.copy()
-    # if extra_env_defs:
-    #     env_repr_dict.update(extra_env_defs)
-
-    macro_repr_dict = pylatexenc.latex2text.default_macro_dict.copy()
-    macro_repr_keys = ("macname", "simplify_repl", "discard")
-    # Can't use string input, need to have True/False column.
-    # macname, repl, ignore
-    extra_macro_reprs = [ # """
-        ("includegraphics",	None,			True),
-        ("cite",		None,				True),
-        ("footnote",	None,				True),
-
-        ("chapter",		"\n\nChapter: %s\n",False),
-        ("section",		"\nSection: %s\n",	False),
-        ("subsection",	"\n%s:\n",			False),
-        ("subsubsection","\n%s:\n",			False),
-        ("paragraph",	"\n%s:",			False),
-        ("caption",		"\nCaption: %s\n",	False),
-        ("epigraph",	"\nQuote: %s\n",	False),
-
-        ("%",			"percent",			False),
-        ("percent",		"percent",			False),
-        ("prime",		"prime",			False),
-        ("degree",		"degree",			False),
-
-        ("SI",			"%s %s",			False),
-        ("SIrange",		"from %s to %s ",	False),
-        # ("SIrange",		" from %s to %s ",	False),
-        ("autoref",		"see reference: ",	False),
-    ]
-    greek = (
-        'alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa',
-        'lambda', 'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'upsilon', 'phi',
-        'chi', 'psi', 'omega')
-    for letter in greek:
-        extra_macro_reprs.append((letter, letter, False))
-    # """
-    # extra_macro_reprs = [
-    #     line.replace('\\n', '\n').split("\t")
-    #     for line in extra_macro_reprs.strip().split("\n")
-    #     if line and line[0] != "#"
-    # ]
-    extra_macro_reprs = [dict(zip(macro_repr_keys, row)) for row in extra_macro_reprs]
-    extra_macro_reprs = {d['macname']: MacroDef(**d) for d in extra_macro_reprs}
-    macro_repr_dict.update(extra_macro_reprs)
-
-    # Define the extra macros for latexwalker nodes (to capture macro arguments):
-    numargs = {
-        "SI": 2,
-        "SIrange": 2,
-        "%": 0,
-        "percent": 0,
-    }
-    extra_macro_defs = {
-        macname: MacrosDef(macname=macname, optarg=True, numargs=numargs.get(macname, 1))
-        for macname in extra_macro_reprs
-    }
-    macro_node_defs = pylatexenc.latexwalker.default_macro_dict  # .copy()
-    macro_node_defs.update(extra_macro_defs)
-
-    text_replacements = list(pylatexenc.latex2text.default_text_replacements)
-    # Probably better to have these in separate file, unless regex.
-    extra_text_replacements = [
-        # (search, replace) tuple, regex or fixed-string, using regex.sub() or str.replace()
-        # Mac TTS has problems when words contains hyphens; generally just replace hyphen with space or en-dash
-        # ("-", "—"),
-        ("-", " "),
-        ("   ", " "),
-        ("  ", " "),
-        ("  ", " "),
-        ("  ", " "),
-        (" .", "."),
-        (" , ", ", "),
-        ("\n ", "\n"),
-
-        ("3'", "3 prime"),
-        ("5'", "5 prime"),
-        ("2'", "2 prime"),
-        ("5′", "5 prime"),
-        ("3′", "3 prime"),
-        ("2′", "2 prime"),
-        ("T_m", "melting temperature"),
-        ("%", "percent"),
-        ("∼", "approximately"),
-        (" nt", " nucleotide"),
-        (" nts", " nucleotides"),
-        ("et al.", "and co-workers"),
-        ("e.g.", "for example"),
-        ("i.e.", "that is,"),
-
-        # Hyphens, etc:
-        ("---", "—"),  # em-dash
-        ("--", "—"),  # en-dash
-        # ("--", "-"),  # hyphen
-
-        # Other;
-        ("°", " degree "),  # hyphen
-        ("T_m", "melting temperature"),  # hyphen
-        ("T_ m", "melting temperature"),  # hyphen
-
-        # Specialized:
-        ("OH", "hydroxyl"),
-        (" KL", " kissing loop"),
-        (" MB", " molecular beacon"),
-        (" bp", " base-pair"),
-        (" kbp",  "kilo base pairs"),
-        (" kb", " kilo bases"),
-        ("K+", " potassium ions"),
-        ("Na+", " sodium ions"),
-        ("Mg2+", "magnesium"),
-        ("Mg 2+", "magnesium"),
-
-        ("G-quadruplex", "G quadruplex"),
-        ("G-tetrad", "G tetrad"),
-        ("G-tetrads", "G tetrads"),
-        ("siRNA", "SI RNA"),  # space or hyphen
-        ("dsRNA", "double stranded RNA"),  # space or hyphen
-        ("dsDNA", "double stranded DNA"),  # space or hyphen
-        # ("TALENs", "Ta-lens"),
-        # 3,5-difluoro-4-hydroxybenzylidene
-
-        # Trim excessive white space:
-        ("  ", " "),
-        ("  ", " "),
-
-    ]
-    # TODO: Disabled text replacements while checking grammar!!
-    # TODO: Just move all text replacements outside of this function and let this only deal with latex macros.
-    extra_text_replacements = [
-        # Trim excessive white space:
-        (" MB", "molecular beacon"),
-        ("   ", " "),
-        ("  ", " "),
-        ("  ", " "),
-        (" .", "."),
-        (" ,", ","),
-
-    ]
-    if extra_text_replacements:
-        text_replacements.extend(extra_text_replacements)
-
-    parser = pylatexenc.latexwalker.LatexWalker(
-        tex,
-        macro_dict=macro_node_defs,
-        keep_inline_math=False,  # True
-        tolerant_parsing=False,
-        strict_braces=False
-    )
-    (nodelist, tpos, tlen) = parser.get_latex_nodes(
-        stop_upon_closing_brace=None,
-        stop_upon_end_environment=None,
-        stop_upon_closing_mathmode=None
-    )
-
-    # (nodelist, tpos, tlen) = pylatexenc.latexwalker.get_latex_nodes(
-    #     tex, keep_inline_math=False, tolerant_parsing=False)
-
-    text = pylatexenc.latex2text.LatexNodes2Text(
-        env_dict=env_repr_dict,
-        macro_dict=macro_repr_dict,
-        text_replacements=text_replacements,
-        keep_inline_math=False,  # False = "replace $ with ' '"
-        keep_comments=False,
-    ).nodelist_to_text(nodelist, sep=" ")
-    return text
+    from tts_preprocessor.pattern_utils import CompiledDirective, ReplacementTuple, FIXED_TYPE, REGEX_TYPE
+    ops = []
+    for search, replace in text_replacements:
+        if not isinstance(replace, str):
+            return None
+        if isinstance(search, str):
+            ops.append(ReplacementTuple(search, replace, FIXED_TYPE))
+        elif isinstance(getattr(search, 'pattern', None), str) and not search.flags & ~re.UNICODE:
+            ops.append(ReplacementTuple(search.pattern, replace, REGEX_TYPE))
+        else:
+            return None
+    return CompiledDirective(ops, name="latex_text_replacements")
+
+
+class DirectiveTextReplacement:
+    """ A pylatexenc text replacement "pattern" applying a directive (pylatexenc calls `pattern.sub(repl, text)`). """
+
+    def __init__(self, directive):
+        self.directive = directive
+
+    def sub(self, repl, string):
+        return self.directive(string)
+
+
+_default_converter = None
+
+
+def get_default_converter():
+    """ Get the shared default LatexConverter (created when first needed). """
+    global _default_converter
+    if _default_converter is None:
+        _default_converter = LatexConverter()
+    return _default_converter
+
+
+def pylatexenc_convert(tex):
+    """ Convert tex to plain text, using the default LatexConverter. """
+    return get_default_converter().convert(tex)
+
+
+# Increment when the default conversion changes (this invalidates outputs recorded in manifests, see `manifest`):
+pylatexenc_convert.version = 2
+
+
+# The fast engine (`--latex-engine fast`, see `FastLatexConverter`):
+
+# pylatexenc's default text replacements (`latex2text.default_text_replacements`), applied before the extra ones:
+FAST_TEXT_REPLACEMENTS = [
+    ("~", " "),
+    ("``", '"'),
+    ("''", '"'),
+    (re.compile(r"(?<!\\)&"), "   "),  # Column separators (pylatexenc 1.5 has this as a string, which never matches)
+    ("\\&", "&"),
+]
+
+
+def format_equation(content):
+    """ Format the contents of an equation environment: indented, on lines of its own (as pylatexenc does). """
+    indent = " " * 4
+    return "\n" + indent + content.strip().replace("\n", "\n" + indent) + "\n"
+
+
+def accent_repl(combining):
+    """ Make a (callable) macro repl, adding the combining accent character to each character of the argument. """
+    def accent(optarg, args):
+        chars = args[0].strip() if args else ""
+        return unicodedata.normalize('NFC', "".join(
+            {"\N{LATIN SMALL LETTER DOTLESS I}": "i", "\N{LATIN SMALL LETTER DOTLESS J}": "j"}.get(ch, ch) + combining
+            for ch in chars))
+    return accent
+
+
+# Accent macros, (macname, combining character), as `latex2text.unicode_accents_list`:
+FAST_ACCENTS = (
+    ("'", "\u0301"), ("`", "\u0300"), ('"', "\u0308"), ("c", "\u0327"), ("^", "\u0302"), ("~", "\u0303"),
+    ("H", "\u030b"), ("k", "\u0328"), ("=", "\u0304"), ("b", "\u0331"), (".", "\u0307"), ("d", "\u0323"),
+    ("r", "\u030a"), ("u", "\u0306"), ("v", "\u030c"), ("vec", "\u20d7"), ("dot", "\u0307"), ("hat", "\u0302"),
+    ("check", "\u030c"), ("breve", "\u0306"), ("acute", "\u0301"), ("grave", "\u0300"), ("tilde", "\u0303"),
+    ("bar", "\u0305"), ("ddot", "\u0308"), ("not", "\u0338"),
+)
+
+# Symbol macros, {macname: text}, as in `latex2text.default_macro_dict`:
+FAST_SYMBOLS = {
+    "oe": "œ", "OE": "Œ", "ae": "æ", "AE": "Æ", "aa": "å", "AA": "Å", "o": "ø", "O": "Ø", "ss": "ß",
+    "L": "Ł", "l": "ł", "i": "ı", "j": "ȷ",
+    "&": "\\&", "$": "$", "{": "{", "}": "}", "#": "#", "_": "_", "\\": "\n",
+    ",": " ", ";": " ", ":": " ", " ": " ", "\n": " ", "!": "", "quad": "  ", "qquad": "    ",
+    "textquoteleft": "`", "textquoteright": "'", "textquotedblright": "”", "textquotedblleft": "“",
+    "textendash": "–", "textemdash": "—", "textpm": "±", "textmp": "∓", "texteuro": "€",
+    "hbar": "ħ", "ell": "ℓ", "forall": "∀", "complement": "∁", "partial": "∂", "exists": "∃", "nexists": "∄",
+    "varnothing": "∅", "emptyset": "∅", "aleph": "ℵ", "nabla": "∇", "in": "∈", "notin": "∉", "ni": "∋",
+    "prod": "∏", "coprod": "∐", "sum": "∑", "setminus": "∖", "smallsetminus": "∖", "ast": "∗", "circ": "∘",
+    "bullet": "∙", "propto": "∝", "infty": "∞", "parallel": "∥", "nparallel": "∦", "wedge": "∧", "vee": "∨",
+    "cap": "∩", "cup": "∪", "int": "∫", "iint": "∬", "iiint": "∭", "oint": "∮", "sim": "∼", "backsim": "∽",
+    "simeq": "≃", "approx": "≈", "neq": "≠", "equiv": "≡", "ge": ">", "le": "<", "leq": "≤", "geq": "≥",
+    "leqslant": "≤", "geqslant": "≥", "leqq": "≦", "geqq": "≧", "lneqq": "≨", "gneqq": "≩", "ll": "≪", "gg": "≫",
+    "nless": "≮", "ngtr": "≯", "nleq": "≰", "ngeq": "≱", "lesssim": "≲", "gtrsim": "≳", "lessgtr": "≶",
+    "gtrless": "≷", "prec": "≺", "succ": "≻", "preceq": "≼", "succeq": "≽", "precsim": "≾", "succsim": "≿",
+    "nprec": "⊀", "nsucc": "⊁", "subset": "⊂", "supset": "⊃", "subseteq": "⊆", "supseteq": "⊇",
+    "nsubseteq": "⊈", "nsupseteq": "⊉", "subsetneq": "⊊", "supsetneq": "⊋", "cdot": "·", "times": "×",
+    "otimes": "⊗", "oplus": "⊕", "bigotimes": "⊗", "bigoplus": "⊕", "cos": "cos", "sin": "sin", "tan": "tan",
+    "arccos": "arccos", "arcsin": "arcsin", "arctan": "arctan", "prime": "'", "dag": "†", "dagger": "†",
+    "pm": "±", "mp": "∓", "ldots": "...", "cdots": "...", "ddots": "...", "dots": "...", "langle": "〈",
+    "rangle": "〉", "mid": "|", "nmid": "∤", "uparrow": "↑", "downarrow": "↓", "rightarrow": "→", "to": "→",
+    "leftarrow": "←", "longrightarrow": "⟶", "longleftarrow": "⟵", "id": "𝕀", "Ident": "𝕀",
+    "varepsilon": "ε", "vartheta": "ϑ", "varpi": "ϖ", "varrho": "ϱ", "varsigma": "ς", "varphi": "φ",
+}
+FAST_SYMBOLS.update(zip((letter.capitalize() for letter in GREEK_LETTERS), "ΑΒΓΔΕΖΗΘΙΚΛΜΝΞΟΠΡΣΤΥΦΧΨΩ"))
+
+# Macros for the fast engine, (macname, simplify_repl, discard), as EXTRA_MACRO_REPRS (which are added after these).
+# These mirror `latex2text.default_macro_dict`; a callable simplify_repl is called as repl(optarg, args).
+FAST_MACRO_REPRS = [
+    ("emph",		None,				False),
+    ("textbf",		None,				False),
+    ("textit",		None,				False),
+    ("textsl",		None,				False),
+    ("textsc",		None,				False),
+    ("text",		None,				False),
+    ("mathrm",		None,				False),
+    ("includegraphics", "< g r a p h i c s >", True),
+    ("ref",			"<ref>",			True),
+    ("eqref",		"(<ref>)",			True),
+    ("url",			"<%s>",				True),
+    ("footnote",	"[%s]",				True),
+    ("frac",		"%s/%s",			True),
+    ("nicefrac",	"%s/%s",			True),
+    ("sqrt",		"√(%s)",			True),
+    ("ket",			"|%s〉",				True),
+    ("bra",			"〈%s|",				True),
+    ("braket",		"〈%s|%s〉",			True),
+    ("ketbra",		"|%s〉〈%s|",			True),
+    ("item",		lambda optarg, args: "\n  " + (optarg if optarg is not None else "*"), False),
+    ("texorpdfstring", lambda optarg, args: args[1] if len(args) > 1 else "", False),
+]
+FAST_MACRO_REPRS.extend((macname, repl, True) for macname, repl in FAST_SYMBOLS.items())
+FAST_MACRO_REPRS.extend((macname, accent_repl(combining), False) for macname, combining in FAST_ACCENTS)
+
+# Macro arguments, {macname: argspec}, as `latexwalker.default_macro_dict`: "[" is an optional argument,
+# "{" a mandatory argument. Other macros take no arguments (the extra macros take EXTRA_MACRO_NUMARGS arguments).
+FAST_MACRO_ARGSPECS = {
+    "\\": "[", "item": "[",
+    "emph": "{", "textbf": "{", "textit": "{", "textsl": "{", "textsc": "{", "text": "{", "mathrm": "{",
+    "includegraphics": "[{", "ref": "{", "eqref": "{", "url": "{", "footnote": "[{", "label": "{",
+    "frac": "{{", "nicefrac": "{{", "sqrt": "[{", "texorpdfstring": "{{",
+    "ket": "{", "bra": "{", "braket": "{{", "ketbra": "{{",
+    "hspace": "{", "vspace": "{", "hphantom": "[{", "vphantom": "[{",
+    "documentclass": "[{", "usepackage": "[{", "selectlanguage": "[{", "include": "{", "input": "{",
+    "hypersetup": "{", "keywords": "{", "DeclareMathOperator": "{{",
+    "newcommand": "{[[{", "renewcommand": "{[[{",
+    "setlength": "[{{", "addlength": "[{{", "setcounter": "[{{", "addcounter": "[{{",
+}
+FAST_MACRO_ARGSPECS.update((macname, "{") for macname, combining in FAST_ACCENTS)
+
+# Environments, {envname: simplify_repl}, as `latex2text.default_env_dict`; other environments are replaced
+# by their contents. A callable simplify_repl is called with the contents.
+FAST_ENV_REPRS = {
+    "equation": format_equation,
+    "eqnarray": format_equation,
+    "align": format_equation,
+    "multline": format_equation,
+    "gather": format_equation,
+    "dmath": format_equation,
+    "array": "< a r r a y >",
+    "pmatrix": "< p m a t r i x >",
+    "bmatrix": "< b m a t r i x >",
+    "smallmatrix": "< s m a l l m a t r i x >",
+    "center": "\n%s\n",
+    "flushleft": "\n%s\n",
+    "flushright": "\n%s\n",
+}
+
+
+def macro_argspec(numargs):
+    """ Get the argspec for a macro taking numargs arguments (and an optional argument, if it takes any). """
+    return "[" + "{" * numargs if numargs else ""
+
+
+# Tokens (in groups, environments, and arguments), in the order they are tried:
+FAST_TOKEN_REGEX = re.compile(
+    r"(?P<text>[^\\{}%\]\n]+)"
+    r"|\\(?P<word>[a-zA-Z]+\*?)(?P<space>[ \t]*(?:\n(?![ \t]*\n)[ \t]*)?)"  # A control word eats one line break
+    r"|\\(?P<symbol>[\s\S]?)"
+    r"|(?P<par>\n(?:[ \t]*\n)+)"
+    r"|(?P<newline>\n)"
+    r"|(?P<comment>%[^\n]*)"
+    r"|(?P<open>\{)"
+    r"|(?P<close>\})"
+    r"|(?P<bracket>\])"
+)
+# Space before a macro argument (comments included, but not paragraph breaks):
+FAST_ARG_SPACE_REGEX = re.compile(r"(?:[ \t]+|\n(?![ \t]*\n)|%[^\n]*)*")
+FAST_ENV_NAME_REGEX = re.compile(r"[ \t]*\{([^{}\\]*)\}")
+FAST_CONTROL_REGEX = re.compile(r"\\([a-zA-Z]+\*?|[\s\S]?)")
+
+# Frame kinds (see `FastLatexConverter.convert()`):
+ROOT, GROUP, ENV, ARG, OPTARG, MACRO = "root", "group", "env", "arg", "optarg", "macro"
+
+
+class _Frame:
+    """ An open group, environment, macro argument, or macro (waiting for its arguments), while converting. """
+    __slots__ = ('kind', 'name', 'pieces', 'argspec', 'args')
+
+    def __init__(self, kind, name=None, argspec=""):
+        self.kind = kind
+        self.name = name
+        self.pieces = []
+        self.argspec = argspec
+        self.args = []
+
+
+class FastLatexConverter:
+    """ Convert LaTeX to plain text in a single pass, without building a node tree (the "fast" LaTeX engine).
+
+    The text is tokenized with a single regex, left to right, and each token is expanded as it is read:
+    the text of open groups, environments, and macro arguments is collected on a stack of frames,
+    and a macro is replaced (by its simplify_repl) as soon as its last argument is closed.
+    The macro table is the same as `LatexConverter`'s, (macname, simplify_repl, discard) tuples and the
+    number of arguments of the extra macros, on top of a table mirroring pylatexenc's defaults
+    (`FAST_MACRO_REPRS`, `FAST_MACRO_ARGSPECS`, `FAST_ENV_REPRS`), so pylatexenc is not needed.
+    As with pylatexenc, unknown macros are discarded (their arguments, if any, are kept as text),
+    the text replacements are applied to the result, and `$` signs are removed.
+
+    Malformed input is never an error, and only affects the text close to it:
+    * A paragraph break (blank line) closes all open macro arguments (as in LaTeX, for most macros),
+        so e.g. a missing `}` in `\\cite{...` discards at most the rest of the paragraph.
+    * A missing argument (at a `}`, a paragraph break, or the end of the text) is empty.
+    * An `\\end{name}` closes everything opened since its `\\begin{name}`; without a `\\begin{name}`, it is ignored.
+    * A stray `}` or `]` is ignored (or kept as text, respectively); anything still open at the end is closed.
+
+    Differences from pylatexenc: whitespace between macros and groups is kept (e.g. `\\alpha \\beta` gives
+    "alpha beta", rather than "alphabeta"), and a macro given as an argument reads its own arguments.
+
+    Args:
+        extra_macro_reprs: List of (macname, simplify_repl, discard) tuples, for macros to add or override.
+        extra_macro_numargs: Dict with the number of arguments for the extra macros (default is 1).
+        extra_text_replacements: List of (search, replace) tuples, applied after the default text replacements.
+    """
+
+    def __init__(self, extra_macro_reprs=EXTRA_MACRO_REPRS, extra_macro_numargs=EXTRA_MACRO_NUMARGS,
+                 extra_text_replacements=EXTRA_TEXT_REPLACEMENTS):
+        self.macro_reprs = {macname: (repl, discard) for macname, repl, discard in FAST_MACRO_REPRS}
+        self.macro_argspecs = dict(FAST_MACRO_ARGSPECS)
+        for macname, repl, discard in extra_macro_reprs:
+            self.macro_reprs[macname] = (repl, discard)
+            self.macro_argspecs[macname] = macro_argspec(extra_macro_numargs.get(macname, 1))
+        self.env_reprs = dict(FAST_ENV_REPRS)
+        self.text_replacements = FAST_TEXT_REPLACEMENTS + list(extra_text_replacements)
+        self.text_directive = compile_text_replacements(self.text_replacements)
+
+    def expand_macro(self, macname, optarg=None, args=()):
+        """ Get the text for a macro, given the text of its optional argument (or None) and of its arguments. """
+        repl, discard = self.macro_reprs.get(macname.rstrip("*"), (None, True))
+        if callable(repl):
+            return repl(optarg, args)
+        if repl:
+            if "%" in repl:
+                try:
+                    return repl % tuple(args)
+                except (TypeError, ValueError):
+                    return repl
+            return repl
+        if discard:
+            return ""
+        return (optarg or "") + "".join(args)
+
+    def expand_env(self, envname, content):
+        """ Get the text for an environment, given the text of its contents. """
+        repl = self.env_reprs.get(envname.rstrip("*"))
+        if callable(repl):
+            return repl(content)
+        if repl:
+            if "%" in repl:
+                try:
+                    return repl % (content,)
+                except (TypeError, ValueError):
+                    return repl
+            return repl
+        return content
+
+    def close_frame(self, stack):
+        """ Close the innermost frame, adding its text to the frame enclosing it. """
+        frame = stack.pop()
+        if frame.kind == MACRO:
+            argspec, args = frame.argspec, frame.args
+            args.extend([None] * (len(argspec) - len(args)))  # Missing arguments
+            optargs = [arg for kind, arg in zip(argspec, args) if kind == "["]
+            text = "" if frame.name is None else self.expand_macro(
+                frame.name, optargs[0] if optargs else None,
+                [arg or "" for kind, arg in zip(argspec, args) if kind == "{"])
+        elif frame.kind == ENV:
+            text = self.expand_env(frame.name, "".join(frame.pieces))
+        else:
+            text = "".join(frame.pieces)
+        parent = stack[-1]
+        if parent.kind == MACRO:
+            parent.args.append(text)
+        else:
+            parent.pieces.append(text)
+
+    def read_argument(self, tex, pos, stack):
+        """ Read the next argument of the macro in the innermost frame, returning the new position. """
+        frame = stack[-1]
+        kind = frame.argspec[len(frame.args)]
+        start = pos
+        pos = FAST_ARG_SPACE_REGEX.match(tex, pos).end()
+        char = tex[pos:pos + 1]
+        if kind == "[":
+            if char == "[":
+                stack.append(_Frame(OPTARG))
+                return pos + 1
+            frame.args.append(None)
+            return start  # Keep the space, e.g. after `\\item`
+        if char == "{":
+            stack.append(_Frame(ARG))
+            return pos + 1
+        if char == "\\":
+            control = FAST_CONTROL_REGEX.match(tex, pos)
+            macname = control.group(1)
+            if macname not in ("begin", "end", ""):
+                argspec = self.macro_argspecs.get(macname.rstrip("*"))
+                if argspec:
+                    # The macro (with its own arguments) is the argument, e.g. `\emph\texorpdfstring{a}{b}`:
+                    stack.append(_Frame(MACRO, macname, argspec))
+                else:
+                    frame.args.append(self.expand_macro(macname))
+                return control.end()
+        elif char not in ("", "}", "\n") and not (char == "]" and stack[-2].kind == OPTARG):
+            frame.args.append(char)
+            return pos + 1
+        self.close_frame(stack)  # Missing argument(s)
+        return start
+
+    def convert(self, tex):
+        """ Convert tex to plain text. """
+        stack = [_Frame(ROOT)]
+        pos, end = 0, len(tex)
+        match_token = FAST_TOKEN_REGEX.match
+        while True:
+            frame = stack[-1]
+            if frame.kind == MACRO:
+                if len(frame.args) == len(frame.argspec):
+                    self.close_frame(stack)
+                else:
+                    pos = self.read_argument(tex, pos, stack)
+                continue
+            if pos >= end:
+                break
+            token = match_token(tex, pos)
+            kind = token.lastgroup
+            if kind == "text" or kind == "newline":
+                frame.pieces.append(token.group())
+            elif kind == "space":
+                macname = token.group("word")
+                if macname == "begin" or macname == "end":
+                    pos = self.environment(tex, token.end("word"), stack, macname)
+                    continue
+                argspec = self.macro_argspecs.get(macname.rstrip("*"))
+                if argspec:
+                    stack.append(_Frame(MACRO, macname, argspec))
+                    pos = token.end("word")  # The arguments may follow the space
+                    continue
+                frame.pieces.append(self.expand_macro(macname))
+                frame.pieces.append(token.group("space"))
+            elif kind == "symbol":
+                macname = token.group("symbol")
+                argspec = self.macro_argspecs.get(macname)
+                if argspec:
+                    stack.append(_Frame(MACRO, macname, argspec))
+                elif macname:
+                    frame.pieces.append(self.expand_macro(macname))
+            elif kind == "open":
+                stack.append(_Frame(GROUP))
+            elif kind == "close":
+                if frame.kind == GROUP or frame.kind == ARG:
+                    self.close_frame(stack)
+            elif kind == "bracket":
+                if frame.kind == OPTARG:
+                    self.close_frame(stack)
+                else:
+                    frame.pieces.append("]")
+            elif kind == "par":
+                # Recover from unclosed macro arguments (e.g. a missing `}`) at the end of the paragraph:
+                outermost = next((i for i, open_frame in enumerate(stack) if open_frame.kind == MACRO), None)
+                while outermost is not None and len(stack) > outermost:
+                    self.close_frame(stack)
+                stack[-1].pieces.append(token.group())
+            pos = token.end()
+        while len(stack) > 1:
+            self.close_frame(stack)
+        return self.apply_text_replacements("".join(stack[0].pieces))
+
+    def environment(self, tex, pos, stack, macname):
+        """ Read `\\begin{name}` or `\\end{name}` (after the macro name), returning the new position. """
+        name = FAST_ENV_NAME_REGEX.match(tex, pos)
+        if name is None:
+            return pos  # Not an environment, e.g. `\\begin` without a name: discarded, as an unknown macro
+        envname = name.group(1).strip()
+        pos = name.end()
+        if macname == "begin":
+            stack.append(_Frame(ENV, envname))
+            # An optional or regular argument right after `\\begin{name}` (e.g. `[h]`, `{ll}`) is discarded:
+            if tex[pos:pos + 1] in ("[", "{"):
+                stack.append(_Frame(MACRO, None, tex[pos]))
+            return pos
+        for i in range(len(stack) - 1, 0, -1):
+            if stack[i].kind == ENV and stack[i].name == envname:
+                while len(stack) > i:
+                    self.close_frame(stack)
+                break
+        return pos
+
+    def apply_text_replacements(self, text):
+        """ Apply the text replacements (in the same order as pylatexenc), and remove `$` signs. """
+        if self.text_directive is not None:
+            text = self.text_directive(text)
+        else:
+            for pattern, replacement in self.text_replacements:
+                text = pattern.sub(replacement, text) if hasattr(pattern, 'sub') else text.replace(pattern, replacement)
+        return text.replace("$", "")
+
+    def __call__(self, tex):
+        return self.convert(tex)
+
+
+_fast_converter = None
+
+
+def get_fast_converter():
+    """ Get the shared default FastLatexConverter (created when first needed). """
+    global _fast_converter
+    if _fast_converter is None:
+        _fast_converter = FastLatexConverter()
+    return _fast_converter
+
+
+def fast_latex_convert(tex):
+    """ Convert tex to plain text, using the default FastLatexConverter (the fast engine). """
+    return get_fast_converter().convert(tex)
+
+
+# Increment when the default conversion changes (see `pylatexenc_convert.version`):
+fast_latex_convert.version = 2
+
+# LaTeX engines, {--latex-engine: (converter factory, transformation name)}:
+LATEX_ENGINES = {
+    'pylatexenc': (get_default_converter, 'pylatexenc'),
+    'fast': (get_fast_converter, 'latex_fast'),
+}
 
 
 def main():
@@ -375,8 +856,16 @@ def main():
     ap.add_argument('texfile', nargs="+")
     ap.add_argument('-o', '--outputfnfmt', default="{texfile}.txt")
     ap.add_argument('--input-encoding', default="utf-8")
+    ap.add_argument('--latex-engine', choices=sorted(LATEX_ENGINES), default="pylatexenc",
+                    help="The LaTeX-to-text engine: pylatexenc, or the single-pass fast engine (which does not need "
+                         "pylatexenc, and recovers from syntax errors instead of skipping the file).")
 
     argns = ap.parse_args()
+    converter = LATEX_ENGINES[argns.latex_engine][0]()
+    if argns.latex_engine == "pylatexenc":
+        from pylatexenc.latexwalker import LatexWalkerParseError
+    else:
+        LatexWalkerParseError = ()  # The fast engine never raises parse errors
 
     for file in argns.texfile:
         print("\nReading tex from file:", file)
@@ -387,8 +876,8 @@ def main():
             print(e.__class__.__name__, e, " - skipping this file...")
             continue
         try:
-            text = pylatexenc_convert(tex)
-        except pylatexenc.latexwalker.LatexWalkerParseError as e:
+            text = converter.convert(tex)
+        except LatexWalkerParseError as e:
             print(e.__class__.__name__, e)
             print(" - skipping this file (%s)..." % (file,))
             continue
@@ -0,0 +1,168 @@
+"""
+
+Lexicon directives: expanding whole tokens (and multi-token phrases) using a token trie.
+
+A regular directive applies its ops one by one, so each fixed-string op costs a scan of the document,
+and the ops replace substrings anywhere, e.g. `nm --> nanometer` also rewrites "nm" inside other words.
+A lexicon tokenizes the document once, and only replaces whole tokens or phrases (sequences of tokens),
+looked up in a trie (nested dicts), so the cost depends on the length of the document, not on the size
+of the lexicon.
+
+Tokens are runs of letters, runs of digits, and single other (non-whitespace) characters,
+e.g. "et al. (5nm)" is tokenized as `et`, `al`, `.`, `(`, `5`, `nm`, `)`.
+An entry matches where the document has the same tokens, separated the same way: where the entry has
+whitespace between two tokens, the document must have whitespace (any amount, but at most one line break,
+so entries never match across paragraphs); where the entry has none, the document must have none.
+E.g. "et al." matches "et al." and "et\\nal.", but not "etal." or "et al" (without the period).
+At each position, the longest matching entry is used. Replacements are inserted as is
+(they are not matched again, and not treated as regex templates).
+
+Lexicons are loaded from the usual patterns files, using the `lexicon` option in the first-line config:
+
+    # {lexicon: true}
+    nm	 nanometer
+    et al.	and co-workers
+
+The regex/fixed-string type column is ignored (all entries are whole-token phrases).
+If an entry is listed twice, the first one is used (as it would be with regular ops).
+
+
+"""
+
+import re
+
+from tts_preprocessor.pattern_utils import CompiledDirective, ReplacementTuple
+
+TOKEN_REGEX = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+SPACE_REGEX = re.compile(r"\s+")
+SPACE = " "  # Trie key for whitespace between tokens
+END = None   # Trie key for the replacement of an entry ending at a node
+
+
+def tokenize_entry(phrase):
+    """ Tokenize a lexicon entry, returning the trie keys: tokens, with SPACE for whitespace between tokens. """
+    keys, pos = [], 0
+    phrase = phrase.strip()
+    for match in TOKEN_REGEX.finditer(phrase):
+        if match.start() > pos:
+            keys.append(SPACE)
+        keys.append(match.group())
+        pos = match.end()
+    return keys
+
+
+class Lexicon:
+    """ A lexicon transformation, replacing whole tokens and phrases (see module docstring).
+
+    Args:
+        directive_ops: A list of ReplacementTuples, (search phrase, replacement, ...).
+        name: The directive name.
+        options: Directive options, e.g. from the first-line config of a patterns file.
+    """
+
+    # Entries never match across a blank line, so documents can be transformed paragraph by paragraph
+    # (chunk-safe). Entries with whitespace can match across a line break, where streaming may split a long
+    # paragraph (see `streaming.read_blocks()`), so lexicons with such entries are not local:
+    local = True
+
+    def __init__(self, directive_ops, name=None, options=None):
+        self.name = name
+        self.ops = [ReplacementTuple(*operation) for operation in directive_ops]
+        self.options = options if options is not None else {}
+        self.trie = {}
+        self.entries = 0
+        for operation in self.ops:
+            keys = tokenize_entry(operation.search_pat or "")
+            if not keys:
+                continue
+            node = self.trie
+            for key in keys:
+                node = node.setdefault(key, {})
+            if END not in node:
+                node[END] = operation.replace_pat or ""
+                self.entries += 1
+                if SPACE in keys:
+                    self.local = False
+
+    @property
+    def chunk_safe(self):
+        return bool(self.options.get('chunk_safe', True))
+
+    @property
+    def fingerprint(self):
+        """ A hash of the lexicon's entries and options (see `CompiledDirective.fingerprint`). """
+        import hashlib
+        return hashlib.sha256(repr(("lexicon", [tuple(op) for op in self.ops], sorted(
+            self.options.items(), key=repr))).encode('utf-8')).hexdigest()
+
+    def __reduce__(self):
+        return self.__class__, (self.ops, self.name, self.options)
+
+    def __call__(self, string, verbose=0):
+        return self.substitute(string, verbose=verbose)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __iter__(self):
+        return iter(self.ops)
+
+    def __repr__(self):
+        return "<%s %r (%s entries)>" % (self.__class__.__name__, self.name, self.entries)
+
+    def longest_match(self, string, node, pos):
+        """ Continue matching an entry at pos (after its first token), returning (end, replacement) or None. """
+        best = None
+        if END in node:
+            best = (pos, node[END])
+        while True:
+            if SPACE in node:
+                space = SPACE_REGEX.match(string, pos)
+                if space is not None:
+                    if space.group().count("\n") > 1:
+                        break
+                    pos = space.end()
+                    node = node[SPACE]
+            token = TOKEN_REGEX.match(string, pos)
+            if token is None:
+                break
+            node = node.get(token.group())
+            if node is None:
+                break
+            pos = token.end()
+            if END in node:
+                best = (pos, node[END])
+        return best
+
+    def substitute(self, string, verbose=0):
+        """ Replace all lexicon entries in string, returning the transformed string. """
+        trie = self.trie
+        parts, last, matches = [], 0, 0
+        for token in TOKEN_REGEX.finditer(string):
+            start = token.start()
+            if start < last:
+                continue  # Inside a replaced phrase
+            node = trie.get(token.group())
+            if node is None:
+                continue
+            match = self.longest_match(string, node, token.end())
+            if match is None:
+                continue
+            end, replacement = match
+            parts.append(string[last:start])
+            parts.append(replacement)
+            last = end
+            matches += 1
+        if verbose > 0:
+            print("Lexicon %s: %s replacements (%s entries)." % (self.name, matches, self.entries))
+        if not parts:
+            return string
+        parts.append(string[last:])
+        return "".join(parts)
+
+
+def compile_directive(directive_ops, name=None, options=None):
+    """ Compile directive ops: to a Lexicon if the `lexicon` option is set, otherwise to a CompiledDirective. """
+    if options and options.get('lexicon'):
+        return Lexicon(directive_ops, name=name, options=options)
+    return CompiledDirective(directive_ops, name=name, options=options)
@@ -0,0 +1,131 @@
+"""
+
+Manifest of processed files, for incremental batch runs.
+
+For each output file, the manifest records:
+* the hash of the input file,
+* the fingerprint of the transformation chain (see `chain_fingerprint()`),
+* the (resolved) input and output encodings, and
+* the hash of the output file.
+
+If all of these still match, the output is up to date and the input file does not need to be processed again.
+When a file is processed, the output file is only rewritten if its content changes,
+so the output file's mtime (and anything downstream watching it) is left alone if nothing changed.
+
+The manifest is saved as a json file in each output directory (see `MANIFEST_FILENAME`),
+with entries keyed by the output file's base name.
+
+
+"""
+
+import os
+
+MANIFEST_FILENAME = ".tts_manifest.json"
+
+
+def bytes_hash(data):
+    import hashlib
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    """ Return the hash of the file's content, or None if the file does not exist. """
+    try:
+        with open(path, mode='rb') as fp:
+            return bytes_hash(fp.read())
+    except FileNotFoundError:
+        return None
+
+
+def transform_fingerprint(transform):
+    """ Get a fingerprint for a single transformation.
+
+    Transformations can provide a `fingerprint` attribute (e.g. CompiledDirective, based on its ops).
+    For other transformations (functions), the fingerprint is the function's name and its `version` attribute,
+    so e.g. `pylatexenc_convert.version` should be incremented whenever its output changes.
+    """
+    fingerprint = getattr(transform, 'fingerprint', None)
+    if fingerprint is not None:
+        return str(fingerprint)
+    name = getattr(transform, '__qualname__', None) or type(transform).__qualname__
+    return "%s.%s:%s" % (getattr(transform, '__module__', None), name, getattr(transform, 'version', None))
+
+
+def chain_fingerprint(transformations):
+    """ Get a fingerprint for a chain (list) of transformations. """
+    return bytes_hash("\n".join(transform_fingerprint(transform) for transform in transformations).encode('utf-8'))
+
+
+def write_if_changed(outputfn, content, encoding):
+    """ Write content to outputfn, unless the file already has exactly that content. Returns the output hash. """
+    data = content.replace("\n", os.linesep).encode(encoding)
+    output_hash = bytes_hash(data)
+    if file_hash(outputfn) != output_hash:
+        with open(outputfn, mode='wb') as fp:
+            fp.write(data)
+    return output_hash
+
+
+def replace_if_changed(tmpfn, outputfn):
+    """ Replace outputfn with tmpfn, unless they have the same content (then tmpfn is removed). Returns the hash. """
+    output_hash = file_hash(tmpfn)
+    if file_hash(outputfn) == output_hash:
+        os.remove(tmpfn)
+    else:
+        os.replace(tmpfn, outputfn)
+    return output_hash
+
+
+class Manifest:
+    """ Manifest of processed files (see module docstring).
+
+    Args:
+        fingerprint: The fingerprint of the transformation chain used for this run.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.manifests = {}  # {manifest_path: {output_basename: entry}}
+        self.changed = set()  # Manifest paths with new entries
+
+    @staticmethod
+    def manifest_path(outputfn):
+        return os.path.join(os.path.dirname(os.path.abspath(outputfn)), MANIFEST_FILENAME)
+
+    def entries(self, outputfn):
+        path = self.manifest_path(outputfn)
+        if path not in self.manifests:
+            import json
+            try:
+                with open(path, encoding='utf-8') as fp:
+                    self.manifests[path] = json.load(fp)
+            except (OSError, ValueError):
+                self.manifests[path] = {}
+        return self.manifests[path]
+
+    def is_current(self, outputfn, input_hash, encodings=None):
+        """ Return True if outputfn was produced from input with input_hash by the same chain, and is unchanged.
+
+        encodings, (inputencoding, outputencoding), must also be the same as when outputfn was produced.
+        """
+        entry = self.entries(outputfn).get(os.path.basename(outputfn))
+        return (entry is not None and entry['input_hash'] == input_hash and entry['fingerprint'] == self.fingerprint
+                and entry.get('encodings') == (list(encodings) if encodings is not None else None)
+                and entry['output_hash'] == file_hash(outputfn))
+
+    def make_entry(self, inputfile, input_hash, output_hash, encodings=None):
+        return {'input': inputfile, 'input_hash': input_hash, 'fingerprint': self.fingerprint,
+                'encodings': list(encodings) if encodings is not None else None, 'output_hash': output_hash}
+
+    def record(self, outputfn, entry):
+        self.entries(outputfn)[os.path.basename(outputfn)] = entry
+        self.changed.add(self.manifest_path(outputfn))
+
+    def save(self):
+        import json
+        for path in sorted(self.changed):
+            tmppath = path + ".tmp"
+            with open(tmppath, mode='w', encoding='utf-8') as fp:
+                json.dump(self.manifests[path], fp, indent=1, sort_keys=True)
+            os.replace(tmppath, path)
+        self.changed.clear()
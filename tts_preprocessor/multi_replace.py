@@ -0,0 +1,275 @@
+"""
+
+Single-pass replacement of many fixed strings.
+
+A run of fixed-string ops, [(search_1, replace_1), (search_2, replace_2), ...], applied one by one
+with `str.replace()` scans (and copies) the whole document once per op.
+For large lexicons, this makes the cost proportional to len(text) * len(lexicon).
+
+Instead, the search strings of a run of ops can be compiled into a single automaton,
+which rewrites the text in a single left-to-right pass.
+The automaton used here is a trie of the search strings, expressed as a regular expression, e.g.
+
+    ["nm", "nM", "μm", "μM", "μ"]  -->  (?:n[Mm]|μ(?:[Mm])?)
+
+and executed by the `re` module. This keeps the per-character cost bounded by the length of the
+longest search string (independent of the number of search strings), and runs the scanning in C
+(a pure-python Aho-Corasick automaton is considerably slower than this for all practical lexicons).
+
+
+When is single-pass replacement equivalent to sequential replacement?
+---------------------------------------------------------------------
+
+Applying ops one by one, an earlier op "wins" over a later op, e.g.
+("ab", "X") then ("ca", "Y") gives "cX" for "cab", and ("μ", " micron ") then ("μm", " micrometer ")
+never replaces "μm". These *overlapping* search strings are handled by the single pass, which
+selects matches by op order, the same way as applying the ops one by one would.
+
+However, the single pass never re-scans replaced text, so it gives a different result if
+the replacement of an earlier op can *create* a match for a later op, either within the replacement
+itself, or by joining text on either side of it. Example: ("nm", " nanometer ") then (" n", "N").
+
+Ops that neither create matches for each other, nor have overlapping search strings, commute.
+`layer_fixed_ops()` uses this to arrange a run of ops in layers, such that ops that can create matches
+for each other end up in different layers (in their original order), and each layer can be applied
+in a single pass.
+
+
+"""
+
+import re
+from collections import defaultdict
+
+
+def _substrings(string, maxlen=None):
+    """ Generate all non-empty substrings of string (with length at most maxlen). """
+    n = len(string)
+    if maxlen is None:
+        maxlen = n
+    for start in range(n):
+        for stop in range(start + 1, min(n, start + maxlen) + 1):
+            yield string[start:stop]
+
+
+def layer_fixed_ops(pairs):
+    """ Arrange a sequence of (search, replace) pairs in layers that can each be applied in a single pass.
+
+    For two ops i < k:
+    * If either op can create matches for the other (when applied in either order),
+        k is placed in a later layer than i.
+    * If their search strings overlap (one contains the other, or the end of one is the start of the other),
+        k is placed in the same or a later layer than i.
+    * Otherwise, the ops commute, and can be placed in any layer.
+
+    Args:
+        pairs: A list of (search_str, replace_str) tuples, in the order they are applied.
+
+    Returns:
+        A list of layers, each layer being a list of indices into pairs (in ascending order).
+        Applying the layers in order, with the ops within each layer applied in a single pass
+        (see `MultiReplacer`), gives the same result as applying the ops one by one.
+    """
+    layers = []
+    layer_of = []
+    maxlen = max((len(search) for search, _ in pairs), default=0)
+    pattern_set = {search for search, _ in pairs}
+    # Search strings found within replacement strings, {search: [indices of the replacements]}:
+    in_replacements = defaultdict(list)
+    for i, (_, replace) in enumerate(pairs):
+        for sub in set(_substrings(replace, maxlen)) & pattern_set:
+            in_replacements[sub].append(i)
+
+    # Lookup tables for earlier ops, {key: max layer of the ops having that key}:
+    replacements = {}            # replace
+    replacement_suffixes = {}    # suffixes of replace
+    replacement_prefixes = {}    # prefixes of replace
+    patterns = {}                # search
+    pattern_substrings = {}      # substrings of search
+    pattern_prefixes = {}        # proper prefixes of search
+    pattern_suffixes = {}        # proper suffixes of search
+    empty_replacements = -1      # max layer of deletions
+    long_patterns = -1           # max layer of search strings with more than one character
+
+    def update(table, key, layer):
+        if table.get(key, -1) < layer:
+            table[key] = layer
+
+    for k, (search, replace) in enumerate(pairs):
+        creates = [-1]  # Layers of earlier ops that can create matches for op k (or vice versa)
+        overlaps = [0]  # Layers of earlier ops with search strings overlapping search string k
+
+        # 1. An earlier op can create a match for op k:
+        # Search string k contained in an earlier replacement:
+        creates.extend(layer_of[i] for i in in_replacements.get(search, ()) if i < k)
+        search_substrings = set(_substrings(search))
+        for sub in search_substrings:
+            # Earlier replacement contained in search string k (might join text into a match):
+            creates.append(replacements.get(sub, -1))
+        for cut in range(1, len(search)):
+            # Earlier replacement ends with the start of search string k (or starts with its end):
+            creates.append(replacement_suffixes.get(search[:cut], -1))
+            creates.append(replacement_prefixes.get(search[cut:], -1))
+        if len(search) > 1:
+            # Deleting text can join text on either side into a match:
+            creates.append(empty_replacements)
+
+        # 2. Op k can create a match for an earlier op:
+        if replace:
+            for sub in set(_substrings(replace, maxlen)):
+                creates.append(patterns.get(sub, -1))
+            creates.append(pattern_substrings.get(replace, -1))
+            for cut in range(len(replace)):
+                creates.append(pattern_prefixes.get(replace[cut:], -1))
+                creates.append(pattern_suffixes.get(replace[:cut + 1], -1))
+        else:
+            creates.append(long_patterns)
+
+        # 3. Overlapping search strings:
+        overlaps.append(pattern_substrings.get(search, -1))
+        for sub in search_substrings:
+            overlaps.append(patterns.get(sub, -1))
+        for cut in range(1, len(search)):
+            overlaps.append(pattern_suffixes.get(search[:cut], -1))
+            overlaps.append(pattern_prefixes.get(search[cut:], -1))
+
+        layer = max(max(creates) + 1, max(overlaps))
+        layer_of.append(layer)
+        if layer == len(layers):
+            layers.append([])
+        layers[layer].append(k)
+
+        if replace:
+            update(replacements, replace, layer)
+            for cut in range(len(replace)):
+                update(replacement_suffixes, replace[cut:], layer)
+                update(replacement_prefixes, replace[:cut + 1], layer)
+        else:
+            empty_replacements = max(empty_replacements, layer)
+        update(patterns, search, layer)
+        for sub in search_substrings:
+            update(pattern_substrings, sub, layer)
+        for cut in range(1, len(search)):
+            update(pattern_prefixes, search[:cut], layer)
+            update(pattern_suffixes, search[cut:], layer)
+        if len(search) > 1:
+            long_patterns = max(long_patterns, layer)
+
+    return layers
+
+
+def have_overlaps(strings):
+    """ Return True if any of the strings contains another, or if the end of one string is the start of another. """
+    strings = set(strings)
+    prefixes = {string[:cut] for string in strings for cut in range(1, len(string))}
+    for string in strings:
+        if any(string[cut:] in prefixes for cut in range(1, len(string))):
+            return True
+        if any(sub in strings for sub in _substrings(string) if sub != string):
+            return True
+    return False
+
+
+def trie_regex(strings):
+    """ Create a regular expression matching any of the given strings, preferring the longest match.
+
+    The strings are arranged in a trie, so that the regex engine only has to consider
+    the strings sharing a prefix with the text at a given position.
+    """
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[""] = True  # Terminal marker
+
+    def node_regex(node):
+        terminal = "" in node
+        children = sorted((char, child) for char, child in node.items() if char)
+        if not children:
+            return ""
+        leaves = [char for char, child in children if len(child) == 1 and "" in child]
+        branches = [re.escape(char) + node_regex(child) for char, child in children
+                    if not (len(child) == 1 and "" in child)]
+        if leaves:
+            branches.append(re.escape(leaves[0]) if len(leaves) == 1
+                            else "[" + "".join(re.escape(char) for char in leaves) + "]")
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        regex = "(?:" + "|".join(branches) + ")"
+        if terminal:
+            regex += "?"
+        return regex
+
+    return node_regex(trie)
+
+
+class MultiReplacer:
+    """ Replace many fixed strings in a single pass.
+
+    Matches are selected the same way as replacing each string in turn with `str.replace()` would,
+    as long as no replacement can create new matches (see `layer_fixed_ops()`).
+
+    Args:
+        pairs: A list of (search_str, replace_str) tuples, in the order they should be applied.
+            If the same search string occurs more than once, the first one is used.
+    """
+
+    def __init__(self, pairs):
+        self.table = {}
+        self.priority = {}
+        for search, replace in pairs:
+            if search not in self.table:
+                self.table[search] = replace
+                self.priority[search] = len(self.priority)
+        regex = trie_regex(self.table)
+        self.regex = re.compile(regex)
+        self.repl = lambda match: self.table[match.group()]
+        self.overlapping = have_overlaps(self.table)
+        if self.overlapping:
+            # Find all (overlapping) matches, using a lookahead:
+            self.lookahead_regex = re.compile("(?=(%s))" % regex)
+            self.lengths = sorted({len(search) for search in self.table}, reverse=True)
+
+    def __call__(self, string):
+        return self.subn(string)[0]
+
+    def subn(self, string):
+        """ Perform all replacements, returning (new_string, number_of_replacements). """
+        if not self.overlapping:
+            # No two search strings can match overlapping text, so "longest match" is the only rule needed:
+            return self.regex.subn(self.repl, string)
+        return self._subn_overlapping(string)
+
+    def _subn_overlapping(self, string):
+        """ Select matches in op order: each op takes the leftmost matches not overlapping matches of earlier ops. """
+        table, priority = self.table, self.priority
+        candidates = []
+        for match in self.lookahead_regex.finditer(string):
+            start, longest = match.start(), match.group(1)
+            for length in self.lengths:
+                if length <= len(longest):
+                    search = longest[:length]
+                    if search in table:
+                        candidates.append((priority[search], start, start + length, search))
+        if not candidates:
+            return string, 0
+        candidates.sort()
+        covered = bytearray(len(string))
+        selected = []
+        current, last_end = None, 0
+        for prio, start, end, search in candidates:
+            if prio != current:
+                current, last_end = prio, 0
+            if start >= last_end and covered.find(1, start, end) == -1:
+                covered[start:end] = b"\x01" * (end - start)
+                last_end = end
+                selected.append((start, end, search))
+        selected.sort()
+        pieces = []
+        pos = 0
+        for start, end, search in selected:
+            pieces.append(string[pos:start])
+            pieces.append(table[search])
+            pos = end
+        pieces.append(string[pos:])
+        return string[:0].join(pieces), len(selected)  # (str or bytes)
@@ -0,0 +1,247 @@
+"""
+
+Op coverage: Which ops in a directive actually match anything in a corpus of documents?
+
+Large directives (e.g. lexicons with thousands of entries) cost a scan of the document for each op,
+whether it matches anything or not. OpCoverage runs a corpus through a chain of transformations,
+applying the ops of each directive one by one, and counts for each op:
+* the number of matches, and
+* the number of matches where the replacement is identical to the matched text.
+
+Ops are then classified as:
+* dead: Never matched anything in the corpus,
+* rare: Matched at most `rare` times,
+* identity: Matched, but always replaced the match with identical text (i.e. the op has no effect).
+
+Removing dead and identity ops does not change the output for any document in the corpus
+(so `write_pruned_patterns()` removes these by default). Removing rare ops does change the output,
+so it has to be requested explicitly.
+
+OBS: Ops are applied one by one (not fused, see `pattern_utils.compile_operations()`),
+which gives the same result, but is slower than applying the compiled directive.
+
+OBS: Lexicons (see `lexicon_processing`) apply all their entries in a single pass, so their coverage
+is not recorded; they are applied as usual, and listed as not covered in the report.
+
+
+"""
+
+import os
+
+from tts_preprocessor.pattern_utils import CompiledDirective, FixedStringOp, RegexOp, is_fixed_op
+from tts_preprocessor.pattern_utils import extract_first_line_config
+from tts_preprocessor.lexicon_processing import Lexicon
+from tts_preprocessor.directives import REGISTERED_FILE_STATS, REGISTERED_TRANSFORMATIONS, STRUCTURED_FORMATS
+
+DEFAULT_RARE = 2
+
+
+class OpCounts:
+    """ Match counts for a single op. """
+
+    def __init__(self, index, operation):
+        self.index = index
+        self.operation = operation
+        self.matches = 0
+        self.identical = 0  # Matches replaced with identical text
+
+    @property
+    def identity(self):
+        return self.matches > 0 and self.identical == self.matches
+
+    def as_dict(self):
+        return {'index': self.index, 'search_pat': self.operation.search_pat,
+                'replace_pat': self.operation.replace_pat, 'matches': self.matches, 'identical': self.identical}
+
+
+def count_fixed(op, string, counts):
+    matches = string.count(op.search_pat)
+    counts.matches += matches
+    if op.search_pat == op.replace_pat:
+        counts.identical += matches
+    return op(string)
+
+
+def count_regex(op, string, counts):
+    repl = op.repl  # A function, or a string (for replacements without group references)
+
+    def counting_repl(match):
+        replacement = repl if isinstance(repl, str) else repl(match)
+        counts.matches += 1
+        if replacement == match.group():
+            counts.identical += 1
+        return replacement
+    return op.regex.sub(counting_repl, string)
+
+
+class DirectiveCoverage:
+    """ Coverage of the ops in a single directive. """
+
+    def __init__(self, directive):
+        self.directive = directive
+        self.name = directive.name
+        self.filename = directive_file(directive)
+        self.documents = 0
+        self.counts = [OpCounts(index, operation) for index, operation in enumerate(directive.ops)]
+        # Fixed-string ops without a search string are applied as regex ops (as by `compile_operations()`):
+        self.compiled = [(FixedStringOp(operation), count_fixed) if is_fixed_op(operation)
+                         else (RegexOp(operation), count_regex)
+                         for operation in directive.ops]
+
+    def __call__(self, string):
+        self.documents += 1
+        for (op, count), counts in zip(self.compiled, self.counts):
+            string = count(op, string, counts)
+        return string
+
+    def dead(self):
+        return [counts for counts in self.counts if counts.matches == 0]
+
+    def rare(self, rare=DEFAULT_RARE):
+        return [counts for counts in self.counts if 0 < counts.matches <= rare]
+
+    def identity(self):
+        return [counts for counts in self.counts if counts.identity]
+
+    def prune_indices(self, prune_rare=None):
+        """ Get the indices of the ops to prune: dead and identity ops, and ops with at most prune_rare matches. """
+        limit = 0 if prune_rare is None else prune_rare
+        return {counts.index for counts in self.counts if counts.matches <= limit or counts.identity}
+
+    def report(self, rare=DEFAULT_RARE, verbose=0):
+        lines = ["%s (%s): %s ops, %s documents: %s dead, %s rare (1-%s matches), %s identity." % (
+            self.name, self.filename or "not from a file", len(self.counts), self.documents,
+            len(self.dead()), len(self.rare(rare)), rare, len(self.identity()))]
+        if verbose:
+            for title, counts_list in (("Dead", self.dead()), ("Rare", self.rare(rare)),
+                                       ("Identity", self.identity())):
+                for counts in counts_list:
+                    lines.append("    %-8s op %4d (%3d matches): %r --> %r" % (
+                        title, counts.index, counts.matches, counts.operation.search_pat,
+                        counts.operation.replace_pat))
+        return "\n".join(lines)
+
+    def as_dict(self):
+        return {'name': self.name, 'filename': self.filename, 'documents': self.documents,
+                'ops': [counts.as_dict() for counts in self.counts]}
+
+
+def directive_file(directive):
+    """ Return the patterns file a (registered) directive was loaded from, or None. """
+    for filename in REGISTERED_FILE_STATS:
+        if REGISTERED_TRANSFORMATIONS.get(filename) is directive:
+            return filename
+    return None
+
+
+class OpCoverage:
+    """ Runs documents through a chain of transformations, recording the coverage of each directive's ops.
+
+    Args:
+        transformations: The chain of transformations. Coverage is recorded for the CompiledDirectives;
+            other transformations (e.g. `pylatexenc`, and Lexicons) are applied as usual.
+    """
+
+    def __init__(self, transformations):
+        self.chain = [DirectiveCoverage(transform) if isinstance(transform, CompiledDirective) else transform
+                      for transform in transformations]
+        self.directives = [transform for transform in self.chain if isinstance(transform, DirectiveCoverage)]
+        self.lexicons = [transform for transform in self.chain if isinstance(transform, Lexicon)]
+
+    def __call__(self, text):
+        for transform in self.chain:
+            text = transform(text)
+        return text
+
+    def report(self, rare=DEFAULT_RARE, verbose=0):
+        lines = [coverage.report(rare=rare, verbose=verbose) for coverage in self.directives]
+        lines.extend("%s: Lexicon (%s entries), op coverage is not supported for lexicons." % (
+            lexicon.name, lexicon.entries) for lexicon in self.lexicons)
+        return "\n".join(lines)
+
+    def as_dict(self):
+        return {'directives': [coverage.as_dict() for coverage in self.directives]}
+
+
+# Directive options which can select ops by index (see `pattern_utils.option_op_indices()`):
+OP_INDEX_OPTIONS = ("sequential", "no_prefilter")
+
+
+def renumber_op_index_options(options, prune_indices):
+    """ Get a copy of directive options for the pruned ops, or None if the options are not changed by pruning.
+
+    Op indices in `OP_INDEX_OPTIONS` are renumbered, and the indices of pruned ops are dropped
+    (search patterns and `true` are kept as they are).
+    """
+    renumbered = dict(options)
+    for key in OP_INDEX_OPTIONS:
+        selected = options.get(key)
+        if not isinstance(selected, list):
+            continue
+        renumbered[key] = [item - sum(1 for index in prune_indices if index < item) if isinstance(item, int) else item
+                           for item in selected if not (isinstance(item, int) and item in prune_indices)]
+    return renumbered if renumbered != options else None
+
+
+def write_pruned_patterns(filename, prune_indices, outputfn):
+    """ Write a copy of patterns file, without the ops with the given indices.
+
+    For text patterns files, the lines of the pruned ops are removed (keeping comments and the first-line config).
+    For structured (json/yaml/pickle) files, the pruned entries are removed from the 'substitutions'.
+    Op indices in the directive options are renumbered (see `renumber_op_index_options()`).
+
+    Returns:
+        The number of ops removed.
+    """
+    fnext = os.path.splitext(filename)[1][1:].lower()
+    if fnext in STRUCTURED_FORMATS:
+        return _write_pruned_structured(filename, fnext, prune_indices, outputfn)
+    with open(filename) as fp:
+        lines = fp.read().strip().split("\n")
+    options = renumber_op_index_options(extract_first_line_config(lines), prune_indices)
+    if options is not None:
+        import yaml
+        lines[0] = "# " + yaml.safe_dump(options, default_flow_style=True, width=float("inf"), sort_keys=False).strip()
+    kept, index, removed = [], 0, 0
+    for line in lines:
+        # The same lines as `pattern_utils.tsv_to_list()` reads as ops:
+        stripped = line.strip()
+        if stripped and stripped[0] != '#':
+            index += 1
+            if index - 1 in prune_indices:
+                removed += 1
+                continue
+        kept.append(line)
+    with open(outputfn, mode='w') as fp:
+        fp.write("\n".join(kept) + "\n")
+    return removed
+
+
+def _write_pruned_structured(filename, fmt, prune_indices, outputfn):
+    if fmt == "json":
+        import json as serializer
+    elif fmt == "pickle":
+        import pickle as serializer
+    else:
+        import yaml
+        serializer = None
+    mode = 'b' if fmt == "pickle" else ''
+    with open(filename, mode='r' + mode) as fp:
+        data = yaml.safe_load(fp) if serializer is None else serializer.load(fp)
+    subs_defs = data['substitutions']
+    if isinstance(subs_defs, dict):
+        keys = list(subs_defs)
+        data['substitutions'] = {key: subs_defs[key] for index, key in enumerate(keys) if index not in prune_indices}
+    else:
+        data['substitutions'] = [item for index, item in enumerate(subs_defs) if index not in prune_indices]
+    options = renumber_op_index_options(data.get('options') or {}, prune_indices)
+    if options is not None:
+        data['options'] = options
+    with open(outputfn, mode='w' + mode) as fp:
+        if serializer is None:
+            yaml.safe_dump(data, fp, allow_unicode=True, sort_keys=False)
+        elif fmt == "json":
+            serializer.dump(data, fp, indent=2, ensure_ascii=False)
+        else:
+            serializer.dump(data, fp)
+    return len(subs_defs) - len(data['substitutions'])
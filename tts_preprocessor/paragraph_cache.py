@@ -0,0 +1,202 @@
+"""
+
+Paragraph-level memoization of the transformation chain.
+
+Documents often change in only a few paragraphs between runs. With a ParagraphCache, the text is split
+into paragraphs, and each paragraph is looked up in the cache, keyed by (paragraph hash, chain fingerprint).
+Only the paragraphs not found in the cache are transformed, so re-processing an edited document
+costs time proportional to the edit, rather than to the size of the document.
+
+The cache has two tiers:
+* An in-memory LRU cache (with a maximum number of entries), and
+* An optional SQLite database on disk, evicting the least recently used entries when it grows larger than
+  its maximum size.
+
+Splitting into paragraphs is only valid if all transformations are chunk-safe (see `parallel.is_chunk_safe()`);
+otherwise, the whole text is treated as a single "paragraph" (which is still memoized).
+
+
+"""
+
+import os
+import time
+from collections import OrderedDict
+# OBS: hashlib and sqlite3 are imported when needed, to keep start-up fast.
+
+from tts_preprocessor.parallel import CHUNK_BOUNDARY_REGEX, is_chunk_safe
+from tts_preprocessor.manifest import chain_fingerprint
+
+DEFAULT_MAXSIZE = 20000  # Number of entries in the in-memory (LRU) cache
+DEFAULT_DB_MAXSIZE = 2**28  # bytes; the approximate maximum size of the on-disk cache (256 MB)
+DB_EVICT_FRACTION = 0.8  # When the database is too large, evict entries until it is at this fraction of maxsize
+DB_BATCH_SIZE = 500  # Number of keys per database query (SQLite limits the number of query parameters)
+
+
+def split_paragraphs(text):
+    """ Split text into paragraphs, at the chunk boundaries given by `parallel.CHUNK_BOUNDARY_REGEX`.
+
+    Joining the paragraphs gives the original text.
+    """
+    paragraphs = []
+    start = 0
+    for match in CHUNK_BOUNDARY_REGEX.finditer(text):
+        end = match.end()
+        paragraphs.append(text[start:end])
+        start = end
+    paragraphs.append(text[start:])
+    return paragraphs
+
+
+def paragraph_hash(paragraph):
+    import hashlib
+    return hashlib.sha1(paragraph.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class ParagraphCache:
+    """ Two-tier (memory and disk) cache of transformed paragraphs (see module docstring).
+
+    Args:
+        path: The SQLite database file used for the on-disk tier. If None, only the in-memory tier is used.
+        maxsize: The maximum number of entries in the in-memory tier.
+        db_maxsize: The approximate maximum size (in bytes) of the transformed text stored in the on-disk tier.
+
+    The database connection is opened when first needed (and is not pickled), so the cache can be passed to
+    worker processes; each worker then has its own in-memory tier, and they share the on-disk tier.
+    """
+
+    def __init__(self, path=None, maxsize=DEFAULT_MAXSIZE, db_maxsize=DEFAULT_DB_MAXSIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self.db_maxsize = db_maxsize
+        self.memory = OrderedDict()  # {(paragraph_hash, fingerprint): transformed}
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._db_size = None  # Approximate size of the on-disk tier, updated as entries are added.
+
+    def __getstate__(self):
+        return {'path': self.path, 'maxsize': self.maxsize, 'db_maxsize': self.db_maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def db(self):
+        if self._db is None and self.path is not None:
+            import sqlite3
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS paragraphs ("
+                "hash TEXT NOT NULL, fingerprint TEXT NOT NULL, transformed TEXT NOT NULL, "
+                "size INTEGER NOT NULL, atime REAL NOT NULL, PRIMARY KEY (hash, fingerprint))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS paragraphs_atime ON paragraphs (atime)")
+            self._db.commit()
+            self._db_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM paragraphs").fetchone()[0]
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key, transformed):
+        self.memory[key] = transformed
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def apply(self, text, transformations, fingerprint=None):
+        """ Apply transformations to text, using cached results for unchanged paragraphs.
+
+        Args:
+            text: The text to transform.
+            transformations: The chain of transformations.
+            fingerprint: The chain's fingerprint (see `manifest.chain_fingerprint()`), if already calculated.
+
+        Returns:
+            The transformed text, the same as applying the transformations directly.
+        """
+        if fingerprint is None:
+            fingerprint = chain_fingerprint(transformations)
+        if all(is_chunk_safe(transform) for transform in transformations):
+            paragraphs = split_paragraphs(text)
+        else:
+            paragraphs = [text]
+        keys = [(paragraph_hash(paragraph), fingerprint) for paragraph in paragraphs]
+        results = {}  # {key: transformed}, for the paragraphs in this text
+        for key in keys:
+            if key not in results and key in self.memory:
+                self.memory.move_to_end(key)
+                results[key] = self.memory[key]
+        missing = {key for key in keys if key not in results}
+        if missing and self.db is not None:
+            for key, transformed in self._db_lookup(missing, fingerprint).items():
+                self._remember(key, transformed)
+                results[key] = transformed
+        new_entries = {}
+        for paragraph, key in zip(paragraphs, keys):
+            if key in results:
+                continue
+            transformed = paragraph
+            for transform in transformations:
+                transformed = transform(transformed)
+            results[key] = new_entries[key] = transformed
+            self._remember(key, transformed)
+        self.misses += len(new_entries)
+        self.hits += len(keys) - len(new_entries)
+        if new_entries and self.db is not None:
+            self._db_store(new_entries)
+        return "".join(results[key] for key in keys)
+
+    def _db_lookup(self, keys, fingerprint):
+        """ Look up keys in the on-disk tier, returning {key: transformed} for the keys found. """
+        found = {}
+        hashes = sorted(paragraph_hash for paragraph_hash, _ in keys)
+        now = time.time()
+        for i in range(0, len(hashes), DB_BATCH_SIZE):
+            batch = hashes[i:i+DB_BATCH_SIZE]
+            rows = self.db.execute(
+                "SELECT hash, transformed FROM paragraphs WHERE fingerprint = ? AND hash IN (%s)"
+                % (",".join("?" * len(batch)),), [fingerprint] + batch).fetchall()
+            for paragraph_hash, transformed in rows:
+                found[(paragraph_hash, fingerprint)] = transformed
+        if found:
+            with self.db:
+                self.db.executemany("UPDATE paragraphs SET atime = ? WHERE hash = ? AND fingerprint = ?",
+                                    [(now, paragraph_hash, fingerprint) for paragraph_hash, fingerprint in found])
+        return found
+
+    def _db_store(self, entries):
+        """ Add entries, {key: transformed}, to the on-disk tier, evicting old entries if it is too large. """
+        now = time.time()
+        rows = [(paragraph_hash, fingerprint, transformed, len(transformed), now)
+                for (paragraph_hash, fingerprint), transformed in entries.items()]
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO paragraphs VALUES (?, ?, ?, ?, ?)", rows)
+        self._db_size += sum(row[3] for row in rows)
+        if self._db_size > self.db_maxsize:
+            self.evict()
+
+    def evict(self, target=None):
+        """ Remove the least recently used entries from the on-disk tier, until its size is at most target.
+
+        Args:
+            target: The target size, in bytes (default: DB_EVICT_FRACTION * db_maxsize).
+        """
+        if self.db is None:
+            return
+        if target is None:
+            target = int(self.db_maxsize * DB_EVICT_FRACTION)
+        # Other processes may also have added entries; get the actual size:
+        size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM paragraphs").fetchone()[0]
+        if size > target:
+            evicted = []
+            for rowid, entry_size in self.db.execute("SELECT rowid, size FROM paragraphs ORDER BY atime"):
+                evicted.append((rowid,))
+                size -= entry_size
+                if size <= target:
+                    break
+            with self.db:
+                self.db.executemany("DELETE FROM paragraphs WHERE rowid = ?", evicted)
+        self._db_size = size
@@ -0,0 +1,207 @@
+"""
+
+Process many input files in parallel, using a pool of worker processes.
+
+Each worker builds the transformation chain (e.g. loads and compiles the selected directives) once,
+when the worker starts, and then processes input files one at a time.
+(Compiled directives hold compiled regexes and replacement functions, which cannot be pickled,
+so the chain is built by each worker, rather than sent from the main process.)
+
+Output printed while processing a file (e.g. the "Reading file:" and "Writing file:" lines)
+is captured by the worker and printed by the main process, in the same order as the input files,
+so the log is the same regardless of the number of workers.
+An error processing a file is reported (in order) and does not stop the processing of other files.
+
+A single (large) document can also be split into chunks, which are transformed in parallel
+(see `transform_chunks_in_pool()`), for transformations that are chunk-safe.
+
+
+"""
+
+import io
+import os
+import re
+from contextlib import redirect_stdout
+from functools import partial
+# OBS: multiprocessing (and traceback) are imported when needed, to keep start-up fast.
+
+from tts_preprocessor.streaming import is_local
+
+# The transformation chain of the current worker process, created by `_init_worker()`:
+_worker_chain = None
+
+
+def _init_worker(chain_factory, factory_args, factory_kwargs):
+    global _worker_chain
+    if chain_factory is None:
+        return
+    # The main process has already built the chain (and printed any messages about it):
+    with redirect_stdout(io.StringIO()):
+        _worker_chain = chain_factory(*factory_args, **factory_kwargs)
+
+
+def _process_one(process_file, process_kwargs, with_chain, inputfile):
+    log = io.StringIO()
+    result, error = None, None
+    args = (inputfile, _worker_chain) if with_chain else (inputfile,)
+    try:
+        with redirect_stdout(log):
+            result = process_file(*args, **process_kwargs)
+    except Exception:
+        import traceback
+        error = traceback.format_exc()
+    return inputfile, log.getvalue(), result, error
+
+
+def get_jobs(jobs):
+    """ Get the number of worker processes to use; jobs=0 (or None) means one for each CPU core. """
+    if not jobs:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def process_files_in_pool(
+        process_file, inputfiles, chain_factory=None, factory_args=(), factory_kwargs=None, jobs=None, on_result=None,
+        **process_kwargs):
+    """ Process input files in a pool of worker processes.
+
+    Args:
+        process_file: The function used to process a single file, called as
+            `process_file(inputfile, chain, **process_kwargs)`.
+        inputfiles: A list of input files.
+        chain_factory: Function creating the chain of transformations (or directives), called as
+            `chain_factory(*factory_args, **factory_kwargs)` once in each worker process.
+            If None, no chain is created, and process_file is called as `process_file(inputfile, **process_kwargs)`.
+        factory_args, factory_kwargs: Arguments for chain_factory.
+        jobs: The number of worker processes (0 or None: one for each CPU core).
+        on_result: If given, called (in the main process, in input file order) as `on_result(result)`
+            with the value returned by process_file for each successfully processed file.
+        **process_kwargs: Keyword arguments for process_file.
+            If process_kwargs['verbose'] > 0, the full traceback is printed for files that could not be processed.
+
+    Returns:
+        A list of (inputfile, traceback) tuples for the files that could not be processed.
+
+    OBS: All functions must be defined at module level (so they can be pickled).
+    """
+    if not inputfiles:
+        return []
+    jobs = min(get_jobs(jobs), len(inputfiles))
+    # A few chunks per worker, to balance the load while limiting the number of messages:
+    chunksize = max(1, len(inputfiles) // (jobs * 4))
+    from multiprocessing import Pool
+    errors = []
+    with Pool(jobs, initializer=_init_worker, initargs=(chain_factory, factory_args, factory_kwargs or {})) as pool:
+        results = pool.imap(partial(_process_one, process_file, process_kwargs, chain_factory is not None),
+                            inputfiles, chunksize=chunksize)
+        for inputfile, log, result, error in results:
+            print(log, end="")
+            if error is None and on_result is not None:
+                on_result(result)
+            if error is not None:
+                print("Error processing file %s: %s" % (inputfile, error.strip().splitlines()[-1]))
+                if process_kwargs.get('verbose', 0) > 0:
+                    print(error)
+                errors.append((inputfile, error))
+    return errors
+
+
+def process_files_serially(process_file, inputfiles, on_result=None, **process_kwargs):
+    """ Process input files one by one, in this process; a file that cannot be processed does not stop the others.
+
+    Args:
+        process_file: The function used to process a single file, called as `process_file(inputfile, **process_kwargs)`.
+        inputfiles: A list of input files.
+        on_result: If given, called as `on_result(result)` with the value returned by process_file
+            for each successfully processed file.
+        **process_kwargs: Keyword arguments for process_file.
+            If process_kwargs['verbose'] > 0, the full traceback is printed for files that could not be processed.
+
+    Returns:
+        A list of (inputfile, traceback) tuples for the files that could not be processed, as `process_files_in_pool()`.
+    """
+    errors = []
+    for inputfile in inputfiles:
+        try:
+            result = process_file(inputfile, **process_kwargs)
+        except Exception as e:
+            import traceback
+            error = traceback.format_exc()
+            print("Error processing file %s: %s: %s" % (inputfile, type(e).__name__, e))
+            if process_kwargs.get('verbose', 0) > 0:
+                print(error)
+            errors.append((inputfile, error))
+            continue
+        if on_result is not None:
+            on_result(result)
+    return errors
+
+
+# Splitting a single document into chunks:
+
+# Chunk boundaries: Right after a newline, before a blank line, a section heading, or an html paragraph:
+CHUNK_BOUNDARY_REGEX = re.compile(r"\n(?=\n|\\(?:sub)*section\b|\\chapter\b|<p\b)")
+CHUNKS_PER_JOB = 4
+MIN_CHUNK_SIZE = 2**16  # characters; smaller documents are not worth splitting
+
+
+def is_chunk_safe(transform):
+    """ Return True if transform gives the same result when applied to chunks of a document (see `split_chunks()`).
+
+    Transformations declare this with a `chunk_safe` attribute; by default, local transformations are chunk-safe.
+    """
+    return bool(getattr(transform, 'chunk_safe', is_local(transform)))
+
+
+def split_chunks(text, n_chunks):
+    """ Split text into (at most) n_chunks chunks of similar size, at safe boundaries (see `CHUNK_BOUNDARY_REGEX`).
+
+    Joining the chunks gives the original text.
+    """
+    chunks = []
+    start = 0
+    for i in range(1, n_chunks):
+        target = len(text) * i // n_chunks
+        if target <= start:
+            continue
+        match = CHUNK_BOUNDARY_REGEX.search(text, target)
+        if match is None:
+            break
+        end = match.end()
+        chunks.append(text[start:end])
+        start = end
+    chunks.append(text[start:])
+    return chunks
+
+
+def _transform_chunk(chunk):
+    for transform in _worker_chain:
+        chunk = transform(chunk)
+    return chunk
+
+
+def _set_worker_chain(transformations):
+    global _worker_chain
+    _worker_chain = transformations
+
+
+def transform_chunks_in_pool(text, transformations, jobs=None):
+    """ Split text into chunks, transform the chunks in a pool of worker processes, and join the results.
+
+    The number of chunks (and thus the chunk size) is adapted to the number of workers.
+    All transformations must be chunk-safe (see `is_chunk_safe()`), and picklable.
+    """
+    jobs = get_jobs(jobs)
+    n_chunks = min(jobs * CHUNKS_PER_JOB, len(text) // MIN_CHUNK_SIZE)
+    if jobs == 1 or n_chunks < 2:
+        return _apply(text, transformations)
+    from multiprocessing import Pool
+    chunks = split_chunks(text, n_chunks)
+    with Pool(min(jobs, len(chunks)), initializer=_set_worker_chain, initargs=(transformations,)) as pool:
+        return "".join(pool.map(_transform_chunk, chunks, chunksize=1))
+
+
+def _apply(text, transformations):
+    for transform in transformations:
+        text = transform(text)
+    return text
@@ -47,11 +47,13 @@ Refs:
 import os
 import re
 from collections import namedtuple
-import pickle
-import json
-import yaml
-from itertools import zip_longest
-from pprint import pprint
+# OBS: yaml, json, and pickle are imported when needed (only for config lines and structured patterns files),
+# to keep start-up fast.
+
+from tts_preprocessor.multi_replace import layer_fixed_ops, MultiReplacer
+from tts_preprocessor.regex_analysis import SubstitutionInfo, fusable_groups, strip_group_names, required_literals
+from tts_preprocessor.regex_analysis import CharSet, MAX_REQUIRED_LITERALS
+from tts_preprocessor import profiling
 
 # TODO: Use a proper `enum` type
 PATTERN_TYPES = [
@@ -60,6 +62,17 @@ PATTERN_TYPES = [
 ]
 REGEX_TYPE = 0
 FIXED_TYPE = 1
+# Values accepted in the `type` column (patterns files are loaded as text, so types are often strings):
+PATTERN_TYPE_VALUES = {
+    None: REGEX_TYPE, "": REGEX_TYPE, 0: REGEX_TYPE, "0": REGEX_TYPE, "r": REGEX_TYPE, "regex": REGEX_TYPE,
+    1: FIXED_TYPE, "1": FIXED_TYPE, "f": FIXED_TYPE, "fixed": FIXED_TYPE,
+}
+
+# Runs of at least this many consecutive fixed-string ops are replaced in a single pass (see `multi_replace`).
+# For shorter runs, str.replace() calls (which run at memchr speed) are faster than a regex-driven pass.
+MULTI_REPLACE_MIN_OPS = 64
+# Consecutive fixed-string ops whose search strings share a substring of at least this length are guarded together:
+GUARD_MIN_LENGTH = 2
 
 # "Replacement" == "Substitution"
 REPLACEMENTTUPLEARGS = ('search_pat', 'replace_pat', 'type', 'comment')
@@ -71,28 +84,692 @@ SUBS_DEFAULTS_DICT = dict(zip(SUBS_DEFAULTS_KEYS, SUBS_DEFAULTS_VALS))
 ReplacementTuple.__new__.__defaults__ = SUBS_DEFAULTS_VALS  # must be a tuple object
 
 
+def normalize_pattern_type(pattern_type):
+    """ Convert a pattern type value, e.g. "1", "F", or "regex", to either REGEX_TYPE or FIXED_TYPE. """
+    key = pattern_type.strip().lower() if isinstance(pattern_type, str) else pattern_type
+    try:
+        return PATTERN_TYPE_VALUES[key]
+    except (KeyError, TypeError):
+        raise ValueError("Unknown pattern type: %r (should be one of 0/R/regex or 1/F/fixed)" % (pattern_type,))
+
+
 def substitute_patterns(string, directive, verbose=0):
     """ Perform all regex/string substitutions listed in directive (one by one).
 
     Args:
         string: The string to perform the search/replace operations on.
-        directive: A list of `ReplacementTuple`s (namedtuple).
+        directive: A `CompiledDirective`, or a list of `ReplacementTuple`s (namedtuple).
+            A list is compiled on every call; use `CompiledDirective` when
+            applying the same directive to more than one document.
         verbose:
 
     Returns:
+        The transformed string.
+    """
+    if not isinstance(directive, CompiledDirective):
+        directive = CompiledDirective(directive)
+    return directive.substitute(string, verbose=verbose)
+
+
+# Single-character escapes recognized in `re` replacement templates:
+TEMPLATE_ESCAPES = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+TEMPLATE_TOKEN_REGEX = re.compile(
+    r"\\g<(?P<name>[^>]*)>"               # \g<name> or \g<1>
+    r"|\\(?P<octal>0[0-7]{0,2}|[0-7]{3})"  # \0, \012, \101 (octal character)
+    r"|\\(?P<number>[0-9]{1,2})"          # \1 .. \99
+    r"|\\(?P<escape>.)"                    # \n, \t, \\, etc.
+    r"|\\$",
+    re.DOTALL)
+
+
+def parse_replacement_template(template, regex):
+    """ Parse a `re.sub` replacement template into a list of literal strings and group indices.
+
+    This follows the same rules as `re.sub()` uses internally, but does so only once
+    (when the directive is compiled), instead of on every `re.sub()` call.
 
+    Args:
+        template: The replacement template string, e.g. "\\n\\g<heading>: \\g<content>\\n".
+        regex: The compiled search pattern, used to resolve group names.
+
+    Returns:
+        parts: A list of str (literal text) and int (group index) items.
+
+    Raises:
+        re.error, if the template is invalid for the given search pattern.
     """
-    for operation in directive:
-        # operation : ('search_pat', 'replace_pat', 'type', 'comment') namedtuple
-        if operation.type == 1:
-            if verbose > 0:
-                print("Replacing fixed-string: %s --> %s" % (operation.search_pat, operation.replace_pat))
-            string = string.replace(operation.search_pat, operation.replace_pat)
+    parts = []
+    literal = []
+    pos = 0
+    for match in TEMPLATE_TOKEN_REGEX.finditer(template):
+        literal.append(template[pos:match.start()])
+        pos = match.end()
+        name, octal, number, escape = match.group('name', 'octal', 'number', 'escape')
+        if name is not None:
+            if name.isdecimal() and name.isascii():
+                index = int(name)
+            elif name in regex.groupindex:
+                index = regex.groupindex[name]
+            else:
+                raise re.error("unknown group name %r in template %r" % (name, template))
+        elif octal is not None:
+            value = int(octal, 8)
+            if value > 0o377:
+                raise re.error("octal escape value \\%s outside of range 0-0o377" % (octal,))
+            literal.append(chr(value))
+            continue
+        elif number is not None:
+            index = int(number)
+        elif escape is not None:
+            if escape in TEMPLATE_ESCAPES:
+                literal.append(TEMPLATE_ESCAPES[escape])
+            elif escape.isascii() and escape.isalpha():
+                raise re.error("bad escape \\%s in template %r" % (escape, template))
+            else:
+                literal.append("\\" + escape)
+            continue
+        else:
+            raise re.error("bad escape (end of template) in template %r" % (template,))
+        if index > regex.groups:
+            raise re.error("invalid group reference %d in template %r" % (index, template))
+        if literal:
+            parts.append("".join(literal))
+            literal = []
+        parts.append(index)
+    literal.append(template[pos:])
+    literal = "".join(literal)
+    if literal:
+        parts.append(literal)
+    return parts
+
+
+def template_parts_to_repl(parts):
+    """ Create a `repl` argument for `regex.sub()` from parsed template parts.
+
+    Returns a plain string when the template has no group references (which `re` can use directly,
+    without calling back into Python for every match), otherwise a function expanding the match.
+    """
+    if not any(isinstance(part, int) for part in parts):
+        literal = "".join(parts)
+        if "\\" not in literal:
+            return literal
+        return lambda match: literal
+
+    def expand(match):
+        return "".join([part if isinstance(part, str) else (match.group(part) or "") for part in parts])
+    return expand
+
+
+class FixedStringOp:
+    """ A single fixed-string substitution, performed with `str.replace()`. """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.search_pat = operation.search_pat
+        self.replace_pat = operation.replace_pat or ""
+
+    def __call__(self, string):
+        return string.replace(self.search_pat, self.replace_pat)
+
+    def subn(self, string):
+        return string.replace(self.search_pat, self.replace_pat), string.count(self.search_pat)
+
+    @property
+    def line_local(self):
+        return bool(self.search_pat) and "\n" not in self.search_pat
+
+    def describe(self):
+        return "Replacing fixed-string: %s --> %s" % (self.operation.search_pat, self.operation.replace_pat)
+
+
+def prefilter_skips(prefilter, string):
+    """ Return True if string contains none of the prefilter literals (so the regex step cannot match). """
+    for literal in prefilter:
+        if literal in string:
+            return False
+    return True
+
+
+class RegexOp:
+    """ A single regex substitution, with pre-compiled search pattern and pre-parsed replacement template.
+
+    If the regex has required literals (see `regex_analysis.required_literals()`), the substitution is skipped
+    for strings that contain none of them (unless prefilter=False).
+    """
+
+    def __init__(self, operation, prefilter=True):
+        self.operation = operation
+        try:
+            self.regex = re.compile(operation.search_pat)
+            self.template_parts = parse_replacement_template(operation.replace_pat or "", self.regex)
+        except re.error as e:
+            raise re.error("Invalid substitution %r --> %r: %s"
+                           % (operation.search_pat, operation.replace_pat, e)) from e
+        self.repl = template_parts_to_repl(self.template_parts)
+        self.prefilter = required_literals(self.regex) if prefilter else None
+        self._info = None
+
+    def __call__(self, string):
+        if self.prefilter is not None and prefilter_skips(self.prefilter, string):
+            return string
+        return self.regex.sub(self.repl, string)
+
+    def subn(self, string):
+        if self.prefilter is not None and prefilter_skips(self.prefilter, string):
+            return string, 0
+        return self.regex.subn(self.repl, string)
+
+    @property
+    def info(self):
+        """ The SubstitutionInfo for this op (see `regex_analysis`), analyzed when first needed. """
+        if self._info is None:
+            self._info = SubstitutionInfo(self.regex, self.template_parts)
+        return self._info
+
+    @property
+    def line_local(self):
+        return self.info.line_local
+
+    def describe(self):
+        return "Replacing using regex: %s --> %s" % (self.operation.search_pat, self.operation.replace_pat)
+
+
+class MultiFixedStringOp:
+    """ A run of consecutive fixed-string substitutions, performed in a single pass (see `multi_replace`).
+
+    Only use this for ops where `multi_replace.layer_fixed_ops()` has determined that
+    a single pass gives the same result as applying the ops one by one.
+    """
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.replacer = MultiReplacer([(op.search_pat, op.replace_pat or "") for op in operations])
+
+    def __call__(self, string):
+        return self.replacer(string)
+
+    def subn(self, string):
+        return self.replacer.subn(string)
+
+    def describe(self):
+        return "Replacing %s fixed-strings in a single pass: %s" % (
+            len(self.operations), ", ".join(op.search_pat for op in self.operations))
+
+
+def compile_operation(operation):
+    """ Compile a single ReplacementTuple to a callable op: string -> string. """
+    if normalize_pattern_type(operation.type) == FIXED_TYPE:
+        return FixedStringOp(operation)
+    return RegexOp(operation)
+
+
+class GuardedFixedStringOps:
+    """ Consecutive fixed-string substitutions whose search strings all contain a common `guard` string.
+
+    If the text does not contain the guard, none of the ops can match (and none of them changes the text),
+    so all of them are skipped after a single check, e.g. repeated whitespace collapses, ("   ", " "), ("  ", " ").
+    Otherwise, the ops are applied one by one.
+    """
+
+    def __init__(self, operations, guard):
+        self.operations = operations
+        self.guard = guard
+        self.ops = [FixedStringOp(operation) for operation in operations]
+
+    def __call__(self, string):
+        if self.guard not in string:
+            return string
+        for op in self.ops:
+            string = op(string)
+        return string
+
+    def subn(self, string):
+        matches = 0
+        if self.guard in string:
+            for op in self.ops:
+                string, n = op.subn(string)
+                matches += n
+        return string, matches
+
+    def describe(self):
+        return "Replacing %s fixed-strings (skipped unless the text contains %r): %s" % (
+            len(self.operations), self.guard, ", ".join(op.search_pat for op in self.operations))
+
+
+def common_substring(a, b):
+    """ Return the longest string that is a substring of both a and b (the first one found in a). """
+    for length in range(min(len(a), len(b)), 0, -1):
+        for start in range(len(a) - length + 1):
+            if a[start:start + length] in b:
+                return a[start:start + length]
+    return ""
+
+
+def guarded_fixed_string_steps(operations, min_guard=GUARD_MIN_LENGTH):
+    """ Compile a (short) run of fixed-string ops, grouping consecutive ops with a common guard string.
+
+    Returns:
+        A list of steps; FixedStringOps and GuardedFixedStringOps.
+    """
+    steps, group, guard = [], [], ""
+    for operation in operations + [None]:
+        if operation is not None and group:
+            common = common_substring(guard, operation.search_pat)
+            if len(common) >= min_guard:
+                group.append(operation)
+                guard = common
+                continue
+        if len(group) > 1:
+            steps.append(GuardedFixedStringOps(group, guard))
         else:
+            steps.extend(FixedStringOp(op) for op in group)
+        group, guard = ([operation], operation.search_pat) if operation is not None else ([], "")
+    return steps
+
+
+def compile_fixed_string_run(operations):
+    """ Compile a run of consecutive fixed-string ops, merging them into single-pass ops where possible.
+
+    The ops are arranged in layers of non-interacting ops (see `multi_replace.layer_fixed_ops()`),
+    and each sufficiently large layer is applied in a single pass.
+    Shorter runs are applied one by one, but consecutive ops with a common guard string are skipped together
+    (see `GuardedFixedStringOps`).
+    """
+    if len(operations) < MULTI_REPLACE_MIN_OPS:
+        return guarded_fixed_string_steps(operations)
+    steps = []
+    layers = layer_fixed_ops([(op.search_pat, op.replace_pat or "") for op in operations])
+    for layer in layers:
+        layer_ops = [operations[index] for index in layer]
+        if len(layer_ops) >= MULTI_REPLACE_MIN_OPS:
+            steps.append(MultiFixedStringOp(layer_ops))
+        else:
+            steps.extend(FixedStringOp(operation) for operation in layer_ops)
+    return steps
+
+
+class FusedRegexOp:
+    """ A run of consecutive regex substitutions, performed in a single pass using a regex alternation.
+
+    The search patterns are combined as `(pattern_1)|(pattern_2)|...`, and each match is dispatched
+    to the replacement template of the op that matched. Only use this for ops where
+    `regex_analysis.fusable_groups()` has determined that the fused alternation gives the same result
+    as applying the ops one by one.
+
+    The step is skipped for strings that contain none of the ops' required literals
+    (if all the ops have a prefilter, see `RegexOp`).
+    """
+
+    def __init__(self, regex_ops):
+        self.operations = [regex_op.operation for regex_op in regex_ops]
+        prefilters = [regex_op.prefilter for regex_op in regex_ops]
+        self.prefilter = None
+        if None not in prefilters:
+            literals = {literal for prefilter in prefilters for literal in prefilter}
+            if len(literals) <= MAX_REQUIRED_LITERALS:
+                self.prefilter = tuple(sorted(literals, key=len, reverse=True))
+        alternatives = []
+        self.dispatch = {}  # {outer group index: template parts (with group indices offset)}
+        offset = 1
+        for regex_op in regex_ops:
+            alternatives.append("(%s)" % strip_group_names(regex_op.regex.pattern))
+            self.dispatch[offset] = [part + offset if isinstance(part, int) else part
+                                     for part in regex_op.template_parts]
+            offset += 1 + regex_op.regex.groups
+        self.regex = re.compile("|".join(alternatives))
+        if self.regex.groups != offset - 1:
+            raise re.error("Could not fuse patterns: %s" % (self.regex.pattern,))
+
+    def repl(self, match):
+        # For a match of a group `(...)`, all nested groups have closed before it, so lastindex is the outer group:
+        return "".join([part if isinstance(part, str) else (match.group(part) or "")
+                        for part in self.dispatch[match.lastindex]])
+
+    def __call__(self, string):
+        if self.prefilter is not None and prefilter_skips(self.prefilter, string):
+            return string
+        return self.regex.sub(self.repl, string)
+
+    def subn(self, string):
+        if self.prefilter is not None and prefilter_skips(self.prefilter, string):
+            return string, 0
+        return self.regex.subn(self.repl, string)
+
+    def describe(self):
+        return "Replacing %s regexes in a single pass: %s" % (
+            len(self.operations), " | ".join(op.search_pat for op in self.operations))
+
+
+def compile_regex_run(operations, sequential=(), no_prefilter=(), compiled=None):
+    """ Compile a run of consecutive regex ops, fusing ops into a single regex alternation where possible.
+
+    Args:
+        operations: A list of ReplacementTuples (regex type).
+        sequential: Indices (into operations) of ops that must not be fused with other ops.
+        no_prefilter: Indices (into operations) of ops that are never skipped by the literal prefilter.
+        compiled: Optional list of already compiled RegexOps (or None), one for each op.
+    """
+    regex_ops = [compiled[index] if compiled and compiled[index] is not None
+                 else RegexOp(operation, prefilter=index not in no_prefilter)
+                 for index, operation in enumerate(operations)]
+    if len(regex_ops) < 2:
+        return regex_ops
+    infos = [regex_op.info for regex_op in regex_ops]
+    steps = []
+    for start, stop in fusable_groups(infos, sequential=sequential):
+        if stop - start > 1:
+            try:
+                steps.append(FusedRegexOp(regex_ops[start:stop]))
+                continue
+            except re.error:
+                pass
+        steps.extend(regex_ops[start:stop])
+    return steps
+
+
+def option_op_indices(operations, options, key):
+    """ Get indices of the ops selected by a directive option, which is either true (all ops),
+    or a list of op indices (0-based) and search patterns.
+    """
+    selected = options.get(key) if options else None
+    if not selected:
+        return set()
+    if selected is True:
+        return set(range(len(operations)))
+    indices = set()
+    for item in selected:
+        if isinstance(item, int):
+            indices.add(item)
+        else:
+            indices.update(index for index, operation in enumerate(operations) if operation.search_pat == item)
+    return indices
+
+
+def sequential_op_indices(operations, options):
+    """ Get indices of ops that must be applied on their own, from the `sequential` directive option.
+
+    The `sequential` option can be given in the first-line config of a patterns file, e.g.
+        # {sequential: true}                                 -- never fuse ops in this directive
+        # {sequential: [3, '\\(?P<cmd>SI)(?P<params>...']}   -- by op index (0-based) or search pattern
+    """
+    return option_op_indices(operations, options, 'sequential')
+
+
+def no_prefilter_op_indices(operations, options):
+    """ Get indices of regex ops that must not be skipped by the literal prefilter, from the `prefilter` option.
+
+    The prefilter is on by default, and can be disabled in the first-line config of a patterns file, e.g.
+        # {prefilter: false}                        -- for all ops in this directive
+        # {no_prefilter: [3, '\\\\epigraph{']}        -- by op index (0-based) or search pattern
+    """
+    if options and options.get('prefilter', True) is False:
+        return set(range(len(operations)))
+    return option_op_indices(operations, options, 'no_prefilter')
+
+
+def is_fixed_op(operation):
+    """ Return True if operation is applied as a fixed-string op (fixed-string ops without a search string are not). """
+    return normalize_pattern_type(operation.type) == FIXED_TYPE and bool(operation.search_pat)
+
+
+def compile_operations(operations, options=None, removed=(), regex_ops=None):
+    """ Compile a list of ReplacementTuples to a list of callable steps: string -> string.
+
+    Consecutive fixed-string ops are compiled together (see `compile_fixed_string_run()`),
+    and so are consecutive regex ops (see `compile_regex_run()`).
+
+    Args:
+        operations: A list of ReplacementTuples.
+        options: Directive options, e.g. from the first-line config of a patterns file.
+        removed: Indices of ops to leave out (see `optimize_operations()`).
+        regex_ops: Optional dict, {index: RegexOp}, of already compiled regex ops.
+    """
+    sequential = sequential_op_indices(operations, options)
+    no_prefilter = no_prefilter_op_indices(operations, options)
+    steps = []
+    run, run_type, run_indices = [], None, []
+    for index, operation in enumerate(operations + [None]):
+        if index in removed:
+            continue
+        if operation is None:
+            op_type = None
+        else:
+            op_type = FIXED_TYPE if is_fixed_op(operation) else REGEX_TYPE
+        if run and op_type != run_type:
+            if run_type == FIXED_TYPE:
+                steps.extend(compile_fixed_string_run(run))
+            else:
+                steps.extend(compile_regex_run(
+                    run, sequential={pos for pos, i in enumerate(run_indices) if i in sequential},
+                    no_prefilter={pos for pos, i in enumerate(run_indices) if i in no_prefilter},
+                    compiled=[regex_ops.get(i) for i in run_indices] if regex_ops else None))
+            run, run_indices = [], []
+        run_type = op_type
+        run.append(operation)
+        run_indices.append(index)
+    return steps
+
+
+# Static optimization, removing ops that never change the output:
+
+def may_create(search, replacement):
+    """ Return True if replacing a match with replacement might create a new occurrence of search.
+
+    In text without occurrences of search, a new occurrence must overlap the replacement
+    (the text around it is unchanged), i.e. search must agree with replacement where they overlap.
+    An empty replacement joins the text before and after it, so it might always create an occurrence.
+    """
+    if not replacement:
+        return True
+    if set(search).isdisjoint(replacement):
+        return False
+    for offset in range(1 - len(search), len(replacement)):
+        if all(replacement[offset + i] == char for i, char in enumerate(search)
+               if 0 <= offset + i < len(replacement)):
+            return True
+    return False
+
+
+def optimize_operations(operations, options=None, regex_ops=None):
+    """ Find ops that can be removed without changing a directive's output, for any input text.
+
+    These are:
+    * identity ops: fixed-string ops replacing a string with itself.
+    * unreachable ops: After a fixed-string op has replaced all occurrences of its search string,
+        the text contains none, until a later op might create one (see `may_create()`).
+        Until then, ops that only match text containing the search string never match.
+        These are fixed-string ops containing the search string (e.g. an entry listed twice),
+        and regex ops whose required literals contain it (see `regex_analysis.required_literals()`).
+    * duplicate regex ops: Within a group of fusable regex ops (see `regex_analysis.fusable_groups()`),
+        applying the ops one by one gives the same result as the fused alternation,
+        where an op never matches before an identical earlier op.
+
+    Args:
+        operations: A list of ReplacementTuples.
+        options: Directive options (ops excluded from the prefilter, see `no_prefilter_op_indices()`,
+            are not analyzed for required literals either).
+        regex_ops: Optional dict, which is updated with {index: RegexOp} for the regex ops compiled for the analysis.
+
+    Returns:
+        A dict, {index: reason} for the ops that can be removed.
+    """
+    fixed = [is_fixed_op(operation) for operation in operations]
+    no_prefilter = no_prefilter_op_indices(operations, options)
+    removed = {}
+    if regex_ops is None:
+        regex_ops = {}
+
+    def regex_op(index):
+        if index not in regex_ops:
+            regex_ops[index] = RegexOp(operations[index], prefilter=index not in no_prefilter)
+        return regex_ops[index]
+
+    def preserves_absence(index, search):
+        """ True if applying op `index` to text without search gives text without search. """
+        if index in removed:
+            return True
+        if fixed[index]:
+            return not may_create(search, operations[index].replace_pat or "")
+        substitution = regex_op(index).info
+        return (substitution.fusable and not substitution.output_nullable
+                and not substitution.output.intersects(CharSet(search)))
+
+    blockers = {}  # {index: index of the first later op which might create the op's search string}
+
+    def absent_until(index):
+        if index not in blockers:
+            search = operations[index].search_pat
+            blocker = index
+            if not may_create(search, operations[index].replace_pat or ""):
+                blocker = next((later for later in range(index + 1, len(operations))
+                                if not preserves_absence(later, search)), len(operations))
+            blockers[index] = blocker
+        return blockers[index]
+
+    searches = {}  # {search string: [index, ...]} for fixed-string ops
+    lengths = set()
+    for index, operation in enumerate(operations):
+        if not fixed[index]:
+            continue
+        if operation.search_pat == (operation.replace_pat or ""):
+            removed[index] = "identity op"
+            continue
+        searches.setdefault(operation.search_pat, []).append(index)
+        lengths.add(len(operation.search_pat))
+    lengths = sorted(lengths)
+
+    for index, operation in enumerate(operations):
+        if index in removed:
+            continue
+        literals = (operation.search_pat,) if fixed[index] else regex_op(index).prefilter
+        if not literals:
+            continue
+        # For each literal, find an earlier op which leaves no occurrences of (a part of) the literal:
+        reasons = []
+        for literal in literals:
+            candidates = [i for length in lengths if length <= len(literal)
+                          for start in range(len(literal) - length + 1)
+                          for i in searches.get(literal[start:start + length], ()) if i < index]
+            earlier = next((i for i in sorted(candidates, reverse=True)
+                            if i not in removed and absent_until(i) >= index), None)
+            if earlier is None:
+                break
+            reasons.append("no %r after op %s" % (operations[earlier].search_pat, earlier))
+        else:
+            removed[index] = "unreachable (%s)" % ("; ".join(reasons),)
+
+    # Duplicate regex ops, in runs of consecutive regex ops:
+    run = []
+    for index in [index for index in range(len(operations)) if index not in removed] + [None]:
+        if index is not None and not fixed[index]:
+            run.append(index)
+            continue
+        if len(run) > 1:
+            for start, stop in fusable_groups([regex_op(i).info for i in run]):
+                first_seen = {}
+                for i in run[start:stop]:
+                    key = (operations[i].search_pat, operations[i].replace_pat or "")
+                    if key in first_seen:
+                        removed[i] = "duplicate of op %s (fusable)" % (first_seen[key],)
+                    else:
+                        first_seen[key] = i
+        run = []
+    return removed
+
+
+class CompiledDirective:
+    """ A directive (list of ReplacementTuples), compiled once and ready to be applied to many documents.
+
+    Regex search patterns are compiled and replacement templates (e.g. `\\g<heading>`) are parsed
+    when the directive is created, so applying the directive only does the actual matching.
+    Compiled patterns are held by the directive itself, so they are not subject to
+    eviction from the (limited) internal cache of the `re` module.
+
+    Consecutive fixed-string ops are replaced in a single pass, and so are consecutive regex ops
+    that cannot interact with each other (unless disabled with the `sequential` option).
+    Regex steps are skipped for text without their required literals (unless disabled with the `prefilter` option).
+
+    Ops that can never change the output are left out (see `optimize_operations()`; disable with `optimize: false`).
+    They are still listed in `ops` (and included in the fingerprint); see `removed` and `optimization_report()`.
+
+    A CompiledDirective is a transformation, i.e. it can be called as `directive(text) -> text`.
+    """
+
+    def __init__(self, directive_ops, name=None, options=None):
+        self.name = name
+        self.ops = [ReplacementTuple(*operation) for operation in directive_ops]
+        self.options = options if options is not None else {}
+        regex_ops = {}  # {index: RegexOp}, compiled by the optimizer, and re-used when compiling the steps
+        self.removed = {}
+        if self.options.get('optimize', True):
+            self.removed = optimize_operations(self.ops, self.options, regex_ops)
+        self.steps = compile_operations(self.ops, options=self.options, removed=self.removed, regex_ops=regex_ops)
+        self._local = None
+
+    @property
+    def local(self):
+        """ True if the directive can be applied to a document block by block (see `streaming`).
+
+        This can be declared with the `local` option, e.g. `# {local: false}` as first-line config.
+        Otherwise, the directive is local if all its ops are line-local (see `regex_analysis`).
+        """
+        if 'local' in self.options:
+            return bool(self.options['local'])
+        if self._local is None:
+            self._local = all(compile_operation(operation).line_local for operation in self.ops)
+        return self._local
+
+    @property
+    def chunk_safe(self):
+        """ True if the directive can be applied to chunks of a document split at paragraph/section boundaries.
+
+        This can be declared with the `chunk_safe` option; by default, local directives are chunk-safe.
+        """
+        return bool(self.options.get('chunk_safe', self.local))
+
+    @property
+    def fingerprint(self):
+        """ A hash of the directive's ops and options, which changes whenever the directive's output might change. """
+        import hashlib
+        return hashlib.sha256(repr(([tuple(op) for op in self.ops], sorted(self.options.items(), key=repr))).encode(
+            'utf-8')).hexdigest()
+
+    def __reduce__(self):
+        # Compiled steps hold replacement functions, which cannot be pickled; re-compile when unpickling:
+        return self.__class__, (self.ops, self.name, self.options)
+
+    def __call__(self, string, verbose=0):
+        return self.substitute(string, verbose=verbose)
+
+    def optimization_report(self):
+        """ Return a report of the ops left out by the optimizer (see `optimize_operations()`). """
+        lines = ["%s: %s of %s ops removed." % (self.name or "<directive>", len(self.removed), len(self.ops))]
+        for index, reason in sorted(self.removed.items()):
+            operation = self.ops[index]
+            lines.append("    op %4d: %r --> %r: %s" % (index, operation.search_pat, operation.replace_pat, reason))
+        return "\n".join(lines)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __iter__(self):
+        return iter(self.ops)
+
+    def __repr__(self):
+        return "<%s %r (%s ops)>" % (self.__class__.__name__, self.name, len(self.ops))
+
+    def substitute(self, string, verbose=0):
+        """ Perform all substitutions, one by one (see `substitute_patterns()`). """
+        if profiling.ACTIVE_PROFILER is not None:
+            return profiling.ACTIVE_PROFILER.substitute(self, string)
+        for step in self.steps:
             if verbose > 0:
-                print("Replacing using regex: %s --> %s" % (operation.search_pat, operation.replace_pat))
-            string = re.sub(pattern=operation.search_pat, repl=operation.replace_pat or "", string=string)
-    return string
+                print(step.describe())
+                prefilter = getattr(step, 'prefilter', None)
+                if prefilter is not None and prefilter_skips(prefilter, string):
+                    print("    Skipped: text contains none of %s" % (", ".join(map(repr, prefilter)),))
+            string = step(string)
+        return string
 
 
 def pattern_defs_to_tuples(defs, options):
@@ -133,6 +810,7 @@ def pattern_defs_to_tuples(defs, options):
             def_default.update(zip(REPLACEMENTTUPLEARGS, definition))
         else:
             def_default.update(definition)
+        def_default['type'] = normalize_pattern_type(def_default['type'])
         operation = ReplacementTuple(**def_default)
         directive_ops.append(operation)
 
@@ -198,10 +876,11 @@ def extract_first_line_config(input, commentchar="#"):
         # Assume list of lines:
         input = input[0]
     if input and input[0] == commentchar and input[:3] == "# {":
+        import yaml
         input = input.strip("# ")
         try:
-            config = yaml.load(input)
-        except yaml.scanner.ScannerError as e:
+            config = yaml.safe_load(input)
+        except yaml.YAMLError as e:
             print("Error extracting yaml-config from first comment line:", e)
             print(input)
             config = {}
@@ -221,7 +900,7 @@ def parse_pattern_txt_defs_to_list(patterns_str, sep='\t', options=None, extract
     return directive_ops
 
 
-def load_patterns_defs(filename, format=None, name=None, **kwargs):
+def load_patterns_defs(filename, format=None, name=None, options=None, **kwargs):
     """ Load substitution (replacement) definitions/patterns from file.
 
     This supports both simple "text-definitions", but can also be used to dump
@@ -231,6 +910,8 @@ def load_patterns_defs(filename, format=None, name=None, **kwargs):
         filename:
         format:
         name:
+        options: If given, this dict is updated with the directive options loaded from the file,
+            e.g. the first-line config of a text patterns file.
         **kwargs:
 
     Returns:
@@ -245,33 +926,40 @@ def load_patterns_defs(filename, format=None, name=None, **kwargs):
     if format is None and fnext:
         format = fnext[1:].lower()
     mode = 'rb' if format == 'pickle' else 'r'
+    file_options = {}
 
     with open(filename, mode=mode) as fp:
 
         if format in ("json", "yaml", "yml", "pickle"):
             # Structured data formats, a dict with keys 'substitutions', 'options', etc.
             if format == "json":
+                import json
                 # directives = json.loads(content, **kwargs)
-                data = json.loads(fp, **kwargs)
+                data = json.load(fp, **kwargs)
             elif format in ('yml', 'yaml'):
+                import yaml
                 # directives = yaml.load(content, **kwargs)
-                data = yaml.load(fp, **kwargs)
+                data = yaml.safe_load(fp, **kwargs)
             elif format == "pickle":
+                import pickle
                 data = pickle.load(fp, **kwargs)
             else:
                 raise ValueError("Unknown format: '%s' for file '%s'" % (format, filename))
-            options = data.get('options', {})
-            options.update(kwargs)
+            file_options = data.get('options', {})
+            file_options.update(kwargs)
             subs_defs = data['substitutions']
             if name is None:
-                name = options.get('name')
-            directives = pattern_defs_to_tuples(subs_defs, options)
+                name = file_options.get('name')
+            directives = pattern_defs_to_tuples(subs_defs, file_options)
         elif format[:2] == "py":
             pass
         else:
             # Data is a list of substitutions with optional first-line config:
             # directives = str_patterns_to_list(fp.read(), options=options)
-            directives = parse_pattern_txt_defs_to_list(fp.read())  # OBS: This will not load line comments
+            # OBS: This will not load line comments
+            directives = parse_pattern_txt_defs_to_list(fp.read(), options=file_options)
+    if options is not None:
+        options.update(file_options)
     if name is None:
         # Use filename as directive-group name:
         name = os.path.basename(filename).split(".", 1)[0]
@@ -292,8 +980,9 @@ def str_patterns_to_list(patterns_str, sep='\t', options=None):
 
     first_line = patterns[0]
     if first_line and first_line[0:3] == "# {":
+        import yaml
         first_line = first_line.strip("# ")
-        options = yaml.load(first_line)
+        options = yaml.safe_load(first_line)
 
     patterns = [line for line in patterns if line[0] != '#']  # Remove comment lines:
 
@@ -323,9 +1012,11 @@ def load_patterns(filename, format=None, name=None, **kwargs):
     fnbase, fnext = os.path.splitext(filename)
 
     if fnext in ('.json',) or format == "json":
+        import json
         directives = json.loads(content, **kwargs)
     elif fnext in ('.yml', '.yaml') or format == "yaml":
-        directives = yaml.load(content, **kwargs)
+        import yaml
+        directives = yaml.safe_load(content, **kwargs)
     else:
         directives = str_patterns_to_list(content, **kwargs)
     return directives
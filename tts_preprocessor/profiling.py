@@ -0,0 +1,160 @@
+"""
+
+Per-operation profiling of directives and transformations (the `--profile` command line option).
+
+While a Profiler is active (see `profiling()`), each directive step (see `CompiledDirective.steps`)
+and each transformation applied by `apply_transformations()` is timed, and the profiler records:
+* the number of calls and the total wall time,
+* the number of matches (replacements made), for directive steps, and
+* the number of bytes (UTF-8) in and out.
+
+Consecutive ops that are applied in a single pass (fused regexes, multi-string replacements) form a single step,
+and are reported together. To profile such ops one by one, use the `sequential: true` directive option.
+
+When no profiler is active, the only overhead is a single check per directive (not per op) or transformation call.
+Matches and bytes are counted outside the timed sections, so they do not inflate the measured times.
+
+
+"""
+
+import time
+from contextlib import contextmanager
+
+# The active profiler (checked by `CompiledDirective.substitute()` and `apply_transformations()`):
+ACTIVE_PROFILER = None
+
+DEFAULT_TOP = 20
+LABEL_WIDTH = 60
+
+
+def nbytes(string):
+    return len(string.encode('utf-8', 'surrogatepass'))
+
+
+def shorten(label, width=LABEL_WIDTH):
+    label = label.replace("\n", "\\n").replace("\t", "\\t")
+    return label if len(label) <= width else label[:width - 3] + "..."
+
+
+class Stats:
+    """ Accumulated statistics for a single directive step or transformation. """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.calls = 0
+        self.seconds = 0.0
+        self.matches = None  # None if not counted (transformations)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, seconds, string_in, string_out, matches=None):
+        self.calls += 1
+        self.seconds += seconds
+        if matches is not None:
+            self.matches = (self.matches or 0) + matches
+        self.bytes_in += nbytes(string_in)
+        self.bytes_out += nbytes(string_out)
+
+    def as_dict(self):
+        return {'name': self.name, 'description': self.description, 'calls': self.calls, 'seconds': self.seconds,
+                'matches': self.matches, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+
+
+class Profiler:
+    """ Collects per-step and per-transformation statistics (see module docstring). """
+
+    def __init__(self):
+        self.steps = {}       # {(directive name, step index): Stats}
+        self.transforms = {}  # {transformation name: Stats}
+        self.unnamed = {}     # {id(directive): name}, for directives without a name
+        self.overhead = 0.0   # Time spent counting bytes for directive steps (subtracted from transformation times)
+
+    @staticmethod
+    def transform_name(transform):
+        name = getattr(transform, 'name', None) or getattr(transform, '__name__', None)
+        return name or repr(transform)
+
+    def substitute(self, directive, string):
+        """ Apply directive's steps to string (like `CompiledDirective.substitute()`), recording each step. """
+        name = directive.name
+        if not name:
+            name = self.unnamed.setdefault(id(directive), "<directive %s>" % (len(self.unnamed) + 1,))
+        for index, step in enumerate(directive.steps):
+            stats = self.steps.get((name, index))
+            if stats is None:
+                stats = self.steps[(name, index)] = Stats("%s[%s]" % (name, index), step.describe())
+            start = time.perf_counter()
+            result, matches = step.subn(string)
+            end = time.perf_counter()
+            stats.add(end - start, string, result, matches)
+            self.overhead += time.perf_counter() - end
+            string = result
+        return string
+
+    def apply_transformations(self, text, transformations):
+        """ Apply transformations to text one by one, recording each transformation. """
+        for transform in transformations:
+            name = self.transform_name(transform)
+            stats = self.transforms.get(name)
+            if stats is None:
+                stats = self.transforms[name] = Stats(name, repr(transform))
+            overhead = self.overhead
+            start = time.perf_counter()
+            result = transform(text)
+            stats.add(time.perf_counter() - start - (self.overhead - overhead), text, result)
+            text = result
+        return text
+
+    def report(self, top=DEFAULT_TOP):
+        """ Return a report of the transformations, and the top directive steps by total time. """
+        lines = []
+        header = "%10s %6s %7s %9s %11s %11s  %s" % (
+            "time (s)", "%", "calls", "matches", "bytes in", "bytes out", "name")
+        for title, stats_list, limit, describe in (("Transformations", self.transforms.values(), None, False),
+                                                   ("Directive steps", self.steps.values(), top, True)):
+            if not stats_list:
+                continue
+            stats_list = sorted(stats_list, key=lambda stats: stats.seconds, reverse=True)
+            total = sum(stats.seconds for stats in stats_list)
+            shown = stats_list[:limit] if limit else stats_list
+            lines.append("%s (%s of %s, by time; total %.3f s):" % (title, len(shown), len(stats_list), total))
+            lines.append(header)
+            for stats in shown:
+                lines.append("%10.4f %6.1f %7d %9s %11d %11d  %s" % (
+                    stats.seconds, 100 * stats.seconds / total if total else 0, stats.calls,
+                    "-" if stats.matches is None else stats.matches, stats.bytes_in, stats.bytes_out, stats.name))
+                if describe:
+                    lines.append("%s  %s" % (" " * 58, shorten(stats.description)))
+            lines.append("")
+        return "\n".join(lines)
+
+    def as_dict(self):
+        return {
+            'transformations': [stats.as_dict() for stats in self.transforms.values()],
+            'steps': [stats.as_dict() for stats in self.steps.values()],
+        }
+
+    def save(self, filename):
+        import json
+        with open(filename, mode='w', encoding='utf-8') as fp:
+            json.dump(self.as_dict(), fp, indent=1)
+
+
+@contextmanager
+def profiling(profiler):
+    """ Context manager activating profiler (if it is not None) while in the context, e.g.
+
+        with profiling(Profiler()) as profiler:
+            process_all_inputfiles(...)
+        print(profiler.report())
+    """
+    global ACTIVE_PROFILER
+    if profiler is None:
+        yield None
+        return
+    previous, ACTIVE_PROFILER = ACTIVE_PROFILER, profiler
+    try:
+        yield profiler
+    finally:
+        ACTIVE_PROFILER = previous
@@ -0,0 +1,572 @@
+"""
+
+Static analysis of regular expressions used in directive ops.
+
+This is used to determine when a sequence of regex substitutions can be fused into a single regex
+(a named-group alternation), which scans the document once, instead of once for each op.
+
+
+Fusing regex ops:
+-----------------
+
+Applying ops one by one, each op sees the text as modified by the previous ops.
+With a fused alternation, all ops see the original text, and matches are selected left-to-right,
+trying the ops in their original order at each position.
+For two ops i < k, this gives the same result as applying the ops one by one, provided that:
+
+1. The replacement output of op i cannot create a match for op k:
+    * a match of k cannot start inside the output of i, and
+    * a match of k cannot start before the output of i and extend into it,
+    * if the output of i can be empty, a match of k cannot span the "gap" (k matches at most one character).
+2. A match of op k cannot contain the start of a match of op i (other than at its first character).
+    Otherwise, k would "win" over i by starting further to the left.
+3. If op k uses lookarounds (e.g. `(?<!%)`), op i cannot change the characters that k looks at
+    (neither by removing them, by outputting them, or by deleting text between them).
+
+The analysis is based on character sets, i.e. which characters can occur in a match,
+and which characters can occur at the start of a match.
+It is conservative: Ops are only fused when the analysis can prove that the conditions hold.
+Ops using backreferences, anchors (`^`, `$`, `\\b`), or global flags are never fused.
+
+
+Line-local ops:
+---------------
+
+An op is line-local if it can never match (or look at) a newline, and cannot match the empty string.
+Such ops never change the newlines in a document, so a document can be split right after any newline,
+the parts transformed separately, and joined again, with the same result as transforming the whole
+document (see `streaming`).
+
+
+Required literals (prefilter):
+------------------------------
+
+Most regex ops only match text containing a specific literal, e.g. `\\SI`, `<sup>`, or `~`.
+`required_literals()` extracts a set of strings such that every match contains at least one of them.
+If none of them occur in a document (a fast `in` check), the op cannot match, and the regex scan is skipped.
+Literals are taken from the parts of the regex that every match must include (i.e. not from optional items),
+and for alternations, one literal from each branch. The longest (most selective) candidate is used.
+
+
+Bytes patterns:
+---------------
+
+`bytes_regex()` compiles a bytes version of a regex, for matching UTF-8 encoded text (see `bytes_processing`).
+This only gives the same matches as the str regex for patterns that never match part of a (multi-byte) character:
+Non-ASCII characters may only occur as literals in a sequence (not repeated on their own, nor in `[...]`),
+and character types (`.`, `\\w`, `\\b`, `[^...]`, etc.), case-insensitive matching, and patterns that can match
+the empty string are not supported.
+
+
+"""
+
+import re
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+
+class CharSet:
+    """ A (conservative) description of a set of characters.
+
+    Args:
+        chars: A set of characters.
+        categories: A set of sre category codes (e.g. CATEGORY_DIGIT for `\\d`).
+        any: If True, the set includes (or might include) any character, except those in `excluded`.
+        excluded: Characters never included, even if `any` is True (e.g. newline, for `.`).
+    """
+
+    CATEGORY_REGEXES = {
+        sre_parse.CATEGORY_DIGIT: re.compile(r"\d"),
+        sre_parse.CATEGORY_SPACE: re.compile(r"\s"),
+        sre_parse.CATEGORY_WORD: re.compile(r"\w"),
+    }
+
+    def __init__(self, chars=(), categories=(), any=False, excluded=()):
+        self.chars = frozenset(chars)
+        self.categories = frozenset(categories)
+        self.any = any
+        self.excluded = frozenset(excluded) - self.chars if any else frozenset()
+
+    def __or__(self, other):
+        union = CharSet(self.chars | other.chars, self.categories | other.categories, self.any or other.any)
+        if union.any:
+            union.excluded = frozenset(char for char in self.excluded | other.excluded
+                                       if not (self.contains_char(char) or other.contains_char(char)))
+        return union
+
+    def __bool__(self):
+        return bool(self.any or self.chars or self.categories)
+
+    def __repr__(self):
+        return "CharSet(%r, %r, any=%r, excluded=%r)" % (
+            set(self.chars), set(self.categories), self.any, set(self.excluded))
+
+    def contains_char(self, char):
+        if char in self.chars:
+            return True
+        if self.any:
+            return char not in self.excluded
+        return any(self.CATEGORY_REGEXES[category].match(char) for category in self.categories)
+
+    def intersects(self, other):
+        if not self or not other:
+            return False
+        if self.any or other.any:
+            return True
+        if self.categories and other.categories:
+            return True  # Conservative
+        return (any(other.contains_char(char) for char in self.chars)
+                or any(self.contains_char(char) for char in other.chars))
+
+
+EMPTY = CharSet()
+ANY = CharSet(any=True)
+ANY_BUT_NEWLINE = CharSet(any=True, excluded="\n")  # `.` (without the DOTALL flag)
+
+
+class Unsupported(Exception):
+    """ Raised when a regex uses a construct that the analysis cannot reason about. """
+
+
+class RegexInfo:
+    """ Analysis result for a (part of a) regex.
+
+    Attributes:
+        first: CharSet of characters that can start a match.
+        rest: CharSet of characters that can occur in a match, other than at its start.
+        nullable: True if the regex can match the empty string.
+        max_len: The maximum length of a match (None if unbounded).
+        lookaround: CharSet of characters inspected by lookahead/lookbehind assertions.
+    """
+
+    def __init__(self, first=EMPTY, rest=EMPTY, nullable=True, max_len=0, lookaround=EMPTY):
+        self.first = first
+        self.rest = rest
+        self.nullable = nullable
+        self.max_len = max_len
+        self.lookaround = lookaround
+
+    @property
+    def chars(self):
+        return self.first | self.rest
+
+
+def _in_charset(items):
+    """ CharSet for an IN ([...] character class) item list. """
+    chars, categories = set(), set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_parse.RANGE:
+            low, high = av
+            if high - low > 256:
+                return ANY
+            chars.update(chr(code) for code in range(low, high + 1))
+        elif op is sre_parse.CATEGORY and av in CharSet.CATEGORY_REGEXES:
+            categories.add(av)
+        else:
+            # NEGATE, negated categories (\D, \S, \W), etc.
+            return ANY
+    return CharSet(chars, categories)
+
+
+def _add_lengths(a, b):
+    return None if a is None or b is None else a + b
+
+
+def analyze_sequence(items, groups):
+    """ Analyze a parsed regex sequence (a list of (opcode, argument) items).
+
+    Args:
+        items: The parsed regex, e.g. `sre_parse.parse(pattern)`.
+        groups: A dict, which is updated with {group_index: RegexInfo} for all capturing groups.
+
+    Returns:
+        A RegexInfo for the sequence.
+
+    Raises:
+        Unsupported, if the sequence uses anchors, backreferences, or inline flags.
+
+    The regex is assumed to be compiled without flags, e.g. `.` does not match newlines.
+    """
+    first, rest, lookaround = EMPTY, EMPTY, EMPTY
+    nullable, max_len = True, 0
+    for op, av in items:
+        item = analyze_item(op, av, groups)
+        lookaround = lookaround | item.lookaround
+        if nullable:
+            first = first | item.first
+            rest = rest | item.rest
+        else:
+            rest = rest | item.chars
+        if max_len != 0 and item.max_len != 0:
+            rest = rest | item.first
+        nullable = nullable and item.nullable
+        max_len = _add_lengths(max_len, item.max_len)
+    return RegexInfo(first, rest, nullable, max_len, lookaround)
+
+
+def analyze_item(op, av, groups):
+    """ Analyze a single parsed regex item, (opcode, argument). """
+    if op is sre_parse.LITERAL:
+        return RegexInfo(CharSet([chr(av)]), EMPTY, False, 1)
+    if op is sre_parse.ANY:
+        return RegexInfo(ANY_BUT_NEWLINE, EMPTY, False, 1)
+    if op is sre_parse.NOT_LITERAL:
+        return RegexInfo(ANY, EMPTY, False, 1)
+    if op is sre_parse.IN:
+        return RegexInfo(_in_charset(av), EMPTY, False, 1)
+    if op is sre_parse.BRANCH:
+        infos = [analyze_sequence(branch, groups) for branch in av[1]]
+        max_lens = [info.max_len for info in infos]
+        return RegexInfo(
+            first=_union(info.first for info in infos),
+            rest=_union(info.rest for info in infos),
+            nullable=any(info.nullable for info in infos),
+            max_len=None if None in max_lens else max(max_lens),
+            lookaround=_union(info.lookaround for info in infos))
+    if op in _REPEATS:
+        min_count, max_count, item = av
+        info = analyze_sequence(item, groups)
+        rest = info.rest
+        if max_count > 1 and info.max_len != 0:
+            rest = rest | info.chars
+        max_len = None if max_count == sre_parse.MAXREPEAT or info.max_len is None else max_count * info.max_len
+        return RegexInfo(info.first, rest, min_count == 0 or info.nullable, max_len, info.lookaround)
+    if op is sre_parse.SUBPATTERN:
+        group, add_flags, del_flags, item = av
+        if add_flags or del_flags:
+            raise Unsupported("inline flags")
+        info = analyze_sequence(item, groups)
+        if group is not None:
+            groups[group] = info
+        return info
+    if op is _ATOMIC_GROUP:
+        return analyze_sequence(av, groups)
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        direction, item = av
+        info = analyze_sequence(item, groups)
+        return RegexInfo(lookaround=info.chars | info.lookaround)
+    # AT (anchors and word boundaries), GROUPREF, GROUPREF_EXISTS, etc:
+    raise Unsupported(str(op))
+
+
+_REPEATS = tuple(op for op in (
+    sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)) if op is not None)
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+
+def _union(charsets):
+    result = EMPTY
+    for charset in charsets:
+        result = result | charset
+    return result
+
+
+class SubstitutionInfo:
+    """ Analysis of a regex substitution op: the search pattern and the output of its replacement template.
+
+    Args:
+        regex: The compiled search pattern.
+        template_parts: The parsed replacement template, a list of literal strings and group indices
+            (see `pattern_utils.parse_replacement_template()`).
+
+    Attributes:
+        fusable: False if the regex cannot be analyzed (or can match the empty string).
+        match: RegexInfo for the search pattern.
+        output: CharSet of characters that can occur in the replacement output.
+        output_first: CharSet of characters that can start the replacement output.
+        output_nullable: True if the replacement output can be empty.
+        line_local: True if the op never matches, nor looks at, a newline (see "Line-local ops" above).
+    """
+
+    def __init__(self, regex, template_parts):
+        self.regex = regex
+        self.fusable = False
+        self.line_local = False
+        if regex.flags & ~re.UNICODE:
+            return  # Global flags, e.g. `(?i)`, or re.VERBOSE
+        groups = {}
+        try:
+            self.match = analyze_sequence(sre_parse.parse(regex.pattern).data, groups)
+        except Unsupported:
+            return
+        if self.match.nullable:
+            return
+        self.line_local = not (self.match.chars | self.match.lookaround).contains_char("\n")
+        groups[0] = self.match
+        output, output_first = EMPTY, EMPTY
+        output_nullable = True
+        for part in template_parts:
+            if isinstance(part, str):
+                if not part:
+                    continue
+                output = output | CharSet(part)
+                if output_nullable:
+                    output_first = output_first | CharSet(part[0])
+                output_nullable = False
+            else:
+                info = groups[part]
+                output = output | info.chars
+                if output_nullable:
+                    output_first = output_first | info.first
+                # Groups (other than the full match) might not participate in the match:
+                output_nullable = output_nullable and (part != 0 or info.nullable)
+        self.output = output
+        self.output_first = output_first
+        self.output_nullable = output_nullable
+        self.fusable = True
+
+
+def can_fuse(earlier, later):
+    """ Return True if the two ops (SubstitutionInfo) give the same result in a fused alternation.
+
+    See the module docstring for the conditions.
+    """
+    if not (earlier.fusable and later.fusable):
+        return False
+    # 1. The output of the earlier op cannot create a match for the later op:
+    if later.match.first.intersects(earlier.output):
+        return False
+    if earlier.output_first.intersects(later.match.rest):
+        return False
+    if earlier.output_nullable and (later.match.max_len is None or later.match.max_len > 1):
+        return False
+    # 2. A match of the later op cannot contain the start of a match of the earlier op:
+    if earlier.match.first.intersects(later.match.rest):
+        return False
+    # 3. The earlier op does not change the characters inspected by lookarounds in the later op:
+    if later.match.lookaround and (earlier.output_nullable or
+                                   later.match.lookaround.intersects(earlier.match.chars | earlier.output)):
+        return False
+    return True
+
+
+def fusable_groups(infos, sequential=()):
+    """ Split a sequence of regex ops into consecutive groups, where all ops within a group can be fused.
+
+    Args:
+        infos: A list of SubstitutionInfo, one for each op, in the order they are applied.
+        sequential: Indices of ops that must not be fused with any other op.
+
+    Returns:
+        A list of (start, stop) index ranges, one for each group.
+    """
+    groups = []
+    start = 0
+    for k in range(1, len(infos) + 1):
+        if k == len(infos) or k in sequential or (k - 1) in sequential or not all(
+                can_fuse(infos[i], infos[k]) for i in range(start, k)):
+            groups.append((start, k))
+            start = k
+    return groups
+
+
+def strip_group_names(pattern):
+    """ Convert named groups, `(?P<name>...)`, to plain numbered groups, `(...)`.
+
+    Group numbers are unchanged. This allows several patterns using the same group names
+    to be combined in a single regex.
+    """
+    result = []
+    pos = 0
+    in_class = False
+    n = len(pattern)
+    while pos < n:
+        char = pattern[pos]
+        if char == "\\":
+            result.append(pattern[pos:pos + 2])
+            pos += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            in_class = True
+            result.append(char)
+            pos += 1
+            # A "]" right after "[" or "[^" is a literal:
+            if pattern.startswith("^", pos):
+                result.append("^")
+                pos += 1
+            if pattern.startswith("]", pos):
+                result.append("]")
+                pos += 1
+            continue
+        elif pattern.startswith("(?P<", pos):
+            end = pattern.index(">", pos)
+            result.append("(")
+            pos = end + 1
+            continue
+        result.append(char)
+        pos += 1
+    return "".join(result)
+
+
+MAX_REQUIRED_LITERALS = 16  # More alternatives than this (checked one by one) are not worth it
+
+
+def required_literals(regex, max_literals=MAX_REQUIRED_LITERALS):
+    """ Get literals such that every match of regex contains at least one of them (see "Required literals" above).
+
+    Args:
+        regex: A compiled regex.
+        max_literals: The maximum number of alternative literals.
+
+    Returns:
+        A tuple of strings, or None if no required literals were found.
+    """
+    if regex.flags & (re.IGNORECASE | re.LOCALE) or not isinstance(regex.pattern, str):
+        return None
+    try:
+        items = sre_parse.parse(regex.pattern, regex.flags).data
+    except (re.error, TypeError, ValueError):
+        return None
+    best = _best_literals(_sequence_literals(items, max_literals))
+    return tuple(sorted(best, key=len, reverse=True)) if best else None
+
+
+_ZERO_WIDTH = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+
+
+def _sequence_literals(items, max_literals):
+    """ Get candidate literal sets for a parsed regex sequence (every match contains a literal from each set). """
+    candidates, run = [], []
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if op in _ZERO_WIDTH:
+            continue  # Zero-width items do not separate the literals before and after them
+        if op is sre_parse.SUBPATTERN and not (av[1] or av[2]) and all(
+                item_op is sre_parse.LITERAL for item_op, item_av in av[3]):
+            run.extend(chr(item_av) for item_op, item_av in av[3])  # A group of literals, e.g. `\\(?P<cmd>SI)`
+            continue
+        if run:
+            candidates.append(frozenset(["".join(run)]))
+            run = []
+        candidates.extend(_item_literals(op, av, max_literals))
+    if run:
+        candidates.append(frozenset(["".join(run)]))
+    return candidates
+
+
+def _item_literals(op, av, max_literals):
+    if op is sre_parse.SUBPATTERN:
+        group, add_flags, del_flags, item = av
+        return [] if add_flags or del_flags else _sequence_literals(item, max_literals)
+    if op is _ATOMIC_GROUP:
+        return _sequence_literals(av, max_literals)
+    if op in _REPEATS:
+        min_count, max_count, item = av
+        return _sequence_literals(item, max_literals) if min_count >= 1 else []
+    if op is sre_parse.BRANCH:
+        literals = set()
+        for branch in av[1]:
+            best = _best_literals(_sequence_literals(branch, max_literals))
+            if best is None:
+                return []
+            literals |= best
+        return [frozenset(literals)] if len(literals) <= max_literals else []
+    if op is sre_parse.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op is sre_parse.LITERAL:
+                chars.add(chr(item_av))
+            elif item_op is sre_parse.RANGE and item_av[1] - item_av[0] < max_literals:
+                chars.update(chr(code) for code in range(item_av[0], item_av[1] + 1))
+            else:
+                return []  # NEGATE, categories, large ranges
+        return [frozenset(chars)] if len(chars) <= max_literals else []
+    return []
+
+
+def _best_literals(candidates):
+    """ Select the most selective candidate literal set: the longest shortest literal, then the fewest literals. """
+    if not candidates:
+        return None
+    return max(candidates, key=lambda literals: (min(len(literal) for literal in literals), -len(literals)))
+
+
+_BYTES_ANCHORS = (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END, sre_parse.AT_END_STRING)
+
+
+def bytes_regex(regex):
+    """ Compile a bytes version of regex, matching UTF-8 encoded text the same way (see "Bytes patterns" above).
+
+    Args:
+        regex: A compiled (str) regex.
+
+    Returns:
+        A compiled bytes regex, or None if the regex is not supported.
+    """
+    if not isinstance(regex.pattern, str) or regex.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+        if parsed.getwidth()[0] == 0:
+            return None  # Could match between the bytes of a character
+        expected = _utf8_sequence(parsed.data)
+        compiled = re.compile(regex.pattern.encode('utf-8'), regex.flags & ~re.UNICODE)
+        # The bytes pattern must parse to the same items, with non-ASCII literals as UTF-8 byte sequences:
+        if _freeze(sre_parse.parse(compiled.pattern, compiled.flags).data) != expected:
+            return None
+    except (Unsupported, re.error, TypeError, ValueError, OverflowError):
+        return None
+    return compiled
+
+
+def _freeze(value):
+    """ Convert parsed regex items (SubPatterns, lists, and tuples) to nested tuples, for comparison. """
+    if isinstance(value, (list, tuple, sre_parse.SubPattern)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _utf8_sequence(items):
+    """ Get the (frozen) parsed items of a str regex sequence as they should be in the UTF-8 bytes regex. """
+    result = []
+    for op, av in items:
+        if op is sre_parse.LITERAL and av > 0x7f:
+            result.extend((sre_parse.LITERAL, byte) for byte in chr(av).encode('utf-8'))
+        else:
+            result.append((op, _utf8_item(op, av)))
+    return tuple(result)
+
+
+def _utf8_item(op, av):
+    if op is sre_parse.LITERAL:
+        return av
+    if op is sre_parse.IN:
+        if not all(item_op is sre_parse.LITERAL and item_av <= 0x7f
+                   or item_op is sre_parse.RANGE and item_av[1] <= 0x7f for item_op, item_av in av):
+            raise Unsupported("character class")  # NEGATE, categories, non-ASCII characters
+        return _freeze(av)
+    if op in _REPEATS:
+        min_count, max_count, item = av
+        if len(item) == 1 and item[0][0] is sre_parse.LITERAL and item[0][1] > 0x7f:
+            raise Unsupported("repeated non-ASCII character")  # `é+` (the bytes pattern repeats the last byte)
+        return min_count, max_count, _utf8_sequence(item)
+    if op is sre_parse.SUBPATTERN:
+        group, add_flags, del_flags, item = av
+        if add_flags & (re.IGNORECASE | re.LOCALE):
+            raise Unsupported("inline flags")
+        return group, add_flags, del_flags, _utf8_sequence(item)
+    if op is _ATOMIC_GROUP:
+        return _utf8_sequence(av)
+    if op is sre_parse.BRANCH:
+        return av[0], tuple(_utf8_sequence(branch) for branch in av[1])
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return av[0], _utf8_sequence(av[1])
+    if op is sre_parse.GROUPREF:
+        return av
+    if op is sre_parse.GROUPREF_EXISTS:
+        group, yes, no = av
+        return group, _utf8_sequence(yes), None if no is None else _utf8_sequence(no)
+    if op is sre_parse.AT and av in _BYTES_ANCHORS:
+        return av
+    # ANY, NOT_LITERAL, CATEGORY, word boundaries, etc:
+    raise Unsupported(str(op))
@@ -1,7 +1,15 @@
-
 """
 Module for changing encoding of files.
 
+The input encoding of each file is detected (see `encoding_utils.detect_encoding()`), unless given.
+Files are converted block by block (so memory use does not depend on the file size),
+and can be processed in parallel by a pool of worker processes (--jobs).
+
+Existing output files are handled according to --if-exists:
+    skip: Keep the existing file (the default),
+    overwrite: Overwrite the existing file (same as --overwrite),
+    older: Overwrite the existing file only if it is older than the input file.
+
 See also:
     `iconv` - unix tool to convert text encodings:
         $ iconv -f CP1252 -t utf-8 inputfile > outputfile
@@ -11,59 +19,91 @@ See also:
 
 
 import os
+import sys
 import argparse
 
+from tts_preprocessor.encoding_utils import file_encoding, transcode_file, AUTO_ENCODING, TRANSCODE_BLOCKSIZE
+from tts_preprocessor.parallel import process_files_in_pool, process_files_serially
+
+DEFAULT_OUTPUTFNFMT = "{fnbase}.{outputencoding}{fnext}"
+IF_EXISTS_POLICIES = ("skip", "overwrite", "older")
+
+
+def should_write(inputfn, outputfn, if_exists="skip"):
+    """ Return True if outputfn should be written, according to the if_exists policy (see module docstring). """
+    if not os.path.exists(outputfn) or if_exists == "overwrite":
+        return True
+    if if_exists == "older":
+        return os.path.getmtime(outputfn) < os.path.getmtime(inputfn)
+    return False
+
+
+def convert_file(inputfn, outputencoding, inputencoding=None, outputfnfmt=DEFAULT_OUTPUTFNFMT, if_exists="skip",
+                 blocksize=TRANSCODE_BLOCKSIZE):
+    """ Convert a single file to outputencoding, detecting its encoding if inputencoding is not given.
 
-def main():
+    Returns:
+        The output filename, or None if the file was skipped.
+    """
+    _encoding = inputencoding
+    if _encoding is None or _encoding == AUTO_ENCODING:
+        _encoding, confidence = file_encoding(inputfn)
+        if _encoding is None:
+            print("Could not detect encoding of file %s (is `chardet` installed?)\n - skipping.." % inputfn)
+            return None
+        print("Detected encoding of %s: %s (confidence %.2f)" % (inputfn, _encoding, confidence))
+    fnbase, fnext = os.path.splitext(inputfn)
+    outputfn = outputfnfmt.format(inputfn=inputfn, fnbase=fnbase, fnext=fnext,
+                                  inputencoding=_encoding, outputencoding=outputencoding)
+    if not should_write(inputfn, outputfn, if_exists):
+        print(" - Skipping existing file: %s" % outputfn)
+        return None
+    print("Reading %s" % inputfn)
+    print("(Re-)writing content to file:", outputfn)
+    # Write to a temporary file first, so the output file is never left half-written (or read while written):
+    tmpfn = outputfn + ".tmp"
+    try:
+        transcode_file(inputfn, tmpfn, _encoding, outputencoding, blocksize=blocksize)
+    except BaseException:
+        if os.path.exists(tmpfn):
+            os.remove(tmpfn)
+        raise
+    os.replace(tmpfn, outputfn)
+    print(" - Done!")
+    return outputfn
+
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--inputencoding")  # , default="utf-8")  # or use chardet
+    ap.add_argument("--inputencoding", help="The input encoding (default: detected for each file).")
     ap.add_argument("outputencoding")  # , default="utf-8")
-    ap.add_argument("--overwrite", action="store_true")
-    ap.add_argument("--outputfnfmt", default="{fnbase}.{outputencoding}{fnext}")  #   {inputfn}.out
+    ap.add_argument("--if-exists", choices=IF_EXISTS_POLICIES, default="skip",
+                    help="What to do if an output file exists: skip the file, overwrite it, "
+                         "or overwrite it only if it is older than the input file.")
+    ap.add_argument("--overwrite", action="store_const", const="overwrite", dest="if_exists",
+                    help="Overwrite existing output files (same as --if-exists overwrite).")
+    ap.add_argument("--outputfnfmt", default=DEFAULT_OUTPUTFNFMT)  #   {inputfn}.out
+    ap.add_argument("-j", "--jobs", type=int, default=1,
+                    help="Number of worker processes used to convert files in parallel (0: one per CPU core).")
+    ap.add_argument("--blocksize", type=int, default=TRANSCODE_BLOCKSIZE,
+                    help="Block size (in characters) used to convert files.")
     ap.add_argument("inputfiles", nargs="+")
 
-    argns = ap.parse_args()
+    argns = ap.parse_args(argv)
 
-    inputfiles = argns.inputfiles
-    inputencoding = argns.inputencoding
-    outputencoding = argns.outputencoding
-    outputfnfmt = argns.outputfnfmt
-    overwrite = argns.overwrite
-
-    try:
-        import chardet
-    except ImportError as e:
-        print("Module `chardet` not available; will use 'utf8' as default encoding (when not specified).")
-
-    for inputfn in inputfiles:
-        _encoding = inputencoding
-        fnbase, fnext = os.path.splitext(inputfn)
-        outputfn = outputfnfmt.format(inputfn=inputfn, fnbase=fnbase, fnext=fnext,
-                                      inputencoding=inputencoding, outputencoding=outputencoding)
-        if os.path.exists(outputfn) and not overwrite:
-            answer = input("File %s exists. Overwrite? " % outputfn)
-            if not answer or answer.lower()[0] != 'y':
-                print(" - Skipping file: %s" % outputfn)
-                continue
-        if _encoding is None:
-            # Use chardet
-            # OBS: Not actually very good at detecting e.g. Danish characters in Windows-1252 / CP1252.
-            with open(inputfn, 'rb') as fp:
-                file_bytes = fp.read()
-                try:
-                    _encoding = chardet.detect(file_bytes)['encoding']
-                except KeyError:
-                    print("Could not detect encoding of file %s\n - skipping.." % inputfn)
-                    continue
-                # For large files, you can also create a detector and use detector.feed(fp)
-        with open(inputfn, encoding=_encoding) as fp:
-            print("Reading %s" % inputfn)
-            content = fp.read()
-        with open(outputfn, mode='w', encoding=outputencoding) as fp:
-            print("(Re-)writing content to file:", outputfn)
-            fp.write(content)
-            print(" - Done!")
+    convert_kwargs = dict(
+        outputencoding=argns.outputencoding,
+        inputencoding=argns.inputencoding,
+        outputfnfmt=argns.outputfnfmt,
+        if_exists=argns.if_exists,
+        blocksize=argns.blocksize,
+    )
+    if argns.jobs != 1 and len(argns.inputfiles) > 1:
+        errors = process_files_in_pool(convert_file, argns.inputfiles, jobs=argns.jobs, **convert_kwargs)
+    else:
+        errors = process_files_serially(convert_file, argns.inputfiles, **convert_kwargs)
+    return 1 if errors else 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
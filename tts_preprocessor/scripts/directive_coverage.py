@@ -0,0 +1,78 @@
+"""
+
+Report which directive ops match (and which never do) across a corpus of documents,
+and optionally write pruned copies of the patterns files (see `op_coverage`).
+
+Usage:
+    $ python -m tts_preprocessor.scripts.directive_coverage corpus/*.txt -d default_txt --verbose
+    $ python -m tts_preprocessor.scripts.directive_coverage corpus/*.txt -d mylexicon.txt --prune --output-dir pruned
+
+Input files are processed with the same directives as `tts_v2` (given with --directive, or the defaults
+for the first input file's extension), but no output files are written.
+
+
+"""
+
+import os
+import sys
+from argparse import ArgumentParser
+
+from tts_preprocessor.op_coverage import OpCoverage, write_pruned_patterns, DEFAULT_RARE
+from tts_preprocessor.scripts.tts_v2 import get_directive_transforms
+
+
+def pruned_filename(filename, output_dir):
+    """ Get the output filename for a pruned patterns file, e.g. default_txt_pruned.patterns.txt.
+
+    (The pruned file has a different directive name, so it can be used alongside the original.)
+    """
+    name, dot, rest = os.path.basename(filename).partition(".")
+    return os.path.join(output_dir, name + "_pruned" + dot + rest)
+
+
+def main(argv=None):
+    ap = ArgumentParser(description="Report directive op coverage (matches per op) across a corpus of documents.")
+    ap.add_argument('inputfiles', nargs='+', help="The corpus of documents.")
+    ap.add_argument('-d', '--directive', nargs="+", action="append", dest="directives",
+                    help="A named directive or filename (assume filename, if a file with that name exists).")
+    ap.add_argument('--inputencoding', default='utf-8')
+    ap.add_argument('--rare', type=int, default=DEFAULT_RARE,
+                    help="Report ops with at most this many matches as rare.")
+    ap.add_argument('--prune', action="store_true",
+                    help="Write pruned copies of the patterns files, without dead and identity ops.")
+    ap.add_argument('--prune-rare', type=int, default=None, metavar="N",
+                    help="Also prune ops with at most N matches (this changes the output for the corpus).")
+    ap.add_argument('--output-dir', default=".", help="Directory for the pruned patterns files.")
+    ap.add_argument('--json', metavar="FILE", help="Save the match counts of all ops as JSON.")
+    ap.add_argument('--verbose', action="count", default=0)
+    argns = ap.parse_args(argv)
+
+    directives = argns.directives
+    if directives is not None:
+        directives = [directive for nargs in directives for directive in nargs]
+    coverage = OpCoverage(get_directive_transforms(directives=directives, inputfile=argns.inputfiles[0]))
+    for inputfile in argns.inputfiles:
+        with open(inputfile, encoding=argns.inputencoding) as fp:
+            coverage(fp.read())
+    print(coverage.report(rare=argns.rare, verbose=argns.verbose))
+
+    if argns.json:
+        import json
+        with open(argns.json, mode='w', encoding='utf-8') as fp:
+            json.dump(coverage.as_dict(), fp, indent=1)
+        print("Coverage saved to", argns.json)
+    if argns.prune or argns.prune_rare is not None:
+        os.makedirs(argns.output_dir, exist_ok=True)
+        for directive in coverage.directives:
+            if directive.filename is None:
+                print("Directive %s was not loaded from a file; not pruned." % (directive.name,))
+                continue
+            outputfn = pruned_filename(directive.filename, argns.output_dir)
+            removed = write_pruned_patterns(
+                directive.filename, directive.prune_indices(prune_rare=argns.prune_rare), outputfn)
+            print("Writing file: %s (%s of %s ops removed)" % (outputfn, removed, len(directive.counts)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,53 +26,254 @@ Regarding outputfnfmt args:
 """
 
 import os
-import pprint
+import sys
 from argparse import ArgumentParser
 
-from tts_preprocessor.directives import ensure_directive_is_registered
+from tts_preprocessor.directives import ensure_directive_is_registered, rebuild_directive_cache
 from tts_preprocessor.directives import DEFAULT_FILE_DIRECTIVES, REGISTERED_DIRECTIVE_DEFS, REGISTERED_TRANSFORMATIONS
+from tts_preprocessor.streaming import DEFAULT_BLOCKSIZE, is_local, stream_transform, aiter_paragraphs, aiter_text
+from tts_preprocessor.streaming import take_paragraphs
+from tts_preprocessor.parallel import process_files_in_pool, process_files_serially, is_chunk_safe
+from tts_preprocessor.parallel import transform_chunks_in_pool
+from tts_preprocessor.manifest import Manifest, chain_fingerprint, file_hash, write_if_changed, replace_if_changed
+from tts_preprocessor.directives import CACHE_DIR
+from tts_preprocessor.paragraph_cache import ParagraphCache, DEFAULT_DB_MAXSIZE
+from tts_preprocessor.text_processing import Segmenter
+from tts_preprocessor.bytes_processing import get_bytes_chain, mmap_transform, mmap_unsupported
+from tts_preprocessor.encoding_utils import resolve_encoding, AUTO_ENCODING
+from tts_preprocessor.latex_processing import LATEX_ENGINES
+from tts_preprocessor import profiling
 
 
 def default_argparser(**ap_kwargs):
     ap = ArgumentParser(**ap_kwargs)
-    ap.add_argument('inputfiles', nargs='+')  # Only one? Or maybe multiple?
+    ap.add_argument('inputfiles', nargs='*')  # Only one? Or maybe multiple?
     # ap.add_argument('--patternsfile')
     ap.add_argument('-d', '--directive', nargs="+", action="append", dest="directives",
                     help="A named directive or filename (assume filename, if a file with that name exists).")
     # ap.add_argument('--patternsformat')  # how to load patternsfile; yaml/json/txt/tsv/csv; default: tsv
     ap.add_argument('--outputfnfmt', default="{fnroot}.out{fnext}")
-    ap.add_argument('--inputencoding', default='utf-8')
+    ap.add_argument('--inputencoding', default='utf-8',
+                    help="The encoding of the input files ('auto': detect the encoding of each file).")
     ap.add_argument('--outputencoding', default='utf-8')
+    ap.add_argument('--streaming', action="store_true",
+                    help="Read, transform, and write large files in paragraph-aligned blocks, to limit memory usage. "
+                         "Only used if all directives are local; otherwise the whole file is processed at once.")
+    ap.add_argument('--blocksize', type=int, default=DEFAULT_BLOCKSIZE,
+                    help="Block size (in characters; in bytes for --mmap) used for --streaming and --mmap.")
+    ap.add_argument('--mmap', action="store_true", dest="use_mmap",
+                    help="Memory-map UTF-8 input files and apply the directives to the bytes, decoding only for ops "
+                         "that need str semantics; written block by block if all directives are local. "
+                         "Not used for other encodings, with --paragraph-cache or --profile, or for files with "
+                         "carriage returns.")
+    ap.add_argument('-j', '--jobs', type=int, default=1,
+                    help="Number of worker processes used to process input files in parallel (0: one per CPU core). "
+                         "A single input file is split into chunks, which are processed in parallel, "
+                         "if all directives are chunk-safe.")
+    ap.add_argument('--incremental', action="store_true",
+                    help="Skip input files whose outputs are up to date, according to the manifest in the output "
+                         "directory (input hash, directive fingerprint, encodings, output hash), "
+                         "and only rewrite changed outputs.")
+    ap.add_argument('--paragraph-cache', nargs='?', const="default", metavar="DBFILE",
+                    help="Cache transformed paragraphs (in memory, and in an SQLite database on disk), and only "
+                         "transform paragraphs that are not in the cache. DBFILE defaults to paragraphs.sqlite in "
+                         "the cache directory; use 'memory' for an in-memory cache only.")
+    ap.add_argument('--paragraph-cache-size', type=int, default=DEFAULT_DB_MAXSIZE // 2**20, metavar="MB",
+                    help="Maximum size of the on-disk paragraph cache, in MB.")
+    ap.add_argument('--profile', action="store_true",
+                    help="Profile the directives: Record time, matches, and bytes in/out for each op (and "
+                         "transformation), and print a report of the slowest. Files are processed serially.")
+    ap.add_argument('--profile-top', type=int, default=profiling.DEFAULT_TOP, metavar="N",
+                    help="Number of directive ops shown in the --profile report.")
+    ap.add_argument('--profile-json', metavar="FILE", help="Also save the full --profile statistics as JSON.")
+    ap.add_argument('--segment', type=int, metavar="MAXLEN",
+                    help="Split the output into segments of at most MAXLEN characters (e.g. the TTS engine's limit), "
+                         "cutting at sentence, clause, or word boundaries; one segment per line, "
+                         "with a blank line after each paragraph.")
+    ap.add_argument('--rebuild-cache', action="store_true",
+                    help="Re-parse and validate all patterns files in the directive directories (and any given "
+                         "as directive files), updating the directive cache. Input files are optional.")
+    ap.add_argument('--latex-engine', choices=sorted(LATEX_ENGINES),
+                    help="Convert LaTeX to text with this engine: pylatexenc, or the single-pass fast engine "
+                         "(see `latex_processing.FastLatexConverter`). Replaces a `pylatexenc` directive, or is added "
+                         "after the default directives for .tex files.")
     ap.add_argument('--verbose', action="count", default=0)
     # argns = ap.parse_args()  # args, namespace
     return ap
 
 
-def apply_transformations(text, transformations):
+def apply_transformations(text, transformations, jobs=1, cache=None):
+    """ Apply transformations to text.
+
+    While profiling (see `profiling`), the transformations are applied one by one, and each is recorded.
+    Otherwise, if cache (a `paragraph_cache.ParagraphCache`) is given, the text is split into paragraphs,
+    and only paragraphs not found in the cache are transformed.
+
+    Otherwise, with jobs != 1, if all transformations are chunk-safe, the text is split into chunks at paragraph/section
+    boundaries, and the chunks are transformed in parallel (see `parallel.transform_chunks_in_pool()`).
+    """
+    if profiling.ACTIVE_PROFILER is not None:
+        return profiling.ACTIVE_PROFILER.apply_transformations(text, transformations)
+    if cache is not None:
+        return cache.apply(text, transformations)
+    if jobs != 1 and all(is_chunk_safe(transform) for transform in transformations):
+        return transform_chunks_in_pool(text, transformations, jobs=jobs)
     for transform in transformations:
         text = transform(text)
     return text
 
 
-def process_file(inputfile, transformations, outputfnfmt=None, inputencoding=None, outputencoding=None, verbose=0):
-    if inputencoding is None:
-        inputencoding = 'utf-8'
-    if outputencoding is None:
-        outputencoding = inputencoding
+# Chunk size used to read input and split output in `apply_transformations_async()`:
+ASYNC_BLOCKSIZE = 2**16  # characters
+
+
+async def apply_transformations_async(source, transformations, encoding='utf-8', blocksize=ASYNC_BLOCKSIZE,
+                                      prefetch=1):
+    """ Apply transformations to text, yielding transformed chunks (paragraphs) as soon as they are ready.
+
+    This is an async generator, e.g. for reading a long document aloud while it is being processed:
+
+        async for chunk in apply_transformations_async(stream, transformations):
+            await speak(chunk)
+
+    If all transformations are local (see `streaming`), each paragraph is transformed and yielded as soon as
+    it has been read, so the first chunk is ready long before the whole input has been read.
+    Otherwise, the whole input is read and transformed first, and the result is then yielded paragraph by paragraph.
+    Joining the chunks gives the same result as `apply_transformations()`.
+
+    Transformations run in the event loop's default executor, so the event loop is not blocked.
+    At most `prefetch` chunks are transformed ahead of the consumer (backpressure): input is only read
+    as fast as the consumer takes chunks, so a slow consumer does not make memory use grow.
+
+    Args:
+        source: The input text, as a string, or an async iterable of bytes (e.g. an `asyncio.StreamReader`)
+            or strings.
+        transformations: The chain of transformations.
+        encoding: The encoding of byte input.
+        blocksize: Paragraphs longer than this (characters) are split at newlines.
+        prefetch: The number of chunks transformed ahead of the consumer.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(1, prefetch))
+    done = object()
+    errors = []
+
+    async def produce():
+        try:
+            if all(is_local(transform) for transform in transformations):
+                async for paragraph in aiter_paragraphs(source, encoding=encoding, blocksize=blocksize):
+                    await queue.put(await loop.run_in_executor(None, apply_transformations, paragraph, transformations))
+            else:
+                text = "".join([text async for text in aiter_text(source, encoding=encoding)])
+                text = await loop.run_in_executor(None, apply_transformations, text, transformations)
+                paragraphs, rest = take_paragraphs(text, blocksize=blocksize)
+                for paragraph in paragraphs + [rest]:
+                    await queue.put(paragraph)
+        except Exception as e:
+            errors.append(e)
+        await queue.put(done)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            if chunk:
+                yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        producer.cancel()
+
+
+def format_outputfn(outputfnfmt, inputfile):
+    """ Get the output filename for inputfile, from outputfnfmt (see module docstring for the fields). """
     fnroot, fnext = os.path.splitext(inputfile)
     fnbasename = os.path.basename(inputfile)
     fnbase_noext = os.path.basename(fnroot)
     fndir = os.path.dirname(inputfile)
+    return outputfnfmt.format(
+        inputfile=inputfile, fnroot=fnroot, fnext=fnext, fnbasename=fnbasename, fndir=fndir, fnbase_noext=fnbase_noext,
+        cwd=os.getcwd())
+
+
+def process_file(inputfile, transformations, outputfnfmt=None, inputencoding=None, outputencoding=None, verbose=0,
+                 streaming=False, blocksize=DEFAULT_BLOCKSIZE, jobs=1, manifest=None,
+                 paragraph_cache=None, use_mmap=False):
+    """ Process a single input file, writing the result to the output file given by outputfnfmt.
+
+    If a manifest is given (see `manifest.Manifest`), the file is skipped if its output is up to date,
+    and the output file is only written if its content changes.
+    With inputencoding="auto", the encoding of the file is detected (see `encoding_utils`).
+    If a paragraph_cache is given (see `paragraph_cache.ParagraphCache`), it is used to transform the text.
+    With use_mmap=True, the file is memory-mapped and transformed as bytes, if possible (see `bytes_processing`).
+
+    Returns:
+        (outputfn, manifest_entry) if a manifest is given and the file was processed, otherwise None.
+    """
+    if inputencoding is None:
+        inputencoding = 'utf-8'
+    if outputencoding is None:
+        outputencoding = inputencoding
+    outputfn = format_outputfn(outputfnfmt, inputfile)
+    inputencoding = resolve_encoding(inputfile, inputencoding)
+    if outputencoding == AUTO_ENCODING:
+        outputencoding = inputencoding
+    encodings = (inputencoding, outputencoding)  # Recorded in the manifest, as they affect the output
+    if manifest is not None:
+        input_hash = file_hash(inputfile)
+        if manifest.is_current(outputfn, input_hash, encodings=encodings):
+            print("Skipping unchanged file:", inputfile)
+            return None
+    if use_mmap:
+        reason = mmap_unsupported(inputencoding, outputencoding)
+        if reason is None and paragraph_cache is not None:
+            reason = "the paragraph cache is used"
+        if reason is None:
+            chain = get_bytes_chain(transformations)
+            # With a manifest, write to a temporary file, and only replace the output file if it has changed:
+            mmapfn = outputfn if manifest is None else outputfn + ".tmp"
+            print("Reading file:", inputfile)
+            if mmap_transform(inputfile, mmapfn, chain, blocksize=blocksize):
+                print("Writing file:", outputfn)
+                if verbose:
+                    print(chain.report(verbose=verbose))
+                if manifest is not None:
+                    output_hash = replace_if_changed(mmapfn, outputfn)
+                    return outputfn, manifest.make_entry(inputfile, input_hash, output_hash, encodings=encodings)
+                return None
+            reason = "the file contains carriage returns"
+        print("Not using --mmap (%s)." % (reason,))
+    if streaming and not all(is_local(transform) for transform in transformations):
+        print("Directives are not all local; processing the whole file at once.")
+        streaming = False
+    if streaming:
+        # Write to a temporary file (the output file may be the input file), and then replace the output file
+        # (with a manifest, only if it has changed):
+        streamfn = outputfn + ".tmp"
+        with open(inputfile, encoding=inputencoding) as infp, \
+                open(streamfn, mode='w', encoding=outputencoding) as outfp:
+            print("Reading file:", inputfile)
+            print("Writing file:", outputfn)
+            stream_transform(infp, outfp, transformations, blocksize=blocksize, cache=paragraph_cache)
+        if manifest is not None:
+            output_hash = replace_if_changed(streamfn, outputfn)
+            return outputfn, manifest.make_entry(inputfile, input_hash, output_hash, encodings=encodings)
+        os.replace(streamfn, outputfn)
+        return None
+
     with open(inputfile, encoding=inputencoding) as fp:
         print("Reading file:", inputfile)
         content = fp.read()
 
-    for transform in transformations:
-        content = transform(content)
+    content = apply_transformations(content, transformations, jobs=jobs, cache=paragraph_cache)
 
-    outputfn = outputfnfmt.format(
-        inputfile=inputfile, fnroot=fnroot, fnext=fnext, fnbasename=fnbasename, fndir=fndir, fnbase_noext=fnbase_noext,
-        cwd=os.getcwd())
+    if manifest is not None:
+        print("Writing file:", outputfn)
+        output_hash = write_if_changed(outputfn, content, outputencoding)
+        return outputfn, manifest.make_entry(inputfile, input_hash, output_hash, encodings=encodings)
     with open(outputfn, mode='w', encoding=outputencoding) as fp:
         print("Writing file:", outputfn)
         fp.write(content)
@@ -99,8 +300,11 @@ def process_file(inputfile, transformations, outputfnfmt=None, inputencoding=Non
 #     return directives
 
 
-def get_directive_transforms(directives, inputfile):
-    """This depends on `data` module, `data` module depends on `pattern_utils`. Keep func here to void circular refs."""
+def get_directive_transforms(directives, inputfile, max_segment_length=None):
+    """This depends on `data` module, `data` module depends on `pattern_utils`. Keep func here to void circular refs.
+
+    If max_segment_length is given, a final `text_processing.Segmenter` stage is added to the transformations.
+    """
     if directives:
         for name_or_file in directives:
             ensure_directive_is_registered(name_or_file)
@@ -116,25 +320,103 @@ def get_directive_transforms(directives, inputfile):
             print("Could not determine which directive(s) to use; defaulting to %s patterns directive."
                   % (directives,))
     directives = [REGISTERED_TRANSFORMATIONS[name] for name in directives]
+    if max_segment_length:
+        directives.append(Segmenter(max_segment_length))
     return directives
 
 
+def select_latex_engine(directives, inputfile, engine):
+    """ Use the given LaTeX engine (see `latex_processing.LATEX_ENGINES`) to convert LaTeX to text.
+
+    The engine replaces `pylatexenc` in directives. Without directives, the engine is added after the default
+    directives for .tex files. Otherwise, the engine is not used (and a warning is printed).
+
+    Returns:
+        The directives (names) to use.
+    """
+    engine_directive = LATEX_ENGINES[engine][1]
+    if directives is None:
+        if os.path.splitext(inputfile)[1] == ".tex":
+            directives = DEFAULT_FILE_DIRECTIVES["tex"] + [engine_directive]
+            print("Using %s directives (based on input file extension '.tex')..." % (directives,))
+            return directives
+        print("Warning: --latex-engine %s has no effect (the input files are not .tex files)." % (engine,))
+        return directives
+    if "pylatexenc" not in directives and engine_directive not in directives:
+        print("Warning: --latex-engine %s has no effect (no `pylatexenc` directive given)." % (engine,))
+        return directives
+    return [engine_directive if directive == "pylatexenc" else directive for directive in directives]
+
+
 def process_all_inputfiles(
         inputfiles, directives, outputfnfmt,
-        inputencoding=None, outputencoding=None, verbose=0):
-    transformations = get_directive_transforms(directives=directives, inputfile=inputfiles[0])
+        inputencoding=None, outputencoding=None, verbose=0, streaming=False, blocksize=DEFAULT_BLOCKSIZE,
+        jobs=1, incremental=False, paragraph_cache=None, max_segment_length=None, use_mmap=False):
+    """ Process all input files, returning a list of (inputfile, error) for files that could not be processed.
+
+    With incremental=True, input files whose outputs are up to date are skipped (see `manifest`).
+    With a paragraph_cache, only paragraphs not found in the cache are transformed (see `paragraph_cache`).
+    With max_segment_length, the output is split into segments of at most that length, one per line
+    (see `text_processing.Segmenter`).
+    With use_mmap, input files are memory-mapped and transformed as bytes, if possible (see `bytes_processing`).
+
+    With jobs != 1, files are processed in parallel by a pool of worker processes (see `parallel`).
+    A single input file is processed in parallel chunks instead (see `apply_transformations()`).
+    """
+    transformations = get_directive_transforms(
+        directives=directives, inputfile=inputfiles[0], max_segment_length=max_segment_length)
+    if verbose:
+        for transform in transformations:
+            if getattr(transform, 'removed', None):
+                print(transform.optimization_report())
     # print("\nDirectives: (type: %s)" % (type(directives),))
     # pprint.pprint(directives)
     # print(directives)
-    for inputfn in inputfiles:
-        process_file(
-            inputfn,
-            transformations=transformations,
+    manifest = Manifest(chain_fingerprint(transformations)) if incremental else None
+
+    def record(result):
+        if result is not None:
+            manifest.record(*result)
+
+    if jobs != 1 and len(inputfiles) > 1:
+        errors = process_files_in_pool(
+            process_file, inputfiles,
+            chain_factory=get_directive_transforms,
+            factory_kwargs=dict(directives=directives, inputfile=inputfiles[0],
+                                max_segment_length=max_segment_length),
+            jobs=jobs,
+            on_result=record,
+            verbose=verbose,
             outputfnfmt=outputfnfmt,
             inputencoding=inputencoding,
             outputencoding=outputencoding,
-            verbose=verbose,
+            streaming=streaming,
+            blocksize=blocksize,
+            manifest=manifest,
+            paragraph_cache=paragraph_cache,
+            use_mmap=use_mmap,
         )
+        if incremental:
+            manifest.save()
+        return errors
+    errors = process_files_serially(
+        process_file, inputfiles,
+        on_result=record,
+        transformations=transformations,
+        outputfnfmt=outputfnfmt,
+        inputencoding=inputencoding,
+        outputencoding=outputencoding,
+        verbose=verbose,
+        streaming=streaming,
+        blocksize=blocksize,
+        jobs=jobs,
+        manifest=manifest,
+        paragraph_cache=paragraph_cache,
+        use_mmap=use_mmap,
+    )
+    if incremental:
+        manifest.save()
+    return errors
 
 
 def main(argv=None, argns=None):
@@ -148,15 +430,56 @@ def main(argv=None, argns=None):
     if directives is not None:
         directives = [directive for nargs in argns.directives for directive in nargs]
         print("Directives:", directives)
-    process_all_inputfiles(
-        inputfiles=argns.inputfiles,
-        directives=directives,
-        outputfnfmt=argns.outputfnfmt,
-        inputencoding=argns.inputencoding,
-        outputencoding=argns.outputencoding,
-        verbose=argns.verbose,
-    )
+    if argns.rebuild_cache:
+        cache_errors = rebuild_directive_cache([fn for fn in directives or () if os.path.isfile(fn)])
+        if not argns.inputfiles:
+            return 1 if cache_errors else 0
+    if not argns.inputfiles:
+        print("No input files given.")
+        return 2
+    if argns.latex_engine:
+        directives = select_latex_engine(directives, argns.inputfiles[0], argns.latex_engine)
+    paragraph_cache = None
+    if argns.paragraph_cache:
+        path = argns.paragraph_cache
+        if path == "default":
+            path = os.path.join(CACHE_DIR, "paragraphs.sqlite") if CACHE_DIR else None
+        elif path == "memory":
+            path = None
+        paragraph_cache = ParagraphCache(path, db_maxsize=argns.paragraph_cache_size * 2**20)
+    if argns.profile and argns.jobs != 1:
+        print("Profiling: processing files serially (--jobs 1).")
+        argns.jobs = 1
+    profiler = profiling.Profiler() if argns.profile else None
+    with profiling.profiling(profiler):
+        errors = process_all_inputfiles(
+            inputfiles=argns.inputfiles,
+            directives=directives,
+            outputfnfmt=argns.outputfnfmt,
+            inputencoding=argns.inputencoding,
+            outputencoding=argns.outputencoding,
+            verbose=argns.verbose,
+            streaming=argns.streaming,
+            blocksize=argns.blocksize,
+            jobs=argns.jobs,
+            incremental=argns.incremental,
+            paragraph_cache=paragraph_cache,
+            max_segment_length=argns.segment,
+            use_mmap=argns.use_mmap,
+        )
+    if profiler is not None:
+        print(profiler.report(top=argns.profile_top))
+        if argns.profile_json:
+            profiler.save(argns.profile_json)
+            print("Profile saved to", argns.profile_json)
+    if paragraph_cache is not None:
+        paragraph_cache.close()
+        if argns.verbose and (paragraph_cache.hits or paragraph_cache.misses):  # (Not counted in worker processes)
+            print("Paragraph cache: %s hits, %s misses." % (paragraph_cache.hits, paragraph_cache.misses))
+    if errors:
+        print("%s of %s input files could not be processed." % (len(errors), len(argns.inputfiles)))
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+
+Long-running preprocessing server (daemon), keeping directives loaded and compiled in memory.
+
+Starting the command line tools for every short text means importing the package, loading the directive index,
+and loading and compiling the directives, every time. The server does this once, and then processes
+requests from many (concurrent) clients over a local socket (a Unix socket, or a TCP port on localhost).
+
+Protocol: JSON lines, i.e. one JSON object per line (UTF-8), in both directions. A request is
+    {"id": 1, "text": "...", "directives": ["default_txt", "mylexicon.txt"], "format": "txt", "stream": false}
+where only "text" is required:
+* "directives": Directive names or patterns files (default: the default directives for "format", e.g. "tex").
+* "stream": If true, the result is sent back in paragraph-aligned chunks, as they are transformed
+    (only if all directives are local, see `streaming`), otherwise in a single response.
+The responses are
+    {"id": 1, "text": "..."}                                 -- the result (not streaming), or
+    {"id": 1, "chunk": "..."}, ..., {"id": 1, "done": true}  -- the result, streaming, or
+    {"id": 1, "error": "..."}                                -- if the request could not be processed.
+Requests on the same connection are answered in order; use more connections for concurrent requests.
+A {"command": "ping"} request is answered with {"pong": true} (e.g. to check that the server is running).
+
+Patterns files are checked for changes every `reload_interval` seconds, and changed files are reloaded
+(see `directives.reload_changed_directives()`), so edits to patterns files take effect without restarting.
+
+Usage:
+    $ python -m tts_preprocessor.server --socket /tmp/tts_preprocessor.sock
+    $ python -m tts_preprocessor.server --port 8765
+
+    >>> from tts_preprocessor.server import request
+    >>> request("Hello world, e.g. ...", socket_path="/tmp/tts_preprocessor.sock")
+
+OBS: Requests can name any patterns file readable by the server, so only listen on local sockets.
+
+
+"""
+
+import asyncio
+import io
+import json
+import os
+import socket
+import sys
+from argparse import ArgumentParser
+
+from tts_preprocessor.directives import ensure_directive_is_registered, reload_changed_directives
+from tts_preprocessor.directives import DEFAULT_FILE_DIRECTIVES, REGISTERED_TRANSFORMATIONS
+from tts_preprocessor.streaming import is_local, read_blocks
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_RELOAD_INTERVAL = 2.0  # seconds
+STREAM_BLOCKSIZE = 2**14  # characters; the chunk size for streaming responses
+MAX_LINE_LENGTH = 2**30  # bytes; the maximum size of a single request
+
+
+def resolve_chain(directives=None, fmt=None):
+    """ Get the chain of transformations for a request's directives (or the default directives for format). """
+    if isinstance(directives, str):
+        directives = [directives]
+    if not directives:
+        directives = DEFAULT_FILE_DIRECTIVES.get((fmt or "txt").lstrip("."), DEFAULT_FILE_DIRECTIVES["txt"])
+    chain = []
+    for name_or_file in directives:
+        try:
+            ensure_directive_is_registered(name_or_file)
+        except AssertionError:
+            raise ValueError("Unknown directive: %r" % (name_or_file,))
+        chain.append(REGISTERED_TRANSFORMATIONS[name_or_file])
+    return chain
+
+
+def apply_chain(text, chain):
+    for transform in chain:
+        text = transform(text)
+    return text
+
+
+class PreprocessingServer:
+    """ Asyncio server processing JSON-lines requests (see module docstring).
+
+    Args:
+        preload: Directive names to load and compile when the server starts
+            (default: all default directives, see `DEFAULT_FILE_DIRECTIVES`).
+        reload_interval: How often (seconds) to check patterns files for changes (0: never).
+    """
+
+    def __init__(self, preload=None, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        if preload is None:
+            preload = sorted({name for names in DEFAULT_FILE_DIRECTIVES.values() for name in names})
+        self.preload = preload
+        self.reload_interval = reload_interval
+        self.requests = 0
+
+    async def serve(self, socket_path=None, host=DEFAULT_HOST, port=None):
+        """ Start the server (on a Unix socket if socket_path is given, otherwise on host:port), and run forever. """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, resolve_chain, self.preload)
+        if socket_path is not None:
+            remove_stale_socket(socket_path)
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_path, limit=MAX_LINE_LENGTH)
+            print("Listening on Unix socket %s" % (socket_path,))
+        else:
+            server = await asyncio.start_server(self.handle_client, host=host, port=port, limit=MAX_LINE_LENGTH)
+            print("Listening on %s:%s" % (host, port))
+        sys.stdout.flush()
+        watcher = None
+        if self.reload_interval:
+            # Keep a reference to the task (the event loop only keeps a weak reference), and log if it fails:
+            watcher = asyncio.ensure_future(self.watch_patterns_files())
+            watcher.add_done_callback(report_watcher_failure)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if socket_path is not None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+    async def watch_patterns_files(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                reloaded, errors = await loop.run_in_executor(None, reload_changed_directives)
+            except Exception as e:  # Keep watching (errors in single files are returned in errors).
+                print("Error checking patterns files for changes: %s: %s" % (type(e).__name__, e))
+                sys.stdout.flush()
+                continue
+            for fn in reloaded:
+                print("Reloaded patterns file:", fn)
+            for fn, error in errors:
+                print("Error reloading patterns file %s: %s" % (fn, error))
+            if reloaded or errors:
+                sys.stdout.flush()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.handle_request(line, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, line, writer):
+        loop = asyncio.get_running_loop()
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object.")
+            request_id = request.get('id')
+            if request.get('command') == 'ping':
+                await self.send(writer, {'id': request_id, 'pong': True})
+                return
+            text = request['text']
+            chain = await loop.run_in_executor(
+                None, resolve_chain, request.get('directives'), request.get('format'))
+            self.requests += 1
+            if request.get('stream') and all(is_local(transform) for transform in chain):
+                for block in read_blocks(io.StringIO(text), blocksize=STREAM_BLOCKSIZE):
+                    chunk = await loop.run_in_executor(None, apply_chain, block, chain)
+                    await self.send(writer, {'id': request_id, 'chunk': chunk})
+                await self.send(writer, {'id': request_id, 'done': True})
+            elif request.get('stream'):
+                text = await loop.run_in_executor(None, apply_chain, text, chain)
+                await self.send(writer, {'id': request_id, 'chunk': text})
+                await self.send(writer, {'id': request_id, 'done': True})
+            else:
+                text = await loop.run_in_executor(None, apply_chain, text, chain)
+                await self.send(writer, {'id': request_id, 'text': text})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            await self.send(writer, {'id': request_id, 'error': "%s: %s" % (type(e).__name__, e)})
+
+    @staticmethod
+    async def send(writer, message):
+        writer.write(json.dumps(message).encode('utf-8') + b"\n")
+        await writer.drain()
+
+
+def report_watcher_failure(task):
+    """ Done callback for the patterns file watcher task: print the error, if the task failed. """
+    if not task.cancelled() and task.exception() is not None:
+        error = task.exception()
+        print("Patterns file watcher stopped (hot reload disabled): %s: %s" % (type(error).__name__, error))
+        sys.stdout.flush()
+
+
+def remove_stale_socket(socket_path):
+    """ Remove socket_path if it is a Unix socket left by a server that is no longer running. """
+    if not os.path.exists(socket_path):
+        return
+    try:
+        connect(socket_path=socket_path, timeout=1).close()
+    except OSError:
+        os.remove(socket_path)
+    else:
+        raise RuntimeError("A server is already listening on %s" % (socket_path,))
+
+
+def connect(socket_path=None, host=DEFAULT_HOST, port=None, timeout=None):
+    """ Connect to a running server (see `request()`), returning the socket. """
+    if socket_path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        return sock
+    return socket.create_connection((host, port), timeout=timeout)
+
+
+def request(text, directives=None, fmt=None, socket_path=None, host=DEFAULT_HOST, port=None, timeout=None):
+    """ Send a single (non-streaming) request to a running server, returning the transformed text.
+
+    Raises:
+        RuntimeError if the server could not process the request.
+    """
+    message = {'id': 0, 'text': text, 'directives': directives, 'format': fmt}
+    with connect(socket_path=socket_path, host=host, port=port, timeout=timeout) as sock:
+        sock.sendall(json.dumps(message).encode('utf-8') + b"\n")
+        with sock.makefile('rb') as fp:
+            response = json.loads(fp.readline())
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response['text']
+
+
+def main(argv=None):
+    ap = ArgumentParser(description="Run a preprocessing server, keeping directives loaded and compiled in memory.")
+    ap.add_argument('--socket', dest="socket_path", help="Listen on this Unix socket.")
+    ap.add_argument('--host', default=DEFAULT_HOST, help="Listen on this host (with --port).")
+    ap.add_argument('--port', type=int, help="Listen on this TCP port (if --socket is not given).")
+    ap.add_argument('--preload', nargs="+", help="Directives to load when the server starts "
+                                                 "(default: the default directives for all file types).")
+    ap.add_argument('--reload-interval', type=float, default=DEFAULT_RELOAD_INTERVAL,
+                    help="Check patterns files for changes every N seconds (0: never).")
+    argns = ap.parse_args(argv)
+    if argns.socket_path is None and argns.port is None:
+        ap.error("Either --socket or --port is required.")
+    server = PreprocessingServer(preload=argns.preload, reload_interval=argns.reload_interval)
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Clean up (remove the socket) when terminated
+    try:
+        asyncio.run(server.serve(socket_path=argns.socket_path, host=argns.host, port=argns.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
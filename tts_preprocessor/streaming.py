@@ -0,0 +1,154 @@
+"""
+
+Streaming (bounded-memory) processing of large documents.
+
+Instead of reading the whole document, transforming it, and writing the result,
+the document is read in blocks, and each block is transformed and written before the next is read.
+Memory use is then proportional to the block size, rather than to the size of the document.
+
+Blocks are aligned to paragraphs: A block always ends right after a blank line ("\\n\\n"), if possible,
+otherwise right after a newline. Text after the last paragraph boundary in a block
+(the start of a paragraph which continues in the next block) is carried over to the next block,
+so a paragraph is never split between two blocks (unless it is longer than the block size).
+
+This is only valid for transformations that are *local*, i.e. where transforming the blocks one by one
+gives the same result as transforming the whole document. A transformation declares this with
+a `local` attribute (see `CompiledDirective.local`). Transformations without it, e.g. `pylatexenc`,
+are assumed to be non-local, and force whole-document processing.
+
+
+"""
+
+from tts_preprocessor.manifest import chain_fingerprint
+
+DEFAULT_BLOCKSIZE = 2**20  # characters
+
+
+def is_local(transform):
+    """ Return True if transform can be applied block by block (i.e. declares itself local). """
+    return bool(getattr(transform, 'local', False))
+
+
+def find_block_end(text, start=0):
+    """ Find the position where a block should end, i.e. right after the last paragraph boundary in text.
+
+    Args:
+        text: The text to search.
+        start: Only search for boundaries at or after this position.
+
+    Returns:
+        The block end position, or 0 if text[start:] does not contain a newline.
+    """
+    pos = text.rfind("\n\n", start)
+    if pos != -1:
+        return pos + 2
+    return text.rfind("\n", start) + 1
+
+
+def read_blocks(fp, blocksize=DEFAULT_BLOCKSIZE):
+    """ Read text from file-like object fp, yielding paragraph-aligned blocks.
+
+    Joining the blocks gives the full text.
+    """
+    carry = ""
+    while True:
+        data = fp.read(blocksize)
+        if not data:
+            break
+        # Only search the new data (and the last carried character) for boundaries:
+        search_start = max(len(carry) - 1, 0)
+        carry += data
+        end = find_block_end(carry, search_start)
+        if end:
+            yield carry[:end]
+            carry = carry[end:]
+    if carry:
+        yield carry
+
+
+def transform_blocks(blocks, transformations, cache=None):
+    """ Apply transformations to each block in turn, yielding the transformed blocks.
+
+    If cache (a `paragraph_cache.ParagraphCache`) is given, it is used to transform the blocks.
+    """
+    if cache is not None:
+        fingerprint = chain_fingerprint(transformations)
+        for block in blocks:
+            yield cache.apply(block, transformations, fingerprint=fingerprint)
+        return
+    for block in blocks:
+        for transform in transformations:
+            block = transform(block)
+        yield block
+
+
+def stream_transform(infp, outfp, transformations, blocksize=DEFAULT_BLOCKSIZE, cache=None):
+    """ Read text from infp, transform it block by block, and write the result to outfp.
+
+    All transformations must be local (see `is_local()`).
+    """
+    for block in transform_blocks(read_blocks(infp, blocksize=blocksize), transformations, cache=cache):
+        outfp.write(block)
+
+
+# Asynchronous streaming (see `tts_v2.apply_transformations_async()`):
+
+def take_paragraphs(buffer, start=0, blocksize=DEFAULT_BLOCKSIZE):
+    """ Split the complete paragraphs off the start of buffer.
+
+    A paragraph is complete when followed by a blank line. If buffer grows larger than blocksize
+    without a paragraph boundary, it is split after its last newline instead (like `read_blocks()`).
+
+    Args:
+        buffer: The text read so far.
+        start: Only search for boundaries at or after this position (i.e. in text added since the last call).
+        blocksize: The maximum size of the remaining buffer, if it contains a newline.
+
+    Returns:
+        (paragraphs, rest), where joining paragraphs and rest gives buffer.
+    """
+    paragraphs = []
+    begin = 0
+    pos = buffer.find("\n\n", start)
+    while pos != -1:
+        paragraphs.append(buffer[begin:pos + 2])
+        begin = pos + 2
+        pos = buffer.find("\n\n", begin)
+    if len(buffer) - begin > blocksize:
+        end = buffer.rfind("\n", begin) + 1
+        if end:
+            paragraphs.append(buffer[begin:end])
+            begin = end
+    return paragraphs, buffer[begin:]
+
+
+async def aiter_text(source, encoding='utf-8'):
+    """ Iterate over text from source: a string, or an async iterable of bytes (decoded incrementally) or strings. """
+    if isinstance(source, str):
+        yield source
+        return
+    import codecs
+    decoder = codecs.getincrementaldecoder(encoding)()
+    async for data in source:
+        text = decoder.decode(data) if isinstance(data, (bytes, bytearray)) else data
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def aiter_paragraphs(source, encoding='utf-8', blocksize=DEFAULT_BLOCKSIZE):
+    """ Iterate over the paragraphs of text from source (see `aiter_text()`), as soon as each is complete.
+
+    Joining the paragraphs gives the full text.
+    """
+    buffer = ""
+    async for text in aiter_text(source, encoding=encoding):
+        # Search the new text (and the last character before it) for boundaries:
+        start = max(len(buffer) - 1, 0)
+        paragraphs, buffer = take_paragraphs(buffer + text, start=start, blocksize=blocksize)
+        for paragraph in paragraphs:
+            yield paragraph
+    if buffer:
+        yield buffer
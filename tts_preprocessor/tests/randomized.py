@@ -0,0 +1,58 @@
+"""
+
+Random directives and texts for the randomized (differential) tests, and the sequential reference implementation.
+
+Directives are drawn over a small alphabet, so that ops interact often (overlapping search strings,
+replacements creating matches for later ops, duplicate and identity ops), and texts contain line breaks,
+blank lines, and non-ASCII characters (for the bytes path).
+
+
+"""
+
+import re
+
+ALPHABET = "abcé"
+TEXT_ALPHABET = "abcé \n"
+# Regex ops, (search_pat, replace_pat); replacements use no template features beyond group references:
+REGEX_OPS = [
+    (r"a+", "a"), (r"b[ac]", "c"), (r"(a)b", r"\1c"), (r"c\b", "cc"), (r"ab|ba", "b"), (r"^a", "b"),
+    (r"a$", ""), (r"\s+", " "), (r"c(?=a)", "ca"), (r"(?<!b)a", "b"), (r"abc", "abc"), (r"a", ""),
+    (r"é+", "e"), (r"cb?", "é"), (r"(b)(c)", r"\2\1"), (r"a\nb", "ab"), (r"\n\n+", "\n\n"), (r"[bé]a", "x"),
+    (r"b{2,}", "b"), (r"x", "a")]
+
+
+def random_string(rng, alphabet=ALPHABET, max_length=3, min_length=1):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(min_length, max_length)))
+
+
+def random_text(rng, max_length=20):
+    return random_string(rng, alphabet=TEXT_ALPHABET, max_length=max_length, min_length=0)
+
+
+def random_op(rng, regex_fraction=0.3):
+    """ A random op, (search_pat, replace_pat, regex_type); often a duplicate or identity op. """
+    kind = rng.random()
+    if kind < regex_fraction:
+        search_pat, replace_pat = rng.choice(REGEX_OPS)
+        return search_pat, replace_pat, "0"
+    search_pat = random_string(rng, min_length=0 if kind < regex_fraction + 0.05 else 1)
+    replace_pat = search_pat if kind > 0.9 else random_string(rng, min_length=0)
+    return search_pat, replace_pat, "1"
+
+
+def random_ops(rng, max_ops=8, regex_fraction=0.3):
+    ops = [random_op(rng, regex_fraction=regex_fraction) for _ in range(rng.randint(1, max_ops))]
+    # Repeat some ops, as when an entry is listed twice:
+    for _ in range(rng.randint(0, 2)):
+        ops.insert(rng.randint(0, len(ops)), rng.choice(ops))
+    return ops
+
+
+def apply_sequentially(ops, text):
+    """ The reference: apply the ops one by one, with `str.replace()` and `re.sub()`. """
+    for search_pat, replace_pat, regex_type in ops:
+        if regex_type == "1":
+            text = text.replace(search_pat, replace_pat)
+        else:
+            text = re.sub(search_pat, replace_pat, text)
+    return text
@@ -0,0 +1,60 @@
+"""
+
+Randomized tests of `bytes_processing.BytesChain`: applying a chain of transformations to UTF-8 bytes
+(fixed-string, single-pass, and regex steps as bytes, see `bytes_regex()`; other steps as str)
+must give the same output as the sequential reference, and as the str chain, encoded.
+
+Run with:
+    $ python -m pytest tts_preprocessor/tests
+
+
+"""
+
+import random
+
+import pytest
+
+from tts_preprocessor import pattern_utils
+from tts_preprocessor.bytes_processing import BytesChain, StrSteps, block_ranges
+from tts_preprocessor.lexicon_processing import Lexicon
+from tts_preprocessor.pattern_utils import CompiledDirective
+from tts_preprocessor.tests.randomized import random_ops, random_text, apply_sequentially
+
+
+@pytest.fixture(autouse=True)
+def multi_replace_min_ops(monkeypatch):
+    monkeypatch.setattr(pattern_utils, 'MULTI_REPLACE_MIN_OPS', 2)
+
+
+def test_bytes_chain_gives_the_same_output_as_sequential():
+    rng = random.Random(7)
+    bytes_steps = 0
+    for _ in range(2000):
+        ops = random_ops(rng, max_ops=12, regex_fraction=0.5)
+        chain = BytesChain([CompiledDirective(ops)])
+        bytes_steps += sum(not isinstance(step, StrSteps) for step in chain.steps)
+        for _ in range(5):
+            text = random_text(rng, max_length=30)
+            assert chain(text.encode('utf-8')) == apply_sequentially(ops, text).encode('utf-8'), (ops, text)
+    assert bytes_steps > 2000
+
+
+def test_bytes_chain_gives_the_same_output_as_str_chain():
+    rng = random.Random(8)
+    local = 0
+    for _ in range(500):
+        transforms = [CompiledDirective(random_ops(rng, max_ops=8, regex_fraction=0.5)) for _ in range(2)]
+        transforms.insert(1, Lexicon([("ab", "é", "1"), ("c", "a b", "1")]))  # Applied as str
+        chain = BytesChain(transforms)
+        local += chain.local
+        for _ in range(5):
+            text = random_text(rng, max_length=30)
+            expected = text
+            for transform in transforms:
+                expected = transform(expected)
+            data = text.encode('utf-8')
+            assert chain(data) == expected.encode('utf-8'), (transforms, text)
+            if chain.local:
+                blocks = [chain(data[start:end]) for start, end in block_ranges(data, blocksize=rng.randint(1, 12))]
+                assert b"".join(blocks) == expected.encode('utf-8'), (transforms, text)
+    assert local > 50
@@ -0,0 +1,55 @@
+"""
+
+Randomized tests of `pattern_utils.CompiledDirective`: single-pass fixed-string replacement
+(`multi_replace`, layered by `layer_fixed_ops()`) and regex fusion (`regex_analysis.fusable_groups()`)
+must give the same output as applying the ops one by one.
+
+`MULTI_REPLACE_MIN_OPS` is lowered, so that the small random directives are replaced in a single pass.
+
+Run with:
+    $ python -m pytest tts_preprocessor/tests
+
+
+"""
+
+import random
+
+import pytest
+
+from tts_preprocessor import pattern_utils
+from tts_preprocessor.pattern_utils import CompiledDirective, FusedRegexOp, MultiFixedStringOp
+from tts_preprocessor.tests.randomized import random_ops, random_text, apply_sequentially
+
+
+@pytest.fixture
+def multi_replace_min_ops(monkeypatch):
+    monkeypatch.setattr(pattern_utils, 'MULTI_REPLACE_MIN_OPS', 2)
+
+
+def check_directives(rng, n_directives, max_ops, regex_fraction, options=None):
+    """ Compare random directives to the sequential reference, returning the types of the compiled steps. """
+    step_types = set()
+    for _ in range(n_directives):
+        ops = random_ops(rng, max_ops=max_ops, regex_fraction=regex_fraction)
+        directive = CompiledDirective(ops, options=options)
+        step_types.update(type(step) for step in directive.steps)
+        for _ in range(5):
+            text = random_text(rng, max_length=30)
+            assert directive(text) == apply_sequentially(ops, text), (ops, text)
+    return step_types
+
+
+def test_multi_replace_gives_the_same_output(multi_replace_min_ops):
+    step_types = check_directives(random.Random(2), n_directives=2000, max_ops=24, regex_fraction=0.05)
+    assert MultiFixedStringOp in step_types
+
+
+def test_fused_regex_gives_the_same_output(multi_replace_min_ops):
+    step_types = check_directives(random.Random(3), n_directives=2000, max_ops=12, regex_fraction=0.8)
+    assert FusedRegexOp in step_types
+
+
+def test_sequential_option_gives_the_same_output(multi_replace_min_ops):
+    step_types = check_directives(random.Random(4), n_directives=500, max_ops=12, regex_fraction=0.5,
+                                  options={'sequential': True})
+    assert FusedRegexOp not in step_types
@@ -0,0 +1,58 @@
+"""
+
+Tests that the options in the first-line config of a patterns file (e.g. `# {lexicon: true}`, `sequential`,
+`local`, `optimize`) take effect in both CLIs, `tts_preprocessor` (`common`) and `tts_v2`.
+
+Run with:
+    $ python -m pytest tts_preprocessor/tests
+
+
+"""
+
+from tts_preprocessor import common
+from tts_preprocessor.lexicon_processing import Lexicon
+from tts_preprocessor.scripts import tts_v2
+
+OPTIONS_PATTERNS = "# {sequential: true, optimize: false, local: false}\na\tb\t1\nb\tb\t1\n"
+LEXICON_PATTERNS = "# {lexicon: true}\nnm\tnanometer\t1\n"
+
+
+def write_patterns(tmp_path, name, content):
+    patternsfile = tmp_path / (name + ".patterns.txt")
+    patternsfile.write_text(content, encoding='utf-8')
+    return str(patternsfile)
+
+
+def compile_with_both_clis(patternsfile):
+    """ Return the transformation compiled for patternsfile by `common` and by `tts_v2`. """
+    common_directives = common.compile_directives(patternsfile, named_directives=None, inputfile="input.txt")
+    tts_v2_directives = tts_v2.get_directive_transforms([patternsfile], inputfile="input.txt")
+    assert len(common_directives) == len(tts_v2_directives) == 1
+    return common_directives[0], tts_v2_directives[0]
+
+
+def test_options_are_used_by_both_clis(tmp_path):
+    patternsfile = write_patterns(tmp_path, "options", OPTIONS_PATTERNS)
+    for directive in compile_with_both_clis(patternsfile):
+        assert directive.options == {'sequential': True, 'optimize': False, 'local': False}
+        assert directive.local is False
+        assert directive.removed == {}  # Not optimized (the identity op is kept)
+        assert directive("abc") == "bbc"
+
+
+def test_lexicon_option_is_used_by_both_clis(tmp_path):
+    patternsfile = write_patterns(tmp_path, "units", LEXICON_PATTERNS)
+    for directive in compile_with_both_clis(patternsfile):
+        assert isinstance(directive, Lexicon)
+        assert directive("5 nm of nmol") == "5 nanometer of nmol"
+
+
+def test_lexicon_file_end_to_end(tmp_path):
+    patternsfile = write_patterns(tmp_path, "units", LEXICON_PATTERNS)
+    inputfile = tmp_path / "input.txt"
+    inputfile.write_text("5 nm of nmol\n", encoding='utf-8')
+    common_out, tts_v2_out = tmp_path / "common.out", tmp_path / "tts_v2.out"
+    assert not common.main([str(inputfile), "--patternsfile", patternsfile, "--outputfnfmt", str(common_out)])
+    assert not tts_v2.main([str(inputfile), "-d", patternsfile, "--outputfnfmt", str(tts_v2_out)])
+    assert common_out.read_text(encoding='utf-8') == "5 nanometer of nmol\n"
+    assert tts_v2_out.read_text(encoding='utf-8') == "5 nanometer of nmol\n"
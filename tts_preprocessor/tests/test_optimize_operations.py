@@ -0,0 +1,38 @@
+"""
+
+Regression tests for `pattern_utils.optimize_operations()`:
+Leaving out the ops found by the optimizer must not change a directive's output, for any input text.
+
+Random directives (over a small alphabet, so ops interact often) are applied to random texts, and compared to
+* the same directive compiled with `optimize: false`, and
+* naive sequential application of the ops (`str.replace()` and `re.sub()`, one op at a time).
+
+Run with:
+    $ python -m pytest tts_preprocessor/tests
+
+
+"""
+
+import random
+
+from tts_preprocessor.pattern_utils import CompiledDirective
+from tts_preprocessor.tests.randomized import random_ops, random_text, apply_sequentially
+
+
+def test_optimized_directive_gives_the_same_output():
+    rng = random.Random(20)
+    for _ in range(2000):
+        ops = random_ops(rng)
+        optimized = CompiledDirective(ops)
+        unoptimized = CompiledDirective(ops, options={'optimize': False})
+        for _ in range(5):
+            text = random_text(rng)
+            expected = apply_sequentially(ops, text)
+            assert unoptimized(text) == expected, (ops, text)
+            assert optimized(text) == expected, (ops, text, optimized.removed)
+
+
+def test_duplicate_and_identity_ops_are_removed():
+    directive = CompiledDirective([("ab", "x", "1"), ("c", "c", "1"), ("ab", "y", "1")])
+    assert set(directive.removed) == {1, 2}
+    assert directive("abc") == "xc"
@@ -0,0 +1,83 @@
+"""
+
+Randomized tests of block-wise and chunk-wise transformation: a directive (or lexicon) that declares itself
+local (see `streaming.is_local()`) must give the same output when applied block by block
+(see `streaming.read_blocks()`), and a chunk-safe one (see `parallel.is_chunk_safe()`) when applied
+chunk by chunk (see `parallel.split_chunks()`), as when applied to the whole text.
+
+Run with:
+    $ python -m pytest tts_preprocessor/tests
+
+
+"""
+
+import io
+import random
+
+import pytest
+
+from tts_preprocessor import pattern_utils
+from tts_preprocessor.lexicon_processing import Lexicon
+from tts_preprocessor.parallel import is_chunk_safe, split_chunks
+from tts_preprocessor.pattern_utils import CompiledDirective
+from tts_preprocessor.streaming import is_local, read_blocks
+from tts_preprocessor.tests.randomized import random_ops
+
+# Document pieces, including paragraph breaks and the other chunk boundaries (see `CHUNK_BOUNDARY_REGEX`):
+PIECES = ["a", "b", "c", "é", "ab", "a b", " ", " ", "\n", "\n", "\n\n", "\n\n\n", "\\section{b}", "<p>"]
+LEXICON_ENTRIES = ["a", "ab", "b", "é", "a b", "b a", "ab c", "c"]
+
+
+@pytest.fixture(autouse=True)
+def multi_replace_min_ops(monkeypatch):
+    monkeypatch.setattr(pattern_utils, 'MULTI_REPLACE_MIN_OPS', 2)
+
+
+def random_document(rng, max_pieces=40):
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(0, max_pieces)))
+
+
+def random_lexicon(rng):
+    entries = rng.sample(LEXICON_ENTRIES, rng.randint(1, len(LEXICON_ENTRIES)))
+    return Lexicon([(entry, "<%s>" % (index,), "1") for index, entry in enumerate(entries)])
+
+
+def random_transforms(rng, n_transforms):
+    """ Random directives and lexicons, with the local and chunk-safe ones counted. """
+    transforms = []
+    for _ in range(n_transforms):
+        if rng.random() < 0.25:
+            transforms.append(random_lexicon(rng))
+        else:
+            transforms.append(CompiledDirective(random_ops(rng, max_ops=10, regex_fraction=0.5)))
+    return transforms
+
+
+def test_local_transforms_give_the_same_output_block_by_block():
+    rng = random.Random(5)
+    local = 0
+    for transform in random_transforms(rng, 2000):
+        if not is_local(transform):
+            continue
+        local += 1
+        for _ in range(5):
+            text = random_document(rng)
+            blocks = list(read_blocks(io.StringIO(text), blocksize=rng.randint(1, 12)))
+            assert "".join(blocks) == text
+            assert "".join(transform(block) for block in blocks) == transform(text), (transform.ops, text, blocks)
+    assert local > 200
+
+
+def test_chunk_safe_transforms_give_the_same_output_chunk_by_chunk():
+    rng = random.Random(6)
+    chunk_safe = 0
+    for transform in random_transforms(rng, 2000):
+        if not is_chunk_safe(transform):
+            continue
+        chunk_safe += 1
+        for _ in range(5):
+            text = random_document(rng)
+            chunks = split_chunks(text, rng.randint(2, 6))
+            assert "".join(chunks) == text
+            assert "".join(transform(chunk) for chunk in chunks) == transform(text), (transform.ops, text, chunks)
+    assert chunk_safe > 200
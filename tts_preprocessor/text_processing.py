@@ -7,10 +7,140 @@ Pre-process text input for TTS.
 E.g. replace "weird" words and abbreviations with pronounceable words.
 Which words are "pronounceable" depends on the specific TTS engine (which may evolve over time).
 
+Segmenting: TTS engines have a maximum text length per request, and synthesize faster (and in parallel)
+when given chunks of similar size. `iter_segments()` splits (transformed) text into segments of at most
+`max_length` characters, cutting at the strongest boundary available:
+* paragraph boundaries (segments never span a blank line),
+* sentence boundaries (".", "!", "?" or "…", followed by whitespace and not a lower-case letter),
+* clause boundaries (",", ";", ":", or a dash between spaces),
+* word boundaries (whitespace), and
+* if a single word is longer than `max_length`, anywhere.
+Within a paragraph, segments are balanced, i.e. a paragraph that needs n segments is split into n segments
+of similar length, rather than n-1 full segments and a short one.
+Whitespace within a segment (e.g. line breaks) is collapsed to single spaces.
+
+The `Segmenter` transformation can be added as the final stage of a transformation chain (see `tts_v2 --segment`);
+it writes one segment per line, with a blank line after each paragraph.
+
 
 """
 
+import re
+
+DEFAULT_MAX_SEGMENT_LENGTH = 1000  # characters
+
+# Paragraph boundaries; the same boundaries as `parallel.CHUNK_BOUNDARY_REGEX` (so Segmenter is chunk-safe):
+PARAGRAPH_BOUNDARY_REGEX = re.compile(r"\n\s*\n|\n(?=\\(?:sub)*section\b|\\chapter\b|<p\b)")
+# Candidate boundaries, strongest first; a segment boundary is placed at the end of the match:
+SENTENCE_BOUNDARY_REGEX = re.compile(r"""[.!?…]+["'”’)\]]*\s+(?![\sa-zß-ÿ])""")
+CLAUSE_BOUNDARY_REGEX = re.compile(r"[,;:]\s+|\s[-–—]+\s+")
+WORD_BOUNDARY_REGEX = re.compile(r"\s+")
+BOUNDARY_REGEXES = (SENTENCE_BOUNDARY_REGEX, CLAUSE_BOUNDARY_REGEX, WORD_BOUNDARY_REGEX)
+
+
+def split_at(text, regex):
+    """ Split text after each match of regex, keeping the matched delimiters (so joining the pieces gives text). """
+    pieces, start = [], 0
+    for match in regex.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def pack(pieces, max_length):
+    """ Pack consecutive pieces into as few, balanced groups of at most max_length characters as possible.
+
+    Pieces longer than max_length are returned as groups of their own (to be split further).
+    """
+    total = sum(len(piece) for piece in pieces)
+    n_groups = -(-total // max_length)  # ceil
+    target = -(-total // n_groups) if n_groups else max_length
+    groups, current = [], ""
+    for piece in pieces:
+        if current and (len(current) >= target or len(current) + len(piece) > max_length):
+            groups.append(current)
+            current = ""
+        current += piece
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _split_segment(text, max_length, level=0):
+    """ Split text into pieces of at most max_length characters (stripped), at the boundaries of BOUNDARY_REGEXES. """
+    text = text.strip()
+    if len(text) <= max_length:
+        yield text
+        return
+    if level == len(BOUNDARY_REGEXES):
+        # No boundaries left, cut anywhere:
+        n_pieces = -(-len(text) // max_length)
+        size = -(-len(text) // n_pieces)
+        for start in range(0, len(text), size):
+            yield text[start:start + size]
+        return
+    for group in pack(split_at(text, BOUNDARY_REGEXES[level]), max_length):
+        yield from _split_segment(group, max_length, level + 1)
+
+
+def iter_paragraph_segments(text, max_length=DEFAULT_MAX_SEGMENT_LENGTH):
+    """ Split text into segments (see module docstring), yielding a list of segments for each paragraph. """
+    if max_length < 1:
+        raise ValueError("max_length must be positive, got %r" % (max_length,))
+    for paragraph in PARAGRAPH_BOUNDARY_REGEX.split(text):
+        paragraph = " ".join(paragraph.split())
+        if paragraph:
+            yield list(_split_segment(paragraph, max_length))
+
+
+def iter_segments(text, max_length=DEFAULT_MAX_SEGMENT_LENGTH):
+    """ Split text into segments of at most max_length characters (see module docstring).
+
+    Args:
+        text: The (transformed) text to split.
+        max_length: The maximum segment length (characters), e.g. the TTS engine's per-request limit.
+
+    Returns:
+        An iterator of segments (non-empty strings, without leading/trailing whitespace).
+    """
+    for segments in iter_paragraph_segments(text, max_length):
+        yield from segments
+
+
+def segment_text(text, max_length=DEFAULT_MAX_SEGMENT_LENGTH):
+    """ Split text into segments of at most max_length characters, returning a list (see `iter_segments()`). """
+    return list(iter_segments(text, max_length))
+
+
+class Segmenter:
+    """ Transformation splitting text into segments (see module docstring), written one segment per line.
+
+    Each paragraph's segments are followed by a blank line, so segmenting chunks split at paragraph boundaries
+    one by one gives the same result as segmenting the whole text, i.e. Segmenter is chunk-safe.
+    It is not local: streaming splits a paragraph longer than the block size at a line break
+    (see `streaming.read_blocks()`), and each piece would then be segmented as a paragraph of its own.
+
+    Args:
+        max_length: The maximum segment length (characters).
+    """
 
+    local = False
+    chunk_safe = True
+    version = 1
 
+    def __init__(self, max_length=DEFAULT_MAX_SEGMENT_LENGTH):
+        if max_length < 1:
+            raise ValueError("max_length must be positive, got %r" % (max_length,))
+        self.max_length = max_length
+        self.name = "segment(%s)" % (max_length,)
+        self.fingerprint = "%s.Segmenter:%s:%s" % (__name__, self.version, max_length)
 
+    def __call__(self, text):
+        return "".join("\n".join(segments) + "\n\n"
+                       for segments in iter_paragraph_segments(text, self.max_length))
 
+    def __repr__(self):
+        return "Segmenter(max_length=%r)" % (self.max_length,)